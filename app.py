@@ -1,63 +1,39 @@
+from datetime import datetime, timedelta, timezone
+
 import streamlit as st
-from database import delete_all_records, initialize_database, save_to_sqlite, load_data_from_sqlite, has_more_records, get_total_pages
-from model_loading import load_model_pipeline
-from preprocessing import correct_slang_words, standardize_text, tokenize_text
-from sentiment_classification import classify_sentiment
-from utils import show_pipeline_steps, show_sentiment_result
+from constant import HISTORY_PAGE_SIZE, ROLLUP_CHART_BUCKETS, SEARCH_MAX_COUNTED_ROWS
+from database import delete_all_records, initialize_database, load_data_from_sqlite, has_more_records, get_total_pages, load_sentiment_rollup
+from model_loading import load_similarity_index, start_classifier_watcher, start_db_writer, start_metrics_recorder, start_model_warmup
+from pipeline import full_pipeline
+from utils import show_pipeline_steps, show_sentiment_result, show_sentiment_trend, show_similar_comments
 
 initialize_database()
-sentiment_pipeline = load_model_pipeline()
-
-# =========================== Full Pipeline ===========================
-def full_pipeline(text: str, sentiment_pipeline):
-    try:
-        # === Bước 1: Tiền xử lý
-
-        # Chuẩn hóa văn bản
-        standardized_text = standardize_text(text)
-
-        # Sửa những từ không dấu, viết tắt, từ lóng
-        corrected_text = correct_slang_words(standardized_text)
-
-        # Tách từ
-        tokenized_text = tokenize_text(corrected_text)
-
-        # === Bước 2: Phân loại cảm xúc
-        sentiment = classify_sentiment(tokenized_text, sentiment_pipeline)
-
-        # === Bước 3: Hợp nhất và xử lý lỗi
-        result = {
-            "text": tokenized_text,
-            "sentiment": sentiment['label'],
-        }
-
-        # Kiểm tra hợp lệ
-        if len(result["text"]) < 5 or len(result["text"]) > 50:
-            return None, None, "Độ dài câu không hợp lệ, vui lòng thử lại (5-50 ký tự)"
-
-        # Lưu kết quả vào database
-        save_to_sqlite(result)
 
-        # Thông tin hiển thị
-        display_result = {
-            "original_text": text,
-            "corrected_text": corrected_text,
-            "tokenized_text": tokenized_text,
-            "sentiment_label": sentiment['label'],
-            "sentiment_score": round(sentiment['score'] * 100, 2),
-        }
-               
-        # Trả về kết quả
-        return result, display_result, None
-
-    except Exception as e:
-        return None, f"Pipeline error: {e}. Please try again."
+# Mô hình được tải và chạy thử trên luồng nền, giao diện hiển thị ngay không cần chờ
+warmup = start_model_warmup()
+# Đổi classifier head khi có phiên bản mới trong model registry, không tải lại PhoBERT
+start_classifier_watcher()
+start_metrics_recorder()
+db_writer = start_db_writer()
+similarity_index = load_similarity_index()
 
 # =========================== UI ===========================
 st.set_page_config(page_title="Vietnamese Sentiment Assistant", layout="wide")
 
 st.markdown("# Nhận diện cảm xúc tiếng Việt")
 
+if warmup.failed:
+    st.error(f"Không thể tải mô hình: {warmup.error}")
+elif not warmup.ready:
+    # Cập nhật tiến độ mỗi giây, tải xong thì chạy lại cả trang để mở khóa nút "Phân tích"
+    @st.fragment(run_every=1)
+    def show_warmup_progress():
+        if warmup.ready or warmup.failed:
+            st.rerun()
+        st.progress(warmup.progress, text=f"Đang khởi động mô hình: {warmup.phase_label}...")
+
+    show_warmup_progress()
+
 if 'pagination_last_id' not in st.session_state:
     st.session_state.pagination_last_id = None
 if 'pagination_history' not in st.session_state:
@@ -82,7 +58,9 @@ with col_1:
         label_visibility="collapsed"
     )
 
-    analyze_button = st.button("Phân tích", type="primary", width="stretch")
+    analyze_button = st.button("Phân tích", type="primary", width="stretch", disabled=not warmup.ready)
+    if warmup.ready and warmup.pipeline.get("classifier_version"):
+        st.caption(f"Phiên bản classifier: {warmup.pipeline['classifier_version']}")
    
     history_header_col1, history_header_col2, history_header_col3 = st.columns([4, 1, 1])
 
@@ -92,7 +70,12 @@ with col_1:
     @st.dialog("Xóa tất cả lịch sử?")
     def confirm_delete_all():
         if st.button("Xác nhận"):
+            # Chờ writer ghi xong các dòng đang chờ trước khi xóa, để không dòng nào được ghi sau lệnh xóa
+            # và lịch sử khớp với embedding store vừa được xóa
+            db_writer.flush()
             delete_all_records()
+            if similarity_index is not None:
+                similarity_index.store.clear()
             reset_pagination()
             st.rerun()
 
@@ -104,12 +87,48 @@ with col_1:
         if st.button("Làm mới", icon="🔄", width="stretch", on_click=reset_pagination):
             pass
 
-    df_history = load_data_from_sqlite(last_id=st.session_state.pagination_last_id)
+    # Tìm kiếm toàn văn (FTS5): gõ không dấu để khớp mọi cách bỏ dấu, "..." để tìm cụm từ, vui* để tìm theo tiền tố
+    search_query = st.text_input(
+        "Tìm kiếm",
+        key="history_search_query",
+        placeholder='Tìm trong lịch sử, ví dụ: sản phẩm, "rất vui", vui*',
+        on_change=reset_pagination,
+        label_visibility="collapsed",
+    )
+
+    filter_col1, filter_col2 = st.columns([1, 2])
+
+    with filter_col1:
+        sentiment_filter = st.selectbox(
+            "Nhãn cảm xúc",
+            ["Tất cả", "POSITIVE", "NEUTRAL", "NEGATIVE"],
+            key="history_sentiment_filter",
+            on_change=reset_pagination,
+        )
+
+    with filter_col2:
+        date_range = st.date_input(
+            "Khoảng thời gian",
+            value=(),
+            key="history_date_range",
+            on_change=reset_pagination,
+        )
+
+    # Bộ lọc dùng chung cho truy vấn trang, kiểm tra trang tiếp theo và tổng số trang
+    history_filters = {
+        "sentiment": None if sentiment_filter == "Tất cả" else sentiment_filter,
+        "start_time": f"{date_range[0]} 00:00:00" if len(date_range) > 0 else None,
+        "end_time": f"{date_range[1]} 23:59:59" if len(date_range) > 1 else None,
+        "query": search_query.strip() or None,
+    }
+
+    df_history = load_data_from_sqlite(last_id=st.session_state.pagination_last_id, page_size=HISTORY_PAGE_SIZE,
+                                       **history_filters)
     
     current_last_id = None
     if not df_history.empty:
         current_last_id = int(df_history.iloc[-1]['id'])
-        st.session_state.pagination_has_more = has_more_records(current_last_id)
+        st.session_state.pagination_has_more = has_more_records(current_last_id, **history_filters)
     else:
         st.session_state.pagination_has_more = False
 
@@ -126,7 +145,7 @@ with col_1:
             st.session_state.pagination_last_id = None
        
     if df_history.empty:
-        st.info("Chưa có lịch sử!")
+        st.info("Không tìm thấy kết quả!" if history_filters["query"] else "Chưa có lịch sử!")
     else:
         df_display = df_history.copy()
         st.dataframe(df_display, 
@@ -148,7 +167,10 @@ with col_1:
             current_page = 1
         else:
             current_page = len(st.session_state.pagination_history) + 2
-        total_pages = get_total_pages()
+        total_pages = get_total_pages(page_size=HISTORY_PAGE_SIZE, **history_filters)
+        # Kết quả tìm kiếm chỉ được đếm đến SEARCH_MAX_COUNTED_ROWS dòng
+        pages_capped = history_filters["query"] is not None and total_pages * HISTORY_PAGE_SIZE >= SEARCH_MAX_COUNTED_ROWS
+        total_pages_label = f"{max(total_pages, current_page)}+" if pages_capped else str(total_pages)
         
         with pagination_col2:
             if st.button("◀ Trước", disabled=is_first_page, use_container_width=True):
@@ -157,7 +179,7 @@ with col_1:
         
         with pagination_col3:
             st.markdown(
-                f"<div style='text-align:center; font-weight:600'>{current_page}/{total_pages}</div>",
+                f"<div style='text-align:center; font-weight:600'>{current_page}/{total_pages_label}</div>",
                 unsafe_allow_html=True,
             )
         
@@ -169,16 +191,37 @@ with col_1:
 with col_2:
     if analyze_button:
             reset_pagination()
-            result, display_result, error = full_pipeline(user_input, sentiment_pipeline)
+            result, display_result, error = full_pipeline(user_input, warmup.scheduler, writer=db_writer, index=similarity_index)
 
             if result and display_result:
                 # Hiển thị kết quả
                 show_sentiment_result(result['sentiment'], display_result['sentiment_score'])
 
                 # Hiển thị chi tiết các bước trong pipeline
-                show_pipeline_steps(display_result['original_text'], display_result['corrected_text'], display_result['tokenized_text'], display_result['sentiment_label'], result)
+                show_pipeline_steps(display_result['original_text'], display_result['corrected_text'], display_result['tokenized_text'], display_result['sentiment_label'], result, display_result['timings'])
+
+                # Hiển thị các bình luận cũ tương tự
+                if "similar" in display_result:
+                    show_similar_comments(display_result["similar"], display_result.get("reused_from"), display_result['timings'])
 
             if error:
                 st.error(f"Lỗi: {error}")
     else:
-        st.info("Vui lòng nhập một câu và nhấn 'Phân tích' để đánh giá cảm xúc.")
\ No newline at end of file
+        st.info("Vui lòng nhập một câu và nhấn 'Phân tích' để đánh giá cảm xúc.")
+
+    st.markdown("#### Thống kê cảm xúc")
+
+    rollup_granularity = st.radio(
+        "Độ chi tiết",
+        list(ROLLUP_CHART_BUCKETS),
+        index=1,
+        format_func={"minute": "Theo phút", "hour": "Theo giờ", "day": "Theo ngày"}.get,
+        horizontal=True,
+        key="rollup_granularity",
+        label_visibility="collapsed",
+    )
+
+    # Chỉ đọc các bucket gần nhất từ bảng rollup (timestamp lưu theo UTC), không quét bảng sentiments
+    rollup_window = timedelta(**{f"{rollup_granularity}s": ROLLUP_CHART_BUCKETS[rollup_granularity] - 1})
+    rollup_start = (datetime.now(timezone.utc) - rollup_window).strftime("%Y-%m-%d %H:%M:%S")
+    show_sentiment_trend(load_sentiment_rollup(rollup_granularity, start_time=rollup_start))
@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import torch
+
+from metrics import BATCH_SIZE, QUEUE_DEPTH, stage_timer
+from sentiment_classification import classify_batch
+
+# Đánh dấu yêu cầu dừng worker
+_STOP = object()
+
+
+class MicroBatchScheduler:
+    """
+    Gom các yêu cầu phân loại từ nhiều phiên Streamlit vào một hàng đợi chung.
+
+    Một worker duy nhất lấy yêu cầu từ hàng đợi và chạy classify_batch khi:
+        - đủ max_batch_size câu, hoặc
+        - câu đầu tiên trong batch đã chờ quá max_wait_ms mili giây.
+    Mỗi người gọi nhận về kết quả của chính mình qua một Future.
+    Vì chỉ có một luồng chạy model nên các phiên không còn tranh nhau CPU thread.
+    """
+
+    def __init__(self, pipeline, max_batch_size: int = 16, max_wait_ms: float = 10, num_threads: int = None):
+        self.pipeline = pipeline
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue()
+        self._closed = False
+        self._lock = threading.Lock()
+        QUEUE_DEPTH.set_function(self.queue_size)
+
+        # Giới hạn số thread của torch cho luồng forward duy nhất
+        if num_threads:
+            torch.set_num_threads(num_threads)
+
+        self._worker = threading.Thread(target=self._run, name="micro-batch-scheduler", daemon=True)
+        self._worker.start()
+
+    def submit(self, text: str) -> Future:
+        """
+        Đưa một câu (đã tiền xử lý) vào hàng đợi, trả về Future chứa {'label', 'score'}.
+
+        Raises:
+            RuntimeError: Scheduler đã đóng (không còn worker nào xử lý yêu cầu mới).
+        """
+        future = Future()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Cannot submit to a closed MicroBatchScheduler")
+            self._queue.put((text, future))
+        return future
+
+    def classify(self, text: str, timeout: float = None) -> dict:
+        """
+        Phân loại một câu qua hàng đợi và chờ kết quả.
+        """
+        return self.submit(text).result(timeout=timeout)
+
+    def update_pipeline(self, pipeline: dict):
+        """
+        Đổi pipeline (ví dụ classifier head mới) mà không dừng worker.
+        Mỗi batch đọc self.pipeline đúng một lần: batch đang chạy hoàn tất với pipeline cũ,
+        các batch sau dùng pipeline mới.
+        """
+        self.pipeline = pipeline
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        # Từ chối yêu cầu mới, dừng worker sau khi xử lý hết các yêu cầu đang chờ
+        with self._lock:
+            if not self._closed:
+                self._closed = True
+                self._queue.put(_STOP)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_wait
+
+            # Gom thêm yêu cầu cho đến khi đủ batch hoặc hết thời gian chờ
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch: list):
+        texts = [text for text, _ in batch]
+        BATCH_SIZE.observe(len(texts))
+        try:
+            with stage_timer("scheduler_batch"):
+                results = classify_batch(texts, self.pipeline, batch_size=self.max_batch_size)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
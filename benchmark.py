@@ -0,0 +1,284 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import torch
+from transformers import AutoModel, AutoTokenizer, PhobertTokenizer, RobertaConfig, RobertaModel
+
+import database
+from constant import CLASSIFIER_HEAD_PATH, CLASSIFIER_PATH, MAX_TOKEN_LENGTH, MODEL_NAME
+from linear_head import LinearHead, load_head
+from preprocessing import _segment, correct_slang_words, standardize_text, tokenize_text
+from sentiment_classification import predict_from_features
+from tokenization import CachedPhobertTokenizer, encode_batch, wrap_tokenizer
+
+STAGES = (
+    "standardize_text",
+    "correct_slang_words",
+    "tokenize_text",
+    "phobert_tokenize",
+    "encoder_forward",
+    "classifier",
+    "save_to_sqlite",
+)
+
+# =========================== Model Setup ===========================
+def load_local_model(model_name: str = MODEL_NAME):
+    """
+    Tải PhoBERT từ cache cục bộ (không truy cập mạng).
+    Trả về None nếu model chưa được cache.
+    """
+    try:
+        model = AutoModel.from_pretrained(model_name, local_files_only=True, add_pooling_layer=False)
+        tokenizer = wrap_tokenizer(AutoTokenizer.from_pretrained(model_name, local_files_only=True, use_fast=False))
+    except OSError:
+        return None
+    return model.eval(), tokenizer
+
+def build_tiny_model(texts: list, workdir: str, hidden_size: int = 768, num_layers: int = 2):
+    """
+    Tạo model RoBERTa trọng số ngẫu nhiên cỡ nhỏ và tokenizer PhoBERT với vocab lấy từ texts,
+    dùng để chạy benchmark khi không có PhoBERT trong cache.
+    """
+    words = Counter(word for text in texts for word in text.split())
+    chars = Counter(char for text in texts for char in text if not char.isspace())
+
+    vocab_file = os.path.join(workdir, "vocab.txt")
+    merges_file = os.path.join(workdir, "bpe.codes")
+    with open(vocab_file, "w", encoding="utf-8") as f:
+        for word, count in words.most_common(2000):
+            f.write(f"{word} {count}\n")
+        for char, count in chars.items():
+            f.write(f"{char} {count}\n{char}@@ {count}\n")
+    with open(merges_file, "w", encoding="utf-8") as f:
+        f.write("")
+
+    tokenizer = wrap_tokenizer(PhobertTokenizer(vocab_file, merges_file))
+    config = RobertaConfig(
+        vocab_size=len(tokenizer),
+        hidden_size=hidden_size,
+        num_hidden_layers=num_layers,
+        num_attention_heads=12,
+        intermediate_size=hidden_size * 2,
+        max_position_embeddings=258,
+        pad_token_id=tokenizer.pad_token_id,
+        bos_token_id=tokenizer.bos_token_id,
+        eos_token_id=tokenizer.eos_token_id,
+        type_vocab_size=1,
+    )
+    torch.manual_seed(0)
+    model = RobertaModel(config, add_pooling_layer=False).eval()
+    return model, tokenizer
+
+def random_head(hidden_size: int, n_classes: int = 3) -> LinearHead:
+    # Head ngẫu nhiên cùng cấu trúc one-vs-one với SVC khi không có classifier phù hợp
+    rng = np.random.default_rng(0)
+    pairs = [(i, j) for i in range(n_classes) for j in range(i + 1, n_classes)]
+    return LinearHead(
+        rng.normal(0, 0.05, (len(pairs), hidden_size)), np.zeros(len(pairs)),
+        np.full(len(pairs), -3.0), np.zeros(len(pairs)), np.arange(n_classes), pairs,
+    )
+
+# =========================== Inputs ===========================
+def synthetic_texts(vocabulary: list, n_words: int, count: int, seed: int = 0) -> list:
+    # Câu tổng hợp có đúng n_words từ, lấy ngẫu nhiên từ vocabulary của dataset
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(vocabulary) for _ in range(n_words)) for _ in range(count)]
+
+def build_datasets(csv_path: str, synthetic_lengths: list, synthetic_count: int) -> dict:
+    raw = pd.read_csv(csv_path)["text"].astype(str).tolist()
+    vocabulary = sorted({word for text in raw for word in standardize_text(text).split()})
+    datasets = {"csv": raw}
+    for n_words in synthetic_lengths:
+        datasets[f"synthetic_{n_words}w"] = synthetic_texts(vocabulary, n_words, synthetic_count, seed=n_words)
+    return datasets
+
+# =========================== Measurement ===========================
+def summarize(latencies: list, items: int) -> dict:
+    latencies_ms = np.asarray(latencies) * 1000
+    total = float(np.sum(latencies))
+    return {
+        "calls": len(latencies),
+        "items": items,
+        "p50_ms": float(np.percentile(latencies_ms, 50)),
+        "p95_ms": float(np.percentile(latencies_ms, 95)),
+        "p99_ms": float(np.percentile(latencies_ms, 99)),
+        "mean_ms": float(np.mean(latencies_ms)),
+        "throughput_per_s": items / total if total > 0 else None,
+    }
+
+def run_stages(texts: list, model, tokenizer, classifier, batch_size: int, max_len: int = MAX_TOKEN_LENGTH) -> dict:
+    """
+    Chạy toàn bộ pipeline theo batch và đo thời gian từng bước cho mỗi batch.
+
+    Returns:
+        dict: {tên bước: danh sách thời gian (giây) của từng batch}
+    """
+    latencies = {stage: [] for stage in STAGES}
+
+    def timed(stage, fn, *args, **kwargs):
+        start = time.perf_counter()
+        output = fn(*args, **kwargs)
+        latencies[stage].append(time.perf_counter() - start)
+        return output
+
+    for start in range(0, len(texts), batch_size):
+        batch = texts[start:start + batch_size]
+
+        standardized = timed("standardize_text", lambda: [standardize_text(t) for t in batch])
+        corrected = timed("correct_slang_words", lambda: [correct_slang_words(t) for t in standardized])
+        tokenized = timed("tokenize_text", lambda: [tokenize_text(t) for t in corrected])
+
+        encoded = timed("phobert_tokenize", encode_batch, tokenizer, tokenized, max_len)
+        with torch.no_grad():
+            outputs = timed("encoder_forward", model, input_ids=encoded["input_ids"], attention_mask=encoded["attention_mask"])
+        features = outputs[0][:, 0, :].cpu().numpy()
+
+        results = timed("classifier", predict_from_features, features, classifier)
+        for text, result in zip(tokenized, results):
+            timed("save_to_sqlite", database.save_to_sqlite, {"text": text, "sentiment": result["label"]})
+
+    return latencies
+
+def run_benchmark(csv_path: str = "data_sentiment_vn.csv", batch_sizes=(1, 8, 32), synthetic_lengths=(5, 20, 60),
+                  synthetic_count: int = 128, warmup: int = 2, force_tiny: bool = False, num_threads: int = None) -> dict:
+    """
+    Chạy benchmark cho mọi tổ hợp (dataset, batch size) và trả về báo cáo dạng dict (ghi được ra JSON).
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+
+    datasets = build_datasets(csv_path, list(synthetic_lengths), synthetic_count)
+    workdir = tempfile.mkdtemp(prefix="vnsaa-bench-")
+    db_name = database.DB_NAME
+    try:
+        # Ghi kết quả vào database tạm để không làm bẩn lịch sử thật
+        database.close_connection()
+        database.DB_NAME = os.path.join(workdir, "bench.db")
+        database.initialize_database()
+
+        loaded = None if force_tiny else load_local_model()
+        if loaded is not None:
+            model, tokenizer = loaded
+            model_source = MODEL_NAME
+            classifier = load_head(CLASSIFIER_PATH, CLASSIFIER_HEAD_PATH)
+        else:
+            # Không có PhoBERT trong cache: model nhỏ trọng số ngẫu nhiên (đủ để so sánh giữa các lần chạy)
+            corpus = [tokenize_text(correct_slang_words(standardize_text(t))) for t in datasets["csv"]]
+            model, tokenizer = build_tiny_model(corpus, workdir)
+            model_source = "tiny-random"
+            if os.path.exists(CLASSIFIER_HEAD_PATH):
+                classifier = LinearHead.load(CLASSIFIER_HEAD_PATH)
+            else:
+                classifier = random_head(model.config.hidden_size)
+
+        report = {
+            "meta": {
+                "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "model": model_source,
+                "python": platform.python_version(),
+                "torch": torch.__version__,
+                "torch_threads": torch.get_num_threads(),
+                "platform": platform.platform(),
+                "cpu_count": os.cpu_count(),
+            },
+            "results": [],
+        }
+
+        for dataset_name, texts in datasets.items():
+            for batch_size in batch_sizes:
+                # Làm nóng model, sau đó xóa cache tách từ để đo đúng chi phí underthesea
+                run_stages(texts[:batch_size * warmup], model, tokenizer, classifier, batch_size)
+                _segment.cache_clear()
+                if isinstance(tokenizer, CachedPhobertTokenizer):
+                    tokenizer.clear_cache()
+
+                latencies = run_stages(texts, model, tokenizer, classifier, batch_size)
+                for stage in STAGES:
+                    items = len(texts)
+                    entry = {"dataset": dataset_name, "batch_size": batch_size, "stage": stage}
+                    entry.update(summarize(latencies[stage], items))
+                    report["results"].append(entry)
+                print(f"> {dataset_name} batch={batch_size}: done")
+
+        return report
+    finally:
+        # Đóng database tạm, trả lại đường dẫn database thật rồi xóa thư mục tạm (database, model nhỏ)
+        database.close_connection()
+        database.DB_NAME = db_name
+        shutil.rmtree(workdir, ignore_errors=True)
+
+# =========================== Comparison ===========================
+def compare_reports(baseline: dict, current: dict, metric: str = "p50_ms", tolerance: float = 0.20) -> list:
+    """
+    So sánh hai báo cáo, trả về danh sách (dataset, batch_size, stage, giá trị cũ, giá trị mới, tỷ lệ)
+    của các bước chậm đi quá tolerance.
+    """
+    key = lambda r: (r["dataset"], r["batch_size"], r["stage"])
+    old = {key(r): r for r in baseline["results"]}
+    regressions = []
+    for result in current["results"]:
+        previous = old.get(key(result))
+        if previous is None or not previous[metric]:
+            continue
+        ratio = result[metric] / previous[metric]
+        if ratio > 1 + tolerance:
+            regressions.append((*key(result), previous[metric], result[metric], ratio))
+    return regressions
+
+def print_report(report: dict):
+    print(f"> Model: {report['meta']['model']} | torch threads: {report['meta']['torch_threads']}")
+    print(f"  {'dataset':<16}{'batch':>6}  {'stage':<20}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'items/s':>12}")
+    for r in report["results"]:
+        throughput = f"{r['throughput_per_s']:.1f}" if r["throughput_per_s"] else "-"
+        print(f"  {r['dataset']:<16}{r['batch_size']:>6}  {r['stage']:<20}{r['p50_ms']:>10.3f}{r['p95_ms']:>10.3f}{r['p99_ms']:>10.3f}{throughput:>12}")
+
+# =========================== Main ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage latency/throughput benchmark of the sentiment pipeline.")
+    parser.add_argument("--csv", default="data_sentiment_vn.csv")
+    parser.add_argument("--batch-sizes", default="1,8,32", help="Comma-separated batch sizes (default: 1,8,32)")
+    parser.add_argument("--lengths", default="5,20,60", help="Comma-separated synthetic sentence lengths in words")
+    parser.add_argument("--synthetic-count", type=int, default=128, help="Synthetic sentences per length")
+    parser.add_argument("--threads", type=int, help="torch intra-op threads")
+    parser.add_argument("--tiny", action="store_true", help="Always use the tiny random-weight model")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON report")
+    parser.add_argument("--compare", help="Baseline JSON report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.20, help="Allowed p50 slowdown before flagging (default: 0.20)")
+    args = parser.parse_args()
+
+    report = run_benchmark(
+        csv_path=args.csv,
+        batch_sizes=[int(b) for b in args.batch_sizes.split(",")],
+        synthetic_lengths=[int(n) for n in args.lengths.split(",")],
+        synthetic_count=args.synthetic_count,
+        force_tiny=args.tiny,
+        num_threads=args.threads,
+    )
+    print_report(report)
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"> Saved report to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare_reports(baseline, report, tolerance=args.tolerance)
+        for dataset, batch_size, stage, old, new, ratio in regressions:
+            print(f"! Regression {dataset} batch={batch_size} {stage}: {old:.3f} ms -> {new:.3f} ms (x{ratio:.2f})")
+        if regressions:
+            sys.exit(1)
+        print("> No regressions")
+
+if __name__ == "__main__":
+    main()
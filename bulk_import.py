@@ -0,0 +1,210 @@
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from constant import MODEL_BACKEND
+from database import clear_import_checkpoint, initialize_database, load_import_checkpoint, save_import_chunk
+from model_loading import build_model_pipeline
+from preprocessing import preprocess_batch
+from sentiment_classification import classify_batch
+from sharded_inference import ShardedInferenceEngine
+
+# =========================== Input Readers ===========================
+def iter_csv_chunks(path: str, text_column: str, chunk_size: int, position: int = 0):
+    """
+    Đọc file CSV theo từng khối bắt đầu từ byte offset `position` (0: ngay sau dòng tiêu đề),
+    nên tiếp tục từ checkpoint chỉ cần seek, bộ nhớ không tăng theo vị trí checkpoint.
+    Mỗi lần trả về (danh sách văn bản, byte offset tiếp tục sau khối).
+    """
+    with open(path, "rb") as f:
+        columns = next(csv.reader([f.readline().decode("utf-8-sig")]))
+        if text_column not in columns:
+            raise ValueError(f"Column '{text_column}' not found in {path}")
+        index = columns.index(text_column)
+        position = max(position, f.tell())
+        f.seek(position)
+
+        def parse(records):
+            return [row[index] if index < len(row) else "" for row in csv.reader(records)]
+
+        record, records = b"", []
+        for line in iter(f.readline, b""):
+            record += line
+            # Số dấu ngoặc kép lẻ: trường trong ngoặc có xuống dòng, bản ghi chưa kết thúc
+            if record.count(b'"') % 2:
+                continue
+            position += len(record)
+            if record.strip():
+                records.append(record.decode("utf-8"))
+            record = b""
+            if len(records) >= chunk_size:
+                yield parse(records), position
+                records = []
+        if records:
+            yield parse(records), position
+
+def iter_jsonl_chunks(path: str, text_column: str, chunk_size: int, position: int = 0):
+    """
+    Đọc file JSONL theo từng khối bắt đầu từ byte offset `position`.
+    Mỗi lần trả về (danh sách văn bản, byte offset tiếp tục sau khối).
+    """
+    with open(path, "rb") as f:
+        f.seek(position)
+        texts = []
+        for line in iter(f.readline, b""):
+            position += len(line)
+            line = line.strip()
+            if line:
+                texts.append(str(json.loads(line).get(text_column) or ""))
+            if len(texts) >= chunk_size:
+                yield texts, position
+                texts = []
+        if texts:
+            yield texts, position
+
+def detect_format(path: str) -> str:
+    return "jsonl" if path.lower().endswith((".jsonl", ".ndjson")) else "csv"
+
+# =========================== Streaming Pipeline ===========================
+def preprocess_texts(texts: list, executor=None) -> list:
+    # standardize → sửa từ lóng → tách từ, bỏ qua câu rỗng
+    texts = [text for text in texts if text.strip()]
+    tokenized, _ = preprocess_batch(texts, workers=1, executor=executor)
+    return tokenized
+
+def bulk_import(path: str, pipeline, fmt: str = None, text_column: str = "text",
+                chunk_size: int = 1000, batch_size: int = 32, restart: bool = False, workers: int = 1,
+                engine=None) -> int:
+    """
+    Chấm điểm cảm xúc cho toàn bộ file đầu vào và ghi vào bảng sentiments.
+
+    Mỗi khối được ghi bằng executemany trong một transaction, cùng với checkpoint,
+    nên khi bị dừng giữa chừng lần chạy sau sẽ tiếp tục từ khối chưa ghi.
+    Nếu có engine (ShardedInferenceEngine), mỗi khối được chia cho các process của engine.
+
+    Returns:
+        int: Tổng số dòng đã import từ file (tính cả các lần chạy trước).
+    """
+    source = os.path.abspath(path)
+    fmt = fmt or detect_format(path)
+    if restart:
+        clear_import_checkpoint(source)
+
+    position, rows_imported = load_import_checkpoint(source)
+    if position:
+        print(f"> Resuming {source} from position {position} ({rows_imported} rows already imported)")
+
+    # Không dùng cache kết quả cho dữ liệu import hàng loạt để bảng cache không phình to
+    pipeline = dict(pipeline, cache=None)
+
+    # Tiền xử lý song song trên process pool dùng chung cho mọi khối
+    executor = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    reader = iter_jsonl_chunks if fmt == "jsonl" else iter_csv_chunks
+    start_time = time.time()
+    try:
+        for texts, position in reader(path, text_column, chunk_size, position):
+            tokenized = preprocess_texts(texts, executor)
+            if engine is not None:
+                results = list(engine.map(tokenized, chunk_size=batch_size))
+            else:
+                results = classify_batch(tokenized, pipeline, batch_size=batch_size)
+            rows = [(text, result["label"]) for text, result in zip(tokenized, results)]
+
+            rows_imported += len(rows)
+            save_import_chunk(rows, source, position, rows_imported)
+
+            elapsed = time.time() - start_time
+            print(f"> Imported {rows_imported} rows (position {position}, {elapsed:.1f}s)")
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    return rows_imported
+
+# =========================== Resume Check ===========================
+def check_resume(rows: int = 3_000_000, chunk_size: int = 1000, resume_fraction: float = 0.9) -> dict:
+    """
+    Tạo file CSV `rows` dòng (có trường trong ngoặc chứa dấu phẩy, ngoặc kép, xuống dòng),
+    tiếp tục đọc từ checkpoint ở khoảng `resume_fraction` file và so với lần đọc liền một mạch.
+
+    Returns:
+        dict: Số dòng, byte offset tiếp tục, số dòng sai lệch và bộ nhớ đỉnh (MB) khi tiếp tục.
+    """
+    import tempfile
+    import tracemalloc
+
+    samples = ["sản phẩm tốt", 'giao hàng "nhanh", đóng gói kỹ', "dòng một\ndòng hai", ""]
+    with tempfile.TemporaryDirectory(prefix="vnsaa-import-") as workdir:
+        path = os.path.join(workdir, "resume.csv")
+        with open(path, "w", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f, lineterminator="\n")
+            writer.writerow(["id", "text"])
+            writer.writerows((i, f"{samples[i % len(samples)]} {i}") for i in range(rows))
+
+        # Checkpoint sau khối chứa dòng thứ resume_fraction * rows
+        resume_row = int(rows * resume_fraction) // chunk_size * chunk_size
+        expected, position = [], 0
+        for texts, end in iter_csv_chunks(path, "text", chunk_size):
+            if len(expected) < resume_row:
+                position = end
+            expected.extend(texts)
+
+        # So sánh ngay từng khối để bộ nhớ đỉnh chỉ gồm bộ đọc và một khối
+        tracemalloc.start()
+        mismatches, row = 0, resume_row
+        for texts, _ in iter_csv_chunks(path, "text", chunk_size, position):
+            mismatches += sum(text != expected[row + i] if row + i < len(expected) else 1 for i, text in enumerate(texts))
+            row += len(texts)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        mismatches += len(expected) - row if row < len(expected) else 0
+
+    return {"rows": rows, "resume_row": resume_row, "position": position, "mismatches": mismatches,
+            "peak_mb": peak / 2**20}
+
+# =========================== Main ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Bulk score a CSV/JSONL file into the sentiments history table.")
+    parser.add_argument("input", nargs="?", help="Path to a .csv or .jsonl file")
+    parser.add_argument("--format", choices=["csv", "jsonl"], help="Input format (default: from file extension)")
+    parser.add_argument("--text-column", default="text", help="Column/key holding the raw text (default: text)")
+    parser.add_argument("--chunk-size", type=int, default=1000, help="Rows per chunk/transaction (default: 1000)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Sentences per PhoBERT forward pass (default: 32)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes used for text preprocessing (default: 1)")
+    parser.add_argument("--processes", type=int, default=1, help="Model replicas in separate processes (default: 1)")
+    parser.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and start from the beginning")
+    parser.add_argument("--check-resume", type=int, metavar="ROWS",
+                        help="Check resuming a synthetic CSV of ROWS rows from a late checkpoint, then exit")
+    args = parser.parse_args()
+
+    if args.check_resume:
+        report = check_resume(args.check_resume, args.chunk_size)
+        print(f"> Resumed {report['rows']} rows at row {report['resume_row']} (byte {report['position']}): "
+              f"{report['mismatches']} mismatches, peak {report['peak_mb']:.1f} MB")
+        if report["mismatches"]:
+            raise SystemExit(1)
+        return
+    if args.input is None:
+        parser.error("the following arguments are required: input")
+
+    initialize_database()
+    # Pipeline riêng không có cache kết quả và embedding: job hàng loạt không cần resource của app
+    pipeline = build_model_pipeline(MODEL_BACKEND, use_cache=False)
+
+    # Nhiều replica: fork từ pipeline vừa tải, mỗi process một thread
+    engine = ShardedInferenceEngine(args.processes, pipeline=pipeline, batch_size=args.batch_size) if args.processes > 1 else None
+    try:
+        total = bulk_import(args.input, pipeline, fmt=args.format, text_column=args.text_column,
+                            chunk_size=args.chunk_size, batch_size=args.batch_size, restart=args.restart,
+                            workers=args.workers, engine=engine)
+    finally:
+        if engine is not None:
+            engine.close()
+    print(f"> Done. {total} rows imported from {args.input}")
+
+if __name__ == "__main__":
+    main()
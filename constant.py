@@ -1,5 +1,113 @@
 DB_NAME = "sentiment_data.db"
 
+# Kích thước page cache của mỗi kết nối SQLite (KB)
+DB_CACHE_SIZE_KB = 20000
+
+# Ghi lịch sử theo nhóm trên luồng nền: số dòng tối đa mỗi transaction, thời gian chờ tối đa (ms)
+# và số dòng tối đa trong hàng đợi (đầy thì ghi đồng bộ)
+DB_WRITER_MAX_BATCH_ROWS = 256
+DB_WRITER_MAX_DELAY_MS = 50
+DB_WRITER_QUEUE_SIZE = 10000
+
+MODEL_NAME = "vinai/phobert-base-v2"
+
+CLASSIFIER_PATH = "svm_phobert_sentiment.pkl"
+
+# Đầu phân loại tuyến tính NumPy export từ CLASSIFIER_PATH (coef, intercept, tham số Platt)
+CLASSIFIER_HEAD_PATH = "svm_phobert_head.npz"
+
+# Registry các phiên bản classifier head (model_registry.py); nếu có phiên bản đang dùng thì được ưu tiên
+# hơn CLASSIFIER_HEAD_PATH. App/service kiểm tra mỗi MODEL_REGISTRY_POLL_SECONDS giây và đổi head
+# ngay khi đang chạy (0 = không theo dõi)
+MODEL_REGISTRY_DIR = "model_registry"
+MODEL_REGISTRY_POLL_SECONDS = 5
+
+# Cập nhật classifier tăng dần (incremental_training.py): file trạng thái các learner SGD, tỉ lệ dòng mới
+# giữ lại để đánh giá và hiệu chỉnh xác suất, số dòng tối đa của kho replay và kho hiệu chỉnh
+INCREMENTAL_STATE_PATH = "incremental_head_state.pkl"
+INCREMENTAL_HOLDOUT_FRACTION = 0.2
+INCREMENTAL_REPLAY_ROWS = 20000
+INCREMENTAL_CALIBRATION_ROWS = 5000
+
+# Số token tối đa mỗi câu (tính cả <s>, </s>), dùng chung cho training và suy luận
+MAX_TOKEN_LENGTH = 100
+
+# Early exit: head phân loại trên [CLS] của các layer giữa (train bằng early_exit.py).
+# Mỗi câu dừng ở layer đầu tiên có độ tin cậy >= EARLY_EXIT_THRESHOLD (None = tắt, luôn chạy đủ encoder)
+EARLY_EXIT_HEADS_PATH = "early_exit_heads.npz"
+EARLY_EXIT_LAYERS = (3, 6, 9)
+EARLY_EXIT_THRESHOLD = None
+
+# Backend chạy encoder: "torch" (fp32), "int8" (lượng tử hóa động) hoặc "onnx" (onnxruntime)
+MODEL_BACKEND = "torch"
+
+ONNX_MODEL_PATH = "phobert_encoder.onnx"
+
+# Thư mục chứa bản sao cục bộ (safetensors + tokenizer) của model, đọc bằng mmap và không cần gọi Hugging Face Hub
+MODEL_SNAPSHOT_DIR = "model_snapshots"
+
+# Thư mục lưu embedding [CLS] đã tính khi training (memmap theo model + max_len)
+EMBEDDING_CACHE_DIR = "embedding_cache"
+
+# Số kết quả tối đa giữ trong LRU cache trong bộ nhớ
+RESULT_CACHE_SIZE = 10000
+
+# Kết quả cache của một model_version chỉ bị xóa khi không tiến trình nào dùng phiên bản đó trong số ngày này
+RESULT_CACHE_RETENTION_DAYS = 7
+
+# Số câu tối đa được ghi nhớ kết quả tách từ (underthesea)
+TOKENIZE_CACHE_SIZE = 50000
+
+# Số từ tối đa được ghi nhớ token ID (kết quả BPE) khi tokenize cho PhoBERT (0 = dùng tokenizer gốc cho từng câu)
+PHOBERT_WORD_CACHE_SIZE = 100000
+
+# Micro-batching: số câu tối đa mỗi batch và thời gian chờ tối đa (ms) trước khi chạy model
+SCHEDULER_MAX_BATCH_SIZE = 16
+SCHEDULER_MAX_WAIT_MS = 10
+
+# Dịch vụ HTTP (service.py): số luồng xử lý, số yêu cầu tối đa đang chờ/chạy trước khi trả 503,
+# thời gian chờ tối đa mỗi yêu cầu (giây) và số câu tối đa mỗi yêu cầu batch
+SERVICE_WORKERS = 4
+SERVICE_MAX_PENDING = 64
+SERVICE_TIMEOUT_SECONDS = 10
+SERVICE_MAX_BATCH_TEXTS = 256
+
+# Export lịch sử (export_history.py): số dòng mỗi lần fetchmany, cũng là số dòng mỗi row group Parquet,
+# và thuật toán nén của file Parquet
+EXPORT_CHUNK_ROWS = 65536
+EXPORT_PARQUET_COMPRESSION = "zstd"
+
+# Ghi định kỳ giá trị metric vào bảng metrics_history (0 = tắt) và thời gian giữ lại (giờ)
+METRICS_HISTORY_INTERVAL_SECONDS = 0
+METRICS_HISTORY_RETENTION_HOURS = 24
+
+# Số dòng lịch sử hiển thị trên mỗi trang
+HISTORY_PAGE_SIZE = 50
+
+# Tìm kiếm lịch sử: chỉ đếm tối đa số kết quả này khi tính tổng số trang (hiển thị "N+" nếu vượt)
+SEARCH_MAX_COUNTED_ROWS = 10000
+
+# Số bucket gần nhất hiển thị trên biểu đồ thống kê theo từng độ chi tiết (đọc từ bảng rollup)
+ROLLUP_CHART_BUCKETS = {"minute": 60, "hour": 48, "day": 30}
+
+# Lưu embedding [CLS] (float16, memmap, căn theo sentiments.id) của mỗi câu đã phân tích
+# để tìm các bình luận cũ tương tự (embedding_store.py)
+EMBEDDING_STORE_ENABLED = True
+EMBEDDING_STORE_DIR = "embedding_store"
+
+# Số bình luận tương tự hiển thị, số dòng mỗi khối khi duyệt toàn bộ
+# và số cụm IVF được duyệt mỗi truy vấn (chỉ khi đã build IVF)
+SIMILAR_TOP_K = 5
+SIMILARITY_BLOCK_ROWS = 65536
+IVF_NPROBE = 8
+
+# Khi xử lý request chỉ duyệt toàn bộ nếu store có tối đa số embedding này (vài chục ms);
+# lịch sử lớn hơn chỉ được tra qua IVF (python embedding_store.py build-ivf), chưa có IVF thì bỏ qua
+SIMILAR_MAX_EXACT_ROWS = 20000
+
+# Dùng lại nhãn của bình luận cũ gần nhất nếu cosine similarity >= ngưỡng này (None = tắt)
+NEIGHBOR_LABEL_THRESHOLD = None
+
 MAX_SENTENCE_LENGTH = 50
 
 CORRECTION_DICT = {
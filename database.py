@@ -1,126 +1,846 @@
+import re
 import sqlite3
+import threading
+import time
+import unicodedata
+import numpy as np
 import streamlit as st
 import pandas as pd
 
-from constant import DB_NAME
+from constant import DB_CACHE_SIZE_KB, DB_NAME, HISTORY_PAGE_SIZE, SEARCH_MAX_COUNTED_ROWS
+from metrics import DB_WRITE_SECONDS
+
+# =========================== Connection Management ===========================
+# One connection per thread, reused across calls. sqlite3 keeps a per-connection
+# cache of prepared statements, so the SQL strings below are defined once and
+# reused verbatim to hit that cache.
+_local = threading.local()
+
+INSERT_SENTIMENT_SQL = "INSERT INTO sentiments (text, sentiment) VALUES (?, ?)"
+COUNT_ALL_SQL = "SELECT COALESCE(SUM(row_count), 0) FROM sentiment_counts"
+COUNT_BY_SENTIMENT_SQL = "SELECT COALESCE(SUM(row_count), 0) FROM sentiment_counts WHERE sentiment = ?"
+FIRST_ID_FROM_SQL = "SELECT id FROM sentiments WHERE timestamp >= ? ORDER BY timestamp, id LIMIT 1"
+LAST_ID_UNTIL_SQL = "SELECT id FROM sentiments WHERE timestamp <= ? ORDER BY timestamp DESC, id DESC LIMIT 1"
+DELETE_ALL_SQL = "DELETE FROM sentiments"
+UPSERT_CACHE_SQL = "INSERT OR REPLACE INTO sentiment_cache (text, sentiment, score, model_version, embedding) VALUES (?, ?, ?, ?, ?)"
+TOUCH_CACHE_VERSION_SQL = "INSERT OR REPLACE INTO sentiment_cache_versions (model_version, last_used_at) VALUES (?, CURRENT_TIMESTAMP)"
+RETIRED_CACHE_VERSIONS_SQL = "SELECT model_version FROM sentiment_cache_versions WHERE last_used_at < datetime('now', ?) AND model_version != ?"
+DELETE_CACHE_VERSION_ROWS_SQL = "DELETE FROM sentiment_cache WHERE model_version = ?"
+DELETE_CACHE_VERSION_SQL = "DELETE FROM sentiment_cache_versions WHERE model_version = ?"
+UPSERT_CHECKPOINT_SQL = "INSERT OR REPLACE INTO import_checkpoints (source, position, rows_imported, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)"
+SELECT_CHECKPOINT_SQL = "SELECT position, rows_imported FROM import_checkpoints WHERE source = ?"
+DELETE_CHECKPOINT_SQL = "DELETE FROM import_checkpoints WHERE source = ?"
+LAST_INSERT_ID_SQL = "SELECT last_insert_rowid()"
+SELECT_ROWS_AFTER_SQL = "SELECT id, text, sentiment FROM sentiments WHERE id > ? ORDER BY id LIMIT ?"
+SELECT_EXPORT_ROWS_SQL = "SELECT id, text, sentiment, timestamp FROM sentiments WHERE id > ? AND id <= ? ORDER BY id"
+MAX_ID_SQL = "SELECT COALESCE(MAX(id), 0) FROM sentiments"
+UPSERT_EXPORT_CHECKPOINT_SQL = "INSERT OR REPLACE INTO export_checkpoints (name, last_id, rows_exported, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)"
+SELECT_EXPORT_CHECKPOINT_SQL = "SELECT last_id, rows_exported FROM export_checkpoints WHERE name = ?"
+DELETE_EXPORT_CHECKPOINT_SQL = "DELETE FROM export_checkpoints WHERE name = ?"
+UPDATE_SENTIMENT_SQL = "UPDATE sentiments SET sentiment = ? WHERE id = ?"
+INSERT_METRIC_SQL = "INSERT INTO metrics_history (timestamp, name, labels, value) VALUES (?, ?, ?, ?)"
+PRUNE_METRICS_SQL = "DELETE FROM metrics_history WHERE timestamp < ?"
+
+# Rollup granularity -> strftime format of the bucket start (timestamps are UTC, 'YYYY-MM-DD HH:MM:SS')
+ROLLUP_BUCKET_FORMATS = {
+    "minute": "%Y-%m-%d %H:%M:00",
+    "hour": "%Y-%m-%d %H:00:00",
+    "day": "%Y-%m-%d 00:00:00",
+}
+# Full-text index over sentiments.text (external content, no second copy of the text).
+# unicode61 folds tone marks and accents; "đ" is a separate letter, so it is folded to "d"
+# before indexing. "_" is a separator: "sản_phẩm" is indexed as the adjacent tokens sản, phẩm.
+FTS_TOKENIZER = "unicode61 remove_diacritics 2"
+FTS_FOLD_SQL = "replace(replace({column}, 'đ', 'd'), 'Đ', 'D')"
+SEARCH_SOURCE_SQL = "sentiments_fts JOIN sentiments ON sentiments.id = sentiments_fts.rowid"
+
+SELECT_ROLLUP_SQL = {
+    granularity: f"SELECT bucket, sentiment, row_count FROM sentiment_rollup_{granularity} "
+                 f"WHERE bucket >= strftime('{fmt}', ?) AND bucket <= ? AND row_count > 0 ORDER BY bucket"
+    for granularity, fmt in ROLLUP_BUCKET_FORMATS.items()
+}
+
+def get_connection() -> sqlite3.Connection:
+    """
+    Get the SQLite connection of the current thread, opening and tuning it on first use.
+
+    Returns:
+        Connection in WAL mode with synchronous=NORMAL and an enlarged page cache
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(DB_NAME, timeout=30, cached_statements=256)
+        # WAL lets readers proceed while another session is writing
+        conn.execute("PRAGMA journal_mode=WAL")
+        # In WAL mode NORMAL only syncs at checkpoints and is still corruption-safe
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA cache_size=-{DB_CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
+    return conn
+
+def close_connection():
+    """
+    Close the connection of the current thread, if any.
+    """
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
 # =========================== Database Initialization ===========================
 def initialize_database():
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS sentiments (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        text TEXT NOT NULL,
-        sentiment TEXT NOT NULL,
-        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+    conn = get_connection()
+    with conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sentiments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            text TEXT NOT NULL,
+            sentiment TEXT NOT NULL,
+            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        # Keyed on (text, model_version) so processes running different model versions
+        # (backends, early exit, registry versions) share the table without evicting each other
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sentiment_cache (
+            text TEXT NOT NULL,
+            sentiment TEXT NOT NULL,
+            score REAL NOT NULL,
+            model_version TEXT NOT NULL,
+            embedding BLOB,
+            PRIMARY KEY (text, model_version)
+        )
+        """)
+        # Databases created before embeddings were cached
+        cache_columns = {row[1]: row for row in conn.execute("PRAGMA table_info(sentiment_cache)")}
+        if "embedding" not in cache_columns:
+            conn.execute("ALTER TABLE sentiment_cache ADD COLUMN embedding BLOB")
+        # Databases created when the cache was keyed on text alone
+        if not cache_columns["model_version"][5]:
+            _migrate_cache_primary_key(conn)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sentiment_cache_versions (
+            model_version TEXT PRIMARY KEY,
+            last_used_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+        # Versions already in the cache count as used now, so they only retire after the retention window
+        conn.execute("""
+        INSERT OR IGNORE INTO sentiment_cache_versions (model_version)
+        SELECT DISTINCT model_version FROM sentiment_cache
+        """)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS import_checkpoints (
+            source TEXT PRIMARY KEY,
+            position INTEGER NOT NULL,
+            rows_imported INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS export_checkpoints (
+            name TEXT PRIMARY KEY,
+            last_id INTEGER NOT NULL,
+            rows_exported INTEGER NOT NULL,
+            updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+        """)
+
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS metrics_history (
+            timestamp REAL NOT NULL,
+            name TEXT NOT NULL,
+            labels TEXT NOT NULL,
+            value REAL NOT NULL
+        )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_metrics_history_timestamp ON metrics_history (timestamp)")
+
+        # Indexes for filtered keyset pagination
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sentiments_sentiment_id ON sentiments (sentiment, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_sentiments_timestamp ON sentiments (timestamp)")
+
+        # Row counters per label, kept current by triggers so page counts cost O(1)
+        counts_exist = conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentiment_counts'"
+        ).fetchone()
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS sentiment_counts (
+            sentiment TEXT PRIMARY KEY,
+            row_count INTEGER NOT NULL
+        )
+        """)
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_sentiments_count_insert AFTER INSERT ON sentiments
+        BEGIN
+            INSERT INTO sentiment_counts (sentiment, row_count) VALUES (NEW.sentiment, 1)
+            ON CONFLICT (sentiment) DO UPDATE SET row_count = row_count + 1;
+        END
+        """)
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_sentiments_count_delete AFTER DELETE ON sentiments
+        BEGIN
+            UPDATE sentiment_counts SET row_count = row_count - 1 WHERE sentiment = OLD.sentiment;
+        END
+        """)
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_sentiments_count_update AFTER UPDATE OF sentiment ON sentiments
+        BEGIN
+            UPDATE sentiment_counts SET row_count = row_count - 1 WHERE sentiment = OLD.sentiment;
+            INSERT INTO sentiment_counts (sentiment, row_count) VALUES (NEW.sentiment, 1)
+            ON CONFLICT (sentiment) DO UPDATE SET row_count = row_count + 1;
+        END
+        """)
+        if not counts_exist:
+            # Existing database: seed the counters once from the current rows
+            conn.execute("INSERT INTO sentiment_counts (sentiment, row_count) SELECT sentiment, COUNT(*) FROM sentiments GROUP BY sentiment")
+
+        _create_rollups(conn)
+        _create_search_index(conn)
+
+def _rollup_upserts(row: str, delta: int) -> str:
+    # One statement per rollup table adding delta to the bucket of the OLD/NEW row
+    return "\n".join(
+        f"""
+            INSERT INTO sentiment_rollup_{granularity} (bucket, sentiment, row_count)
+            VALUES (strftime('{fmt}', {row}.timestamp), {row}.sentiment, {delta})
+            ON CONFLICT (bucket, sentiment) DO UPDATE SET row_count = row_count + ({delta});"""
+        for granularity, fmt in ROLLUP_BUCKET_FORMATS.items()
     )
+
+def _create_rollups(conn):
+    """
+    Create the per-minute / per-hour / per-day count tables and the triggers that keep them current.
+
+    Each insert touches one row per table, so dashboard queries read a number of
+    rows proportional to the time window, independent of the size of the history.
+    """
+    rollups_exist = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentiment_rollup_day'"
+    ).fetchone()
+    for granularity in ROLLUP_BUCKET_FORMATS:
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS sentiment_rollup_{granularity} (
+            bucket TEXT NOT NULL,
+            sentiment TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            PRIMARY KEY (bucket, sentiment)
+        ) WITHOUT ROWID
+        """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_sentiments_rollup_insert AFTER INSERT ON sentiments
+    WHEN NEW.timestamp IS NOT NULL
+    BEGIN{_rollup_upserts("NEW", 1)}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_sentiments_rollup_delete AFTER DELETE ON sentiments
+    WHEN OLD.timestamp IS NOT NULL
+    BEGIN{_rollup_upserts("OLD", -1)}
+    END
+    """)
+    # Relabelled rows (e.g. re-scoring) move from the old label bucket to the new one
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_sentiments_rollup_update AFTER UPDATE OF sentiment, timestamp ON sentiments
+    WHEN OLD.timestamp IS NOT NULL AND NEW.timestamp IS NOT NULL
+    BEGIN{_rollup_upserts("OLD", -1)}{_rollup_upserts("NEW", 1)}
+    END
+    """)
+    if not rollups_exist:
+        # Existing database: build the rollups once from the current rows
+        _fill_rollups(conn)
+
+def _fill_rollups(conn):
+    # Minutes are counted from the raw rows, hours and days from the finer rollup
+    conn.execute(f"""
+    INSERT INTO sentiment_rollup_minute (bucket, sentiment, row_count)
+    SELECT strftime('{ROLLUP_BUCKET_FORMATS["minute"]}', timestamp) AS bucket, sentiment, COUNT(*)
+    FROM sentiments WHERE timestamp IS NOT NULL GROUP BY bucket, sentiment
     """)
-    conn.commit()
-    conn.close()
+    for granularity, source in (("hour", "minute"), ("day", "hour")):
+        conn.execute(f"""
+        INSERT INTO sentiment_rollup_{granularity} (bucket, sentiment, row_count)
+        SELECT strftime('{ROLLUP_BUCKET_FORMATS[granularity]}', bucket) AS rollup_bucket, sentiment, SUM(row_count)
+        FROM sentiment_rollup_{source} GROUP BY rollup_bucket, sentiment
+        """)
+
+def _create_search_index(conn):
+    """
+    Create the FTS5 index over sentiments (text and label) and the triggers that keep it in sync.
+    """
+    index_exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'sentiments_fts'"
+    ).fetchone()
+    conn.execute(f"""
+    CREATE VIRTUAL TABLE IF NOT EXISTS sentiments_fts USING fts5(
+        text, sentiment, content='sentiments', content_rowid='id', tokenize="{FTS_TOKENIZER}"
+    )
+    """)
+    # External content: deletes must pass the exact values that were indexed
+    insert_row = f"INSERT INTO sentiments_fts (rowid, text, sentiment) VALUES (NEW.id, {FTS_FOLD_SQL.format(column='NEW.text')}, NEW.sentiment);"
+    delete_row = ("INSERT INTO sentiments_fts (sentiments_fts, rowid, text, sentiment) "
+                  f"VALUES ('delete', OLD.id, {FTS_FOLD_SQL.format(column='OLD.text')}, OLD.sentiment);")
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_sentiments_fts_insert AFTER INSERT ON sentiments
+    BEGIN
+        {insert_row}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_sentiments_fts_delete AFTER DELETE ON sentiments
+    BEGIN
+        {delete_row}
+    END
+    """)
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS trg_sentiments_fts_update AFTER UPDATE OF text, sentiment ON sentiments
+    BEGIN
+        {delete_row}
+        {insert_row}
+    END
+    """)
+    if not index_exists:
+        # Existing database: index the current rows once
+        _fill_search_index(conn)
+
+def _fill_search_index(conn):
+    conn.execute(f"""
+    INSERT INTO sentiments_fts (rowid, text, sentiment)
+    SELECT id, {FTS_FOLD_SQL.format(column='text')}, sentiment FROM sentiments
+    """)
+
+def rebuild_search_index():
+    """
+    Re-index every row of sentiments from scratch in one transaction.
+
+    Raises:
+        sqlite3.Error: Nothing is changed on failure
+    """
+    conn = get_connection()
+    with DB_WRITE_SECONDS.time(operation="rebuild_search_index"), conn:
+        conn.execute("INSERT INTO sentiments_fts (sentiments_fts) VALUES ('delete-all')")
+        _fill_search_index(conn)
+        conn.execute("INSERT INTO sentiments_fts (sentiments_fts) VALUES ('optimize')")
+
+def rebuild_rollups():
+    """
+    Recompute every rollup table from scratch in one transaction
+    (after bulk edits that bypassed the triggers, or to repair drift).
+
+    Raises:
+        sqlite3.Error: Nothing is changed on failure
+    """
+    conn = get_connection()
+    with DB_WRITE_SECONDS.time(operation="rebuild_rollups"), conn:
+        for granularity in ROLLUP_BUCKET_FORMATS:
+            conn.execute(f"DELETE FROM sentiment_rollup_{granularity}")
+        _fill_rollups(conn)
 
 # =========================== Database Saving ===========================
-def save_to_sqlite(data: dict):
-    try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
+def save_to_sqlite(data: dict) -> int:
+    """
+    Insert one result.
 
-        cursor.execute(
-            "INSERT INTO sentiments (text, sentiment) VALUES (?, ?)",
-            (data['text'], data['sentiment'])
-        )
-        conn.commit()
+    Returns:
+        id of the new row, or None if the insert failed
+    """
+    try:
+        conn = get_connection()
+        with DB_WRITE_SECONDS.time(operation="save_to_sqlite"), conn:
+            return conn.execute(INSERT_SENTIMENT_SQL, (data['text'], data['sentiment'])).lastrowid
     except Exception as e:
         st.error(f"Error saving to SQLite: {e}")
-    finally:
-        if conn:
-            conn.close()
+        return None
+
+def save_rows_to_sqlite(rows: list):
+    """
+    Insert several results in a single transaction (one commit for the whole group).
+
+    Args:
+        rows: List of (text, sentiment) tuples
+
+    Returns:
+        ids of the new rows, in the order of rows
+
+    Raises:
+        sqlite3.Error: The caller decides how to recover, nothing is written on failure
+    """
+    if not rows:
+        return []
+    conn = get_connection()
+    with DB_WRITE_SECONDS.time(operation="save_rows_to_sqlite"), conn:
+        conn.executemany(INSERT_SENTIMENT_SQL, rows)
+        # The transaction holds the write lock, so AUTOINCREMENT hands out consecutive ids
+        last_id = conn.execute(LAST_INSERT_ID_SQL).fetchone()[0]
+    return list(range(last_id - len(rows) + 1, last_id + 1))
+
+def save_import_chunk(rows: list, source: str, position: int, rows_imported: int):
+    """
+    Insert a chunk of results and advance the import checkpoint in one transaction.
+    
+    Args:
+        rows: List of (text, sentiment) tuples
+        source: Identifier of the input being imported (absolute file path)
+        position: Resume position in the input after this chunk
+        rows_imported: Total number of rows imported from the input so far
+    """
+    conn = get_connection()
+    with DB_WRITE_SECONDS.time(operation="save_import_chunk"), conn:
+        conn.executemany(INSERT_SENTIMENT_SQL, rows)
+        conn.execute(UPSERT_CHECKPOINT_SQL, (source, position, rows_imported))
+
+def load_import_checkpoint(source: str) -> tuple:
+    """
+    Get the (position, rows_imported) checkpoint of an input, or (0, 0) if it was never imported.
+    """
+    row = get_connection().execute(SELECT_CHECKPOINT_SQL, (source,)).fetchone()
+    return row if row else (0, 0)
+
+def clear_import_checkpoint(source: str):
+    conn = get_connection()
+    with conn:
+        conn.execute(DELETE_CHECKPOINT_SQL, (source,))
+
+def load_export_checkpoint(name: str) -> tuple:
+    """
+    Get the (last_id, rows_exported) watermark of a named export, or (0, 0) if it never ran.
+    """
+    row = get_connection().execute(SELECT_EXPORT_CHECKPOINT_SQL, (name,)).fetchone()
+    return row if row else (0, 0)
+
+def save_export_checkpoint(name: str, last_id: int, rows_exported: int):
+    conn = get_connection()
+    with conn:
+        conn.execute(UPSERT_EXPORT_CHECKPOINT_SQL, (name, last_id, rows_exported))
+
+def clear_export_checkpoint(name: str):
+    conn = get_connection()
+    with conn:
+        conn.execute(DELETE_EXPORT_CHECKPOINT_SQL, (name,))
+
+def update_sentiments(rows: list) -> int:
+    """
+    Update the label of existing rows in one transaction (the count triggers keep pages in sync).
+
+    Args:
+        rows: List of (sentiment, id) tuples
+
+    Returns:
+        Number of rows updated
+    """
+    if not rows:
+        return 0
+    conn = get_connection()
+    with DB_WRITE_SECONDS.time(operation="update_sentiments"), conn:
+        return conn.executemany(UPDATE_SENTIMENT_SQL, rows).rowcount
 
 # =========================== Database Loading ===========================
-def load_data_from_sqlite(last_id: int = None, page_size: int = 50) -> pd.DataFrame:
+def iter_sentiment_rows(chunk_size: int = 1000, after_id: int = 0):
+    """
+    Walk the sentiments table in id order with keyset pagination, starting after after_id.
+
+    Yields:
+        Lists of up to chunk_size (id, text, sentiment) tuples
+    """
+    conn = get_connection()
+    last_id = after_id
+    while True:
+        rows = conn.execute(SELECT_ROWS_AFTER_SQL, (last_id, chunk_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1][0]
+
+def stream_sentiment_rows(after_id: int = 0, until_id: int = None, start_time: str = None, end_time: str = None,
+                          chunk_size: int = 10000):
+    """
+    Stream the sentiments table in id order through a single cursor, fetchmany chunk_size rows at a time.
+
+    The SELECT runs as one statement, so it reads one consistent snapshot (WAL lets writers continue
+    meanwhile) and only one chunk is held in memory. until_id defaults to the largest id when the
+    export starts; the timestamp range is mapped to ids through the timestamp index.
+
+    Yields:
+        Lists of up to chunk_size (id, text, sentiment, timestamp) tuples
+    """
+    conn = get_connection()
+    min_id, max_id = _timestamp_id_bounds(conn, start_time, end_time)
+    if min_id is not None:
+        after_id = max(after_id, min_id - 1)
+    if until_id is None:
+        until_id = conn.execute(MAX_ID_SQL).fetchone()[0]
+    if max_id is not None:
+        until_id = min(until_id, max_id)
+
+    cursor = conn.execute(SELECT_EXPORT_ROWS_SQL, (after_id, until_id))
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                return
+            yield rows
+    finally:
+        # Reset the statement so an abandoned export does not keep its read snapshot open
+        cursor.close()
+
+def load_sentiments_by_ids(ids: list) -> dict:
+    """
+    Get the stored rows for the given ids (rows that no longer exist are skipped).
+
+    Returns:
+        Dict mapping id to {'text', 'sentiment', 'timestamp'}
+    """
+    found = {}
+    if not len(ids):
+        return found
+    try:
+        conn = get_connection()
+        placeholders = ", ".join("?" * len(ids))
+        rows = conn.execute(
+            f"SELECT id, text, sentiment, timestamp FROM sentiments WHERE id IN ({placeholders})", [int(i) for i in ids]
+        ).fetchall()
+        for row_id, text, sentiment, timestamp in rows:
+            found[row_id] = {"text": text, "sentiment": sentiment, "timestamp": timestamp}
+    except Exception as e:
+        st.error(f"Error loading sentiments: {e}")
+    return found
+
+def _timestamp_id_bounds(conn, start_time: str = None, end_time: str = None) -> tuple:
+    """
+    Translate a timestamp range into an id range using the timestamp index.
+    
+    Rows get their timestamp from CURRENT_TIMESTAMP on insert, so ids grow with
+    timestamps and a time window maps to one contiguous id range.
+    
+    Returns:
+        (min_id, max_id), either may be None if unbounded; (0, -1) if the range is empty
+    """
+    min_id = max_id = None
+    if start_time is not None:
+        row = conn.execute(FIRST_ID_FROM_SQL, (start_time,)).fetchone()
+        if row is None:
+            return 0, -1
+        min_id = row[0]
+    if end_time is not None:
+        row = conn.execute(LAST_ID_UNTIL_SQL, (end_time,)).fetchone()
+        if row is None:
+            return 0, -1
+        max_id = row[0]
+    return min_id, max_id
+
+def _has_diacritics(text: str) -> bool:
+    # Tone marks / accents decompose into combining characters; "đ" has no decomposition
+    return "đ" in text or any(unicodedata.combining(char) for char in unicodedata.normalize("NFD", text))
+
+def build_search_query(query: str, sentiment: str = None) -> tuple:
+    """
+    Turn a user search string into an FTS5 MATCH expression.
+    
+    Every term must match (AND). "double quotes" search for a phrase, a trailing * searches
+    for a prefix, and underscore-joined words ("sản_phẩm") are searched as a phrase, so they
+    match the tokens produced by tokenize_text. Terms typed without diacritics match any
+    accented form ("vui" also finds "vùi"); terms typed with diacritics must match exactly.
+    
+    Args:
+        query: Search string typed by the user
+        sentiment: Only match rows with this label (None for all labels)
+    
+    Returns:
+        (match_expression, exact_terms), where exact_terms are the lowercased terms with
+        diacritics that must appear verbatim; match_expression is None if nothing is searchable
+    """
+    terms, exact_terms = [], []
+    for phrase, word in re.findall(r'"([^"]*)"?|(\S+)', query):
+        prefix = not phrase and word.endswith("*")
+        text = unicodedata.normalize("NFC", (phrase or word).rstrip("*").lower()).replace("_", " ")
+        text = " ".join(re.findall(r"\w+", text))
+        if not text:
+            continue
+        terms.append(f'"{text.replace("đ", "d")}"' + (" *" if prefix else ""))
+        if _has_diacritics(text):
+            exact_terms.append(text)
+
+    if not terms:
+        return None, []
+    expression = f"text : ({' '.join(terms)})"
+    if sentiment is not None:
+        expression += f' AND sentiment : "{sentiment.replace(chr(34), "")}"'
+    return expression, exact_terms
+
+def _build_filters(conn, last_id: int = None, sentiment: str = None, start_time: str = None, end_time: str = None,
+                   query: str = None) -> tuple:
+    """
+    Build the FROM ... WHERE clause shared by the page, has-more and count queries.
+    
+    With a search query rows come from the FTS index: the label becomes part of the MATCH
+    expression and id bounds apply to the index rowid, so FTS5 resolves both without
+    visiting non-matching rows.
+    
+    Returns:
+        (sql, params, id_column); sql is None if the search query has no searchable terms
+    """
+    clauses, params = [], []
+    if query:
+        expression, exact_terms = build_search_query(query, sentiment)
+        if expression is None:
+            return None, [], None
+        source, id_column = SEARCH_SOURCE_SQL, "sentiments_fts.rowid"
+        clauses.append("sentiments_fts MATCH ?")
+        params.append(expression)
+        for term in exact_terms:
+            # The index folds diacritics, keep only rows whose text has the exact accented term
+            clauses.append("instr(replace(sentiments.text, '_', ' '), ?) > 0")
+            params.append(term)
+    else:
+        source, id_column = "sentiments", "id"
+        if sentiment is not None:
+            clauses.append("sentiment = ?")
+            params.append(sentiment)
+    if last_id is not None:
+        clauses.append(f"{id_column} < ?")
+        params.append(last_id)
+    if start_time is not None or end_time is not None:
+        min_id, max_id = _timestamp_id_bounds(conn, start_time, end_time)
+        if min_id is not None:
+            clauses.append(f"{id_column} >= ?")
+            params.append(min_id)
+        if max_id is not None:
+            clauses.append(f"{id_column} <= ?")
+            params.append(max_id)
+    where = f" WHERE {' AND '.join(clauses)}" if clauses else ""
+    return f"{source}{where}", params, id_column
+
+def load_data_from_sqlite(last_id: int = None, page_size: int = HISTORY_PAGE_SIZE, sentiment: str = None,
+                          start_time: str = None, end_time: str = None, query: str = None) -> pd.DataFrame:
     """
     Load data from SQLite with cursor-based pagination.
     
     Args:
         last_id: ID of the last record from previous page (None for first page)
-        page_size: Number of records to return (default: 50)
+        page_size: Number of records to return (default: HISTORY_PAGE_SIZE)
+        sentiment: Only return records with this label (None for all labels)
+        start_time: Only return records with timestamp >= start_time ('YYYY-MM-DD HH:MM:SS')
+        end_time: Only return records with timestamp <= end_time ('YYYY-MM-DD HH:MM:SS')
+        query: Only return records matching this full-text search (see build_search_query)
     
     Returns:
         DataFrame with sentiment records
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
-        if last_id is None:
-            # First page: get the most recent records
-            query = "SELECT * FROM sentiments ORDER BY id DESC LIMIT ?"
-            df = pd.read_sql_query(query, conn, params=(page_size,))
-        else:
-            # Next page: get records with id < last_id
-            query = "SELECT * FROM sentiments WHERE id < ? ORDER BY id DESC LIMIT ?"
-            df = pd.read_sql_query(query, conn, params=(last_id, page_size))
+        conn = get_connection()
+        # First page: last_id is None, next pages: records with id < last_id
+        sql, params, id_column = _build_filters(conn, last_id, sentiment, start_time, end_time, query)
+        if sql is None:
+            return pd.DataFrame(columns=["id", "text", "sentiment", "timestamp"])
+        select = f"SELECT sentiments.* FROM {sql} ORDER BY {id_column} DESC LIMIT ?"
+        df = pd.read_sql_query(select, conn, params=(*params, page_size))
         return df
     except Exception as e:
         st.error(f"Error loading data from SQLite: {e}")
         return pd.DataFrame(columns=["id", "text", "sentiment", "timestamp"])
-    finally:
-        if conn:
-            conn.close()
 
-def has_more_records(last_id: int) -> bool:
+def has_more_records(last_id: int, sentiment: str = None, start_time: str = None, end_time: str = None,
+                     query: str = None) -> bool:
     """
     Check if there are more records after the given last_id.
     
     Args:
         last_id: ID of the last record in current page
+        sentiment, start_time, end_time, query: Same filters as load_data_from_sqlite
     
     Returns:
         True if there are more records, False otherwise
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM sentiments WHERE id < ?", (last_id,))
-        count = cursor.fetchone()[0]
-        return count > 0
+        conn = get_connection()
+        sql, params, _ = _build_filters(conn, last_id, sentiment, start_time, end_time, query)
+        if sql is None:
+            return False
+        # EXISTS stops at the first matching row instead of counting all of them
+        return bool(conn.execute(f"SELECT EXISTS (SELECT 1 FROM {sql})", params).fetchone()[0])
     except Exception as e:
         st.error(f"Error checking for more records: {e}")
         return False
-    finally:
-        if conn:
-            conn.close()
 
-def get_total_pages(page_size: int = 50) -> int:
+def get_total_pages(page_size: int = HISTORY_PAGE_SIZE, sentiment: str = None, start_time: str = None, end_time: str = None,
+                    query: str = None) -> int:
     """
     Get total number of pages based on total records and page size.
     
+    Without a time filter the total comes from the trigger-maintained
+    sentiment_counts table in constant time. Search matches are only counted
+    up to SEARCH_MAX_COUNTED_ROWS so common terms stay fast.
+    
     Args:
-        page_size: Number of records per page (default: 50)
+        page_size: Number of records per page (default: HISTORY_PAGE_SIZE)
+        sentiment, start_time, end_time, query: Same filters as load_data_from_sqlite
     
     Returns:
         Total number of pages
     """
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("SELECT COUNT(*) FROM sentiments")
-        total_records = cursor.fetchone()[0]
+        conn = get_connection()
+        if start_time is None and end_time is None and not query:
+            if sentiment is None:
+                total_records = conn.execute(COUNT_ALL_SQL).fetchone()[0]
+            else:
+                total_records = conn.execute(COUNT_BY_SENTIMENT_SQL, (sentiment,)).fetchone()[0]
+        else:
+            sql, params, _ = _build_filters(conn, None, sentiment, start_time, end_time, query)
+            if sql is None:
+                total_records = 0
+            elif query:
+                total_records = conn.execute(f"SELECT COUNT(*) FROM (SELECT 1 FROM {sql} LIMIT ?)",
+                                             (*params, SEARCH_MAX_COUNTED_ROWS)).fetchone()[0]
+            else:
+                total_records = conn.execute(f"SELECT COUNT(*) FROM {sql}", params).fetchone()[0]
         total_pages = (total_records + page_size - 1) // page_size  # Ceiling division
         return max(1, total_pages)  # At least 1 page even if empty
     except Exception as e:
         st.error(f"Error getting total pages: {e}")
         return 1
-    finally:
-        if conn:
-            conn.close()
+
+def load_sentiment_rollup(granularity: str = "hour", start_time: str = None, end_time: str = None) -> pd.DataFrame:
+    """
+    Load label counts per time bucket from a rollup table (never scans sentiments).
+    
+    Args:
+        granularity: 'minute', 'hour' or 'day'
+        start_time: Only buckets containing or after this time ('YYYY-MM-DD HH:MM:SS', UTC)
+        end_time: Only buckets starting at or before this time ('YYYY-MM-DD HH:MM:SS', UTC)
+    
+    Returns:
+        DataFrame with bucket, sentiment and row_count columns, ordered by bucket
+    """
+    try:
+        conn = get_connection()
+        params = (start_time or "0000-01-01 00:00:00", end_time or "9999-12-31 23:59:59")
+        return pd.read_sql_query(SELECT_ROLLUP_SQL[granularity], conn, params=params)
+    except Exception as e:
+        st.error(f"Error loading sentiment rollup: {e}")
+        return pd.DataFrame(columns=["bucket", "sentiment", "row_count"])
 
 def delete_all_records():
     try:
-        conn = sqlite3.connect(DB_NAME)
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM sentiments")
-        conn.commit()
+        conn = get_connection()
+        with conn:
+            conn.execute(DELETE_ALL_SQL)
+            # The triggers left every bucket at zero, drop them instead of keeping empty rows
+            for granularity in ROLLUP_BUCKET_FORMATS:
+                conn.execute(f"DELETE FROM sentiment_rollup_{granularity}")
     except Exception as e:
         st.error(f"Error deleting record from SQLite: {e}")
-    finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+
+# =========================== Result Cache ===========================
+def load_cached_sentiments(texts: list, model_version: str, chunk_size: int = 500) -> dict:
+    """
+    Look up cached classification results for the given tokenized texts.
+    
+    Args:
+        texts: Normalized tokenized texts to look up
+        model_version: Only rows produced by this model version are returned
+        chunk_size: Maximum number of texts per query (SQLite parameter limit)
+    
+    Returns:
+        Dict mapping text to {'label', 'score'} (plus the float16 'embedding' when it was
+        cached) for the texts that were found
+    """
+    found = {}
+    try:
+        conn = get_connection()
+        for start in range(0, len(texts), chunk_size):
+            chunk = texts[start:start + chunk_size]
+            placeholders = ", ".join("?" * len(chunk))
+            rows = conn.execute(
+                f"SELECT text, sentiment, score, embedding FROM sentiment_cache WHERE model_version = ? AND text IN ({placeholders})",
+                (model_version, *chunk)
+            ).fetchall()
+            for text, sentiment, score, embedding in rows:
+                found[text] = {"label": sentiment, "score": score}
+                if embedding is not None:
+                    found[text]["embedding"] = np.frombuffer(embedding, dtype=np.float16)
+    except Exception as e:
+        st.error(f"Error loading cached sentiments: {e}")
+    return found
+
+def save_cached_sentiments(results: dict, model_version: str):
+    """
+    Store classification results {text: {'label', 'score'[, 'embedding']}} for the given model version.
+    """
+    try:
+        conn = get_connection()
+        with DB_WRITE_SECONDS.time(operation="save_cached_sentiments"), conn:
+            # Keep the version's last-use time fresh so long-running processes never see it retired
+            conn.execute(TOUCH_CACHE_VERSION_SQL, (model_version,))
+            conn.executemany(
+                UPSERT_CACHE_SQL,
+                [(text, value["label"], value["score"], model_version, _embedding_blob(value.get("embedding")))
+                 for text, value in results.items()]
+            )
+    except Exception as e:
+        st.error(f"Error saving cached sentiments: {e}")
+
+def _embedding_blob(embedding) -> bytes:
+    return None if embedding is None else np.asarray(embedding, dtype=np.float16).tobytes()
+
+def _migrate_cache_primary_key(conn: sqlite3.Connection):
+    """
+    Rebuild sentiment_cache with the (text, model_version) primary key, keeping its rows.
+    """
+    conn.execute("ALTER TABLE sentiment_cache RENAME TO sentiment_cache_old")
+    conn.execute("""
+    CREATE TABLE sentiment_cache (
+        text TEXT NOT NULL,
+        sentiment TEXT NOT NULL,
+        score REAL NOT NULL,
+        model_version TEXT NOT NULL,
+        embedding BLOB,
+        PRIMARY KEY (text, model_version)
+    )
+    """)
+    conn.execute("""
+    INSERT INTO sentiment_cache (text, sentiment, score, model_version, embedding)
+    SELECT text, sentiment, score, model_version, embedding FROM sentiment_cache_old
+    """)
+    conn.execute("DROP TABLE sentiment_cache_old")
+
+def purge_retired_cache(model_version: str, retention_days: float) -> list:
+    """
+    Mark model_version as in use and remove cached results of versions that no process
+    has used for retention_days (other live versions keep their rows).
+
+    Returns:
+        List of the retired model versions that were removed
+    """
+    retired = []
+    try:
+        conn = get_connection()
+        with conn:
+            conn.execute(TOUCH_CACHE_VERSION_SQL, (model_version,))
+            retired = [row[0] for row in conn.execute(RETIRED_CACHE_VERSIONS_SQL, (f"-{retention_days} days", model_version))]
+            for version in retired:
+                conn.execute(DELETE_CACHE_VERSION_ROWS_SQL, (version,))
+                conn.execute(DELETE_CACHE_VERSION_SQL, (version,))
+    except Exception as e:
+        st.error(f"Error clearing result cache: {e}")
+    return retired
+
+# =========================== Metrics History ===========================
+def save_metrics_snapshot(samples: list, retention_hours: float):
+    """
+    Append one snapshot of metric samples and drop snapshots older than the retention window.
+
+    Args:
+        samples: List of (name, labels, value) tuples from MetricsRegistry.samples()
+        retention_hours: Snapshots older than this many hours are deleted
+    """
+    now = time.time()
+    try:
+        conn = get_connection()
+        with conn:
+            conn.executemany(INSERT_METRIC_SQL, [(now, name, labels, value) for name, labels, value in samples])
+            conn.execute(PRUNE_METRICS_SQL, (now - retention_hours * 3600,))
+    except Exception as e:
+        st.error(f"Error saving metrics snapshot: {e}")
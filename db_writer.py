@@ -0,0 +1,136 @@
+import atexit
+import queue
+import threading
+import time
+
+from constant import DB_WRITER_MAX_BATCH_ROWS, DB_WRITER_MAX_DELAY_MS, DB_WRITER_QUEUE_SIZE
+from database import save_rows_to_sqlite, save_to_sqlite
+from metrics import REGISTRY
+
+# Đánh dấu yêu cầu dừng writer
+_STOP = object()
+
+WRITER_QUEUE_DEPTH = REGISTRY.gauge("vnsaa_db_writer_queue_depth", "Rows waiting in the group-commit writer queue.")
+WRITER_FALLBACKS = REGISTRY.counter("vnsaa_db_writer_fallbacks_total", "Rows written synchronously because the writer queue was full or closed.")
+
+
+class GroupCommitWriter:
+    """
+    Ghi lịch sử phân tích vào bảng sentiments trên một luồng nền.
+
+    Các dòng được đưa vào một hàng đợi có giới hạn; luồng writer gom chúng lại và ghi
+    trong một transaction khi:
+        - đủ max_batch_rows dòng, hoặc
+        - dòng đầu tiên trong nhóm đã chờ quá max_delay_ms mili giây.
+    Người gọi không phải chờ commit/fsync. Khi hàng đợi đầy (hoặc writer đã đóng),
+    dòng được ghi đồng bộ bằng save_to_sqlite như trước. close() (cũng được gọi khi
+    tiến trình thoát) ghi hết các dòng còn trong hàng đợi rồi mới dừng.
+
+    Nếu có embedding_store, embedding của từng dòng được ghi vào store theo id vừa cấp
+    ngay sau khi nhóm được commit.
+    """
+
+    def __init__(self, max_batch_rows: int = DB_WRITER_MAX_BATCH_ROWS, max_delay_ms: float = DB_WRITER_MAX_DELAY_MS,
+                 queue_size: int = DB_WRITER_QUEUE_SIZE, embedding_store=None):
+        self.embedding_store = embedding_store
+        self.max_batch_rows = max_batch_rows
+        self.max_delay = max_delay_ms / 1000
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._closed = False
+        self._close_lock = threading.Lock()
+        WRITER_QUEUE_DEPTH.set_function(self.queue_size)
+
+        self._worker = threading.Thread(target=self._run, name="group-commit-writer", daemon=True)
+        self._worker.start()
+        atexit.register(self.close)
+
+    def save(self, data: dict, embedding=None) -> bool:
+        """
+        Đưa một bản ghi {'text', 'sentiment'} (và embedding [CLS] nếu có) vào hàng đợi ghi.
+
+        Returns:
+            bool: True nếu đã vào hàng đợi, False nếu đã ghi đồng bộ (hàng đợi đầy hoặc writer đã đóng).
+        """
+        # Giữ lock để không có dòng nào lọt vào hàng đợi sau dấu dừng của close()
+        with self._close_lock:
+            if not self._closed:
+                try:
+                    self._queue.put_nowait((data['text'], data['sentiment'], embedding))
+                    return True
+                except queue.Full:
+                    pass
+        WRITER_FALLBACKS.inc()
+        self._store_embeddings([save_to_sqlite(data)], [embedding])
+        return False
+
+    def queue_size(self) -> int:
+        return self._queue.qsize()
+
+    def flush(self):
+        # Chờ cho đến khi mọi dòng đã vào hàng đợi được commit
+        self._queue.join()
+
+    def close(self):
+        # Ghi nốt các dòng đang chờ rồi dừng writer; gọi nhiều lần không sao
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(_STOP)
+        self._worker.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                self._queue.task_done()
+                return
+
+            batch = [item]
+            stop = False
+            deadline = time.monotonic() + self.max_delay
+
+            # Gom thêm dòng cho đến khi đủ nhóm hoặc hết thời gian chờ
+            while len(batch) < self.max_batch_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+
+            self._commit(batch)
+            for _ in range(len(batch) + stop):
+                self._queue.task_done()
+            if stop:
+                return
+
+    def _commit(self, rows: list):
+        embeddings = [embedding for _, _, embedding in rows]
+        try:
+            ids = save_rows_to_sqlite([(text, sentiment) for text, sentiment, _ in rows])
+        except Exception as e:
+            # Một dòng lỗi không làm mất cả nhóm: ghi lại từng dòng
+            print(f"> Group commit of {len(rows)} rows failed ({e}), retrying row by row")
+            ids = [save_to_sqlite({"text": text, "sentiment": sentiment}) for text, sentiment, _ in rows]
+        self._store_embeddings(ids, embeddings)
+
+    def _store_embeddings(self, ids: list, embeddings: list):
+        # Bỏ qua dòng ghi lỗi (id None) và dòng không có embedding
+        if self.embedding_store is None:
+            return
+        pairs = [(row_id, embedding) for row_id, embedding in zip(ids, embeddings)
+                 if row_id is not None and embedding is not None]
+        if not pairs:
+            return
+        try:
+            row_ids, vectors = zip(*pairs)
+            self.embedding_store.put(row_ids, vectors)
+        except Exception as e:
+            # Lịch sử đã được ghi, thiếu embedding thì bổ sung sau bằng "embedding_store.py backfill"
+            print(f"> Storing {len(pairs)} embeddings failed: {e}")
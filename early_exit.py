@@ -0,0 +1,299 @@
+import argparse
+import os
+
+import numpy as np
+import torch
+
+from constant import EARLY_EXIT_HEADS_PATH, EARLY_EXIT_LAYERS, EARLY_EXIT_THRESHOLD, MAX_TOKEN_LENGTH, MODEL_NAME
+from linear_head import file_sha256, load_heads, save_heads
+from metrics import REGISTRY, stage_timer
+from sentiment_classification import LABEL_MAP, format_predictions
+from tokenization import length_bucketed_batches, pad_batch, tokenize_batch
+
+# Các ngưỡng được so sánh trong báo cáo accuracy / số layer trung bình
+REPORT_THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+EXIT_LAYERS = REGISTRY.histogram("vnsaa_early_exit_layers", "Encoder layers executed per text in early-exit mode.",
+                                 buckets=tuple(range(1, 13)))
+
+
+# =========================== Inference ===========================
+class EarlyExitEncoder:
+    """
+    Chạy PhoBERT từng layer một; mỗi câu dừng ở layer giữa đầu tiên mà head của layer đó
+    có độ tin cậy >= threshold, các câu còn lại đi hết encoder và dùng classifier chính.
+
+    Câu đã dừng được loại khỏi batch (và batch được cắt bớt padding thừa) nên các layer
+    sau chỉ tính cho những câu khó. Cần encoder PyTorch (backend torch / int8).
+    """
+
+    def __init__(self, model, heads: dict, classifier, threshold: float, source_hash: str = ""):
+        self.model = model
+        self.layers = model.encoder.layer
+        # Head ở layer cuối (nếu có) bị bỏ qua, layer cuối luôn dùng classifier chính
+        self.heads = {layer: head for layer, head in heads.items() if layer < len(self.layers)}
+        self.classifier = classifier
+        self.threshold = threshold
+        self.source_hash = source_hash
+
+    def forward(self, input_ids: torch.Tensor, attention_mask: torch.Tensor) -> tuple:
+        """
+        Chạy một batch đã padding.
+
+        Returns:
+            tuple: (chỉ số lớp, ma trận xác suất, số layer đã chạy) cho từng câu, dạng numpy.
+        """
+        n_samples = input_ids.shape[0]
+        label_idxs = np.empty(n_samples, dtype=np.int64)
+        probas = np.empty((n_samples, len(self.classifier.classes_)))
+        executed = np.empty(n_samples, dtype=np.int64)
+        # Vị trí trong batch ban đầu của các câu còn đang chạy
+        rows = np.arange(n_samples)
+
+        hidden = self.model.embeddings(input_ids=input_ids)
+        for depth, layer in enumerate(self.layers, start=1):
+            extended_mask = self.model.get_extended_attention_mask(attention_mask, attention_mask.shape)
+            hidden = layer(hidden, attention_mask=extended_mask)[0]
+
+            last = depth == len(self.layers)
+            head = self.classifier if last else self.heads.get(depth)
+            if head is None:
+                continue
+
+            labels, proba = head.predict_with_proba(hidden[:, 0, :].cpu().numpy())
+            done = np.ones(len(rows), dtype=bool) if last else proba.max(axis=1) >= self.threshold
+            label_idxs[rows[done]] = labels[done]
+            probas[rows[done]] = proba[done]
+            executed[rows[done]] = depth
+            if done.all():
+                break
+
+            # Giữ lại các câu chưa đủ tin cậy, cắt padding đến câu dài nhất còn lại
+            keep = torch.from_numpy(~done)
+            rows = rows[~done]
+            attention_mask = attention_mask[keep]
+            length = int(attention_mask.sum(dim=1).max())
+            attention_mask = attention_mask[:, :length]
+            hidden = hidden[keep, :length]
+
+        return label_idxs, probas, executed
+
+    def classify(self, texts: list, tokenizer, device: str = "cpu", batch_size: int = 32,
+                 max_len: int = MAX_TOKEN_LENGTH) -> list:
+        """
+        Phân loại danh sách văn bản (đã tiền xử lý) ở chế độ early exit.
+
+        Returns:
+            list: Danh sách dict {'label', 'score'} theo đúng thứ tự của texts.
+        """
+        with stage_timer("model_tokenize"):
+            input_ids = tokenize_batch(tokenizer, texts, max_len)
+        batches = length_bucketed_batches([len(ids) for ids in input_ids], batch_size)
+
+        label_idxs = np.empty(len(texts), dtype=np.int64)
+        probas = np.empty((len(texts), len(self.classifier.classes_)))
+        with stage_timer("encoder_forward"), torch.no_grad():
+            for indices in batches:
+                encoded = pad_batch([input_ids[i] for i in indices], tokenizer.pad_token_id)
+                labels, proba, executed = self.forward(
+                    encoded["input_ids"].to(device), encoded["attention_mask"].to(device)
+                )
+                label_idxs[indices] = labels
+                probas[indices] = proba
+                for depth in executed:
+                    EXIT_LAYERS.observe(int(depth))
+
+        return format_predictions(label_idxs, probas)
+
+
+def load_early_exit(model, classifier, backend: str, path: str = EARLY_EXIT_HEADS_PATH,
+                    threshold: float = EARLY_EXIT_THRESHOLD) -> EarlyExitEncoder:
+    """
+    Tạo EarlyExitEncoder nếu đã bật ngưỡng, đã có file head và encoder hỗ trợ chạy từng layer.
+    Trả về None (chạy đủ encoder như thường) trong các trường hợp còn lại.
+    """
+    if threshold is None:
+        return None
+    if not os.path.exists(path):
+        print(f"> Early exit disabled: {path} not found (train it with `python early_exit.py`)")
+        return None
+    if not hasattr(model, "encoder") or not hasattr(model, "embeddings"):
+        print(f"> Early exit disabled: the {backend} backend cannot run encoder layers one by one")
+        return None
+    return EarlyExitEncoder(model, load_heads(path), classifier, threshold, source_hash=file_sha256(path))
+
+
+# =========================== Report ===========================
+def exit_report(layer_features: dict, labels, heads: dict, classifier, thresholds=REPORT_THRESHOLDS) -> list:
+    """
+    Tính accuracy và số layer trung bình đã chạy với từng ngưỡng trên tập kiểm tra.
+
+    Mô phỏng đúng quy tắc của EarlyExitEncoder từ [CLS] đã tính sẵn của từng layer,
+    vì mỗi câu được xử lý độc lập nên không cần chạy lại encoder cho từng ngưỡng.
+
+    Args:
+        layer_features (dict): {layer: ma trận [CLS]}, gồm cả layer cuối.
+        labels: Nhãn đúng (0/1/2).
+        heads (dict): {layer: LinearHead} của các layer giữa.
+        classifier: Classifier chính dùng ở layer cuối.
+        thresholds: Các ngưỡng cần so sánh.
+
+    Returns:
+        list: Mỗi phần tử gồm threshold, accuracy, avg_layers, speedup (so với chạy đủ encoder)
+            và exits ({layer: tỷ lệ câu dừng ở layer đó}). Dòng đầu (threshold None) là chạy đủ encoder.
+    """
+    labels = np.asarray(labels)
+    num_layers = max(layer_features)
+    exit_layers = sorted(layer for layer in heads if layer < num_layers)
+    predictions = {layer: heads[layer].predict_with_proba(layer_features[layer]) for layer in exit_layers}
+    final_labels, final_proba = classifier.predict_with_proba(layer_features[num_layers])
+
+    report = []
+    for threshold in (None,) + tuple(thresholds):
+        label_idxs, probas = final_labels.copy(), final_proba.copy()
+        executed = np.full(len(labels), num_layers)
+        running = np.ones(len(labels), dtype=bool)
+        if threshold is not None:
+            for layer in exit_layers:
+                layer_labels, layer_proba = predictions[layer]
+                stop = running & (layer_proba.max(axis=1) >= threshold)
+                label_idxs[stop], probas[stop], executed[stop] = layer_labels[stop], layer_proba[stop], layer
+                running &= ~stop
+
+        # Áp dụng cùng quy tắc NEUTRAL như khi suy luận
+        label_ids = {label: idx for idx, label in LABEL_MAP.items()}
+        predicted = [label_ids[result["label"]] for result in format_predictions(label_idxs, probas)]
+        report.append({
+            "threshold": threshold,
+            "accuracy": float(np.mean(np.asarray(predicted) == labels)),
+            "avg_layers": float(executed.mean()),
+            "speedup": num_layers / float(executed.mean()),
+            "exits": {layer: float(np.mean(executed == layer)) for layer in exit_layers + [num_layers]},
+        })
+    return report
+
+
+def print_report(report: list):
+    print(f"> {'threshold':>9} {'accuracy':>9} {'avg layers':>11} {'speedup':>8}  exits per layer")
+    for row in report:
+        threshold = "off" if row["threshold"] is None else f"{row['threshold']:.2f}"
+        exits = ", ".join(f"L{layer}: {share:.0%}" for layer, share in row["exits"].items())
+        print(f"> {threshold:>9} {row['accuracy']:>9.3f} {row['avg_layers']:>11.2f} {row['speedup']:>7.2f}x  {exits}")
+
+
+# =========================== Training ===========================
+def layer_features_for(texts: list, layers: list, model_path: str, embedding_dtype: str = "float32",
+                       use_cache: bool = True) -> dict:
+    """
+    Sinh [CLS] của các layer cho danh sách văn bản bằng luồng trích đặc trưng của train_svm_phobert.py.
+
+    Mỗi layer có một EmbeddingCache riêng (layer cuối dùng chung cache với train_svm_phobert.py);
+    một lần forward với output_hidden_states cho ra [CLS] của mọi layer cần tính.
+
+    Returns:
+        dict: {layer: ma trận (len(texts), hidden_size)}
+    """
+    from embedding_cache import EmbeddingCache
+    from train_svm_phobert import extract_features, load_phobert_model
+
+    num_layers = max(layers)
+    phobert = {}
+    computed = {layer: {} for layer in layers}
+
+    def encoder_for(layer):
+        def encode(texts_to_encode):
+            todo = [text for text in dict.fromkeys(texts_to_encode) if text not in computed[layer]]
+            if todo:
+                if not phobert:
+                    print("> Loading PhoBERT model...")
+                    phobert["model"], phobert["tokenizer"] = load_phobert_model(model_path)
+                features = extract_features(phobert["model"], phobert["tokenizer"], todo, max_len=MAX_TOKEN_LENGTH,
+                                            batch_size=32, device='cpu', layers=layers)
+                for computed_layer, matrix in features.items():
+                    computed[computed_layer].update(zip(todo, matrix))
+            return np.stack([computed[layer][text] for text in texts_to_encode])
+        return encode
+
+    if not use_cache:
+        return {layer: encoder_for(layer)(texts) for layer in layers}
+
+    result = {}
+    for layer in layers:
+        cache_name = MODEL_NAME if layer == num_layers else f"{MODEL_NAME}@layer{layer}"
+        cache = EmbeddingCache(cache_name, max_len=MAX_TOKEN_LENGTH, dtype=embedding_dtype)
+        result[layer] = np.asarray(cache.get_or_compute(texts, encoder_for(layer)), dtype=np.float32)
+    return result
+
+
+def train_exit_heads(layer_features: dict, labels, exit_layers) -> dict:
+    """
+    Train một SVC tuyến tính (probability=True, giống classifier chính) cho [CLS] của mỗi layer giữa
+    và export thành LinearHead.
+    """
+    from sklearn.svm import SVC
+
+    from linear_head import LinearHead
+
+    heads = {}
+    for layer in exit_layers:
+        clf = SVC(kernel='linear', probability=True, gamma=0.125)
+        clf.fit(layer_features[layer], labels)
+        heads[layer] = LinearHead.from_svc(clf)
+    return heads
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train early-exit heads on intermediate PhoBERT layers and report accuracy vs. layers executed.")
+    parser.add_argument("--csv", default="data_sentiment_vn.csv")
+    parser.add_argument("--layers", default=",".join(map(str, EARLY_EXIT_LAYERS)),
+                        help="Intermediate layers that get an exit head (comma separated)")
+    parser.add_argument("--thresholds", default=",".join(map(str, REPORT_THRESHOLDS)),
+                        help="Confidence thresholds compared in the report")
+    parser.add_argument("--output", default=EARLY_EXIT_HEADS_PATH)
+    parser.add_argument("--embedding-dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Always re-encode every text")
+    args = parser.parse_args()
+
+    import pandas as pd
+    from sklearn.model_selection import train_test_split
+    from transformers import AutoConfig
+
+    from linear_head import load_head
+    from model_backends import resolve_model_path
+    from preprocessing import preprocess_batch
+
+    model_path = resolve_model_path(MODEL_NAME)
+    num_layers = AutoConfig.from_pretrained(model_path).num_hidden_layers
+    exit_layers = sorted({int(layer) for layer in args.layers.split(",")})
+    if not all(0 < layer < num_layers for layer in exit_layers):
+        parser.error(f"--layers must be between 1 and {num_layers - 1}")
+
+    print("> Loading dataset...")
+    df = pd.read_csv(args.csv)
+    texts, _ = preprocess_batch(df['text'].astype(str).tolist())
+    labels = np.asarray(df['label'].tolist())
+
+    print("> Extracting [CLS] features of layers " + ", ".join(map(str, exit_layers + [num_layers])) + "...")
+    features = layer_features_for(texts, exit_layers + [num_layers], model_path, args.embedding_dtype,
+                                  use_cache=not args.no_embedding_cache)
+
+    # Cùng cách chia với train_svm_phobert.py: tập kiểm tra không được classifier chính nhìn thấy
+    train_idx, test_idx = train_test_split(np.arange(len(labels)), test_size=0.2, random_state=42, stratify=labels)
+
+    print("> Training exit heads...")
+    heads = train_exit_heads({layer: matrix[train_idx] for layer, matrix in features.items()}, labels[train_idx], exit_layers)
+    for layer, head in heads.items():
+        accuracy = np.mean(head.predict(features[layer][test_idx]) == labels[test_idx])
+        print(f"> Layer {layer} head accuracy: {accuracy:.3f}")
+
+    save_heads(heads, args.output)
+    print(f"> Saved {len(heads)} exit heads to {args.output}")
+
+    print("> Held-out accuracy vs. encoder layers executed:")
+    report = exit_report({layer: matrix[test_idx] for layer, matrix in features.items()}, labels[test_idx],
+                         heads, load_head(), [float(t) for t in args.thresholds.split(",")])
+    print_report(report)
+
+
+if __name__ == "__main__":
+    main()
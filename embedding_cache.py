@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+
+import numpy as np
+
+from constant import EMBEDDING_CACHE_DIR
+
+# Độ dài (byte) khóa của mỗi dòng: sha1 của văn bản đã tiền xử lý
+KEY_SIZE = 20
+
+
+def text_key(text: str) -> bytes:
+    return hashlib.sha1(text.encode("utf-8")).digest()
+
+
+class EmbeddingCache:
+    """
+    Lưu embedding [CLS] trên đĩa dưới dạng ma trận memory-mapped, theo từng (model, max_len, dtype).
+
+    Thư mục của mỗi cấu hình gồm:
+        - embeddings.bin: ma trận (rows, dim) dạng float32/float16, chỉ ghi nối thêm
+        - keys.bin: sha1 (20 byte) của văn bản tương ứng với từng dòng
+        - meta.json: số dòng hợp lệ, dim, dtype; được ghi sau cùng nên là điểm commit
+
+    Lần chạy sau chỉ cần encode những văn bản mới hoặc đã thay đổi,
+    phần còn lại được đọc thẳng từ file qua memmap.
+    """
+
+    def __init__(self, model_name: str, max_len: int, dtype: str = "float32", root: str = EMBEDDING_CACHE_DIR):
+        if dtype not in ("float32", "float16"):
+            raise ValueError(f"Unsupported dtype '{dtype}', expected float32 or float16")
+
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+        self.directory = os.path.join(root, f"{slug}_len{max_len}_{dtype}")
+        self.dtype = np.dtype(dtype)
+        self.meta_path = os.path.join(self.directory, "meta.json")
+        self.data_path = os.path.join(self.directory, "embeddings.bin")
+        self.keys_path = os.path.join(self.directory, "keys.bin")
+        os.makedirs(self.directory, exist_ok=True)
+
+        self.rows = 0
+        self.dim = None
+        self._index = {}
+        self._matrix = None
+        self._load()
+
+    def __len__(self):
+        return self.rows
+
+    def _load(self):
+        if not os.path.exists(self.meta_path):
+            # Chưa có dữ liệu hợp lệ: bỏ phần ghi dở (nếu có)
+            for path in (self.data_path, self.keys_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            return
+
+        with open(self.meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.rows, self.dim = meta["rows"], meta["dim"]
+
+        # Cắt bỏ phần dữ liệu ghi sau lần commit cuối (ví dụ bị dừng giữa chừng)
+        self._truncate(self.data_path, self.rows * self.dim * self.dtype.itemsize)
+        self._truncate(self.keys_path, self.rows * KEY_SIZE)
+
+        with open(self.keys_path, "rb") as f:
+            raw_keys = f.read()
+        self._index = {raw_keys[i * KEY_SIZE:(i + 1) * KEY_SIZE]: i for i in range(self.rows)}
+
+    @staticmethod
+    def _truncate(path: str, size: int):
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+    @property
+    def matrix(self) -> np.ndarray:
+        """
+        Toàn bộ embedding dưới dạng memmap chỉ đọc (rows, dim).
+        """
+        if self._matrix is None or self._matrix.shape[0] != self.rows:
+            if self.rows == 0:
+                return np.empty((0, self.dim or 0), dtype=self.dtype)
+            self._matrix = np.memmap(self.data_path, dtype=self.dtype, mode="r", shape=(self.rows, self.dim))
+        return self._matrix
+
+    def lookup(self, keys: list) -> np.ndarray:
+        # Chỉ số dòng của từng khóa, -1 nếu chưa có
+        return np.fromiter((self._index.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+
+    def append(self, keys: list, embeddings: np.ndarray):
+        """
+        Ghi nối thêm các embedding mới rồi cập nhật meta.json (điểm commit).
+        """
+        embeddings = np.ascontiguousarray(embeddings, dtype=self.dtype)
+        if self.dim is None:
+            self.dim = embeddings.shape[1]
+        elif embeddings.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim {embeddings.shape[1]} does not match cache dim {self.dim}")
+
+        with open(self.data_path, "ab") as f:
+            f.write(embeddings.tobytes())
+        with open(self.keys_path, "ab") as f:
+            f.write(b"".join(keys))
+
+        for offset, key in enumerate(keys):
+            self._index[key] = self.rows + offset
+        self.rows += len(keys)
+
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"rows": self.rows, "dim": self.dim, "dtype": self.dtype.name}, f)
+        os.replace(tmp_path, self.meta_path)
+
+    def get_or_compute(self, texts: list, compute_fn) -> np.ndarray:
+        """
+        Lấy embedding cho texts, chỉ gọi compute_fn(danh sách văn bản) cho những văn bản chưa có.
+
+        Nếu các dòng cần lấy nằm liền nhau và đúng thứ tự trong file, kết quả là một view
+        của memmap (không sao chép); ngược lại là một bản sao theo thứ tự texts.
+
+        Returns:
+            np.ndarray: Ma trận (len(texts), dim).
+        """
+        keys = [text_key(text) for text in texts]
+        rows = self.lookup(keys)
+
+        # Các văn bản chưa có (loại trùng lặp, giữ thứ tự xuất hiện)
+        missing = {}
+        for text, key, row in zip(texts, keys, rows):
+            if row < 0 and key not in missing:
+                missing[key] = text
+
+        if missing:
+            print(f"> Embedding {len(missing)} new texts ({int(np.sum(rows >= 0))} loaded from cache)")
+            self.append(list(missing), compute_fn(list(missing.values())))
+            rows = self.lookup(keys)
+        else:
+            print(f"> All {len(texts)} embeddings loaded from cache")
+
+        if len(rows) and np.array_equal(rows, np.arange(rows[0], rows[0] + len(rows))):
+            return self.matrix[rows[0]:rows[0] + len(rows)]
+        return np.asarray(self.matrix[rows])
@@ -0,0 +1,482 @@
+import argparse
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+
+from constant import EMBEDDING_STORE_DIR, IVF_NPROBE, MODEL_BACKEND, SIMILARITY_BLOCK_ROWS
+
+# Số dòng ghi sau lần dựng danh sách cụm IVF gần nhất được phép lọc trực tiếp trước khi dựng lại
+IVF_REBUILD_MIN_PENDING = 4096
+
+
+def normalize_rows(vectors) -> np.ndarray:
+    # Chuẩn hóa mỗi dòng về độ dài 1 để cosine similarity chỉ còn là tích vô hướng
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+# =========================== Store ===========================
+class EmbeddingStore:
+    """
+    Lưu embedding [CLS] của các câu trong lịch sử dưới dạng mảng memory-mapped,
+    dòng i ứng với sentiments.id = offset + i (offset là id nhỏ nhất từng được ghi).
+
+    Thư mục gồm:
+        - vectors.f16: ma trận (rows, dim) float16, mỗi dòng đã chuẩn hóa độ dài 1
+        - valid.u8: 1 nếu dòng tương ứng đã có embedding
+        - assign.i32: cụm IVF của từng dòng (-1 nếu chưa có), chỉ khi đã build IVF
+        - centroids.npy: tâm các cụm IVF
+        - meta.json: dim và offset
+
+    File chỉ được nối dài thêm (vừa đủ đến id lớn nhất đã ghi, nên kích thước file cũng là
+    số dòng cần duyệt, kể cả với tiến trình khác); các luồng đọc dùng snapshot() mà không cần khóa.
+    Khi ghi id nhỏ hơn offset (backfill lịch sử cũ sau khi app đã ghi), các file được chép lại
+    với phần đầu mới và offset lùi xuống, meta.json ghi sau cùng.
+    """
+
+    def __init__(self, directory: str = EMBEDDING_STORE_DIR):
+        self.directory = directory
+        self.meta_path = os.path.join(directory, "meta.json")
+        self.vectors_path = os.path.join(directory, "vectors.f16")
+        self.valid_path = os.path.join(directory, "valid.u8")
+        self.assign_path = os.path.join(directory, "assign.i32")
+        self.centroids_path = os.path.join(directory, "centroids.npy")
+        os.makedirs(directory, exist_ok=True)
+
+        # Tăng mỗi khi dữ liệu bị xóa hoặc IVF thay đổi, để SimilarityIndex dựng lại danh sách cụm
+        self.generation = 0
+        self._lock = threading.Lock()
+        self._rows = 0
+        self._meta_mtime = None
+        self._vectors = self._valid = self._assign = None
+        self._load_meta()
+        atexit.register(self.flush)
+
+    # =========================== Files ===========================
+    def _meta_stamp(self):
+        try:
+            return os.stat(self.meta_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _load_meta(self):
+        self.dim = self.offset = self.centroids = None
+        self._meta_mtime = self._meta_stamp()
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path) as f:
+                meta = json.load(f)
+            self.dim, self.offset = meta["dim"], meta["offset"]
+        if os.path.exists(self.centroids_path):
+            self.centroids = np.load(self.centroids_path)
+        self.generation += 1
+
+    def _write_meta(self):
+        tmp_path = f"{self.meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"dim": self.dim, "offset": self.offset}, f)
+        os.replace(tmp_path, self.meta_path)
+        self._meta_mtime = self._meta_stamp()
+
+    def _file_rows(self) -> int:
+        return os.path.getsize(self.valid_path) if os.path.exists(self.valid_path) else 0
+
+    def _map(self, rows: int):
+        # (Tái) ánh xạ các file với đúng số dòng hiện có
+        self._rows = rows
+        if rows == 0:
+            self._vectors = self._valid = self._assign = None
+            return
+        self._vectors = np.memmap(self.vectors_path, dtype=np.float16, mode="r+", shape=(rows, self.dim))
+        self._valid = np.memmap(self.valid_path, dtype=np.uint8, mode="r+", shape=(rows,))
+        self._assign = None
+        if self.centroids is not None:
+            self._assign = np.memmap(self.assign_path, dtype=np.int32, mode="r+", shape=(rows,))
+
+    def _grow(self, rows: int):
+        # Nối dài các file (phần mới toàn 0, assign = -1) rồi ánh xạ lại; không bao giờ cắt ngắn
+        # file mà tiến trình khác vừa nối dài hơn
+        for path, itemsize in ((self.vectors_path, 2 * self.dim), (self.valid_path, 1)):
+            with open(path, "ab") as f:
+                if f.tell() < rows * itemsize:
+                    f.truncate(rows * itemsize)
+        if self.centroids is not None:
+            with open(self.assign_path, "ab") as f:
+                missing = rows - f.tell() // 4
+                if missing > 0:
+                    f.write(np.full(missing, -1, dtype=np.int32).tobytes())
+        self._map(self._file_rows())
+
+    def _shift(self, offset: int):
+        # Lùi offset xuống: chép lại từng file với (self.offset - offset) dòng mới ở đầu
+        # (vector/valid = 0, assign = -1) rồi đổi tên vào chỗ cũ
+        extra = self.offset - offset
+        files = [(self.vectors_path, 2 * self.dim, None), (self.valid_path, 1, None)]
+        if self.centroids is not None:
+            files.append((self.assign_path, 4, np.int32(-1)))
+        self._map(0)
+        for path, itemsize, fill in files:
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, "wb") as dst:
+                if fill is None:
+                    dst.truncate(extra * itemsize)
+                    dst.seek(extra * itemsize)
+                else:
+                    for start in range(0, extra, SIMILARITY_BLOCK_ROWS):
+                        dst.write(np.full(min(SIMILARITY_BLOCK_ROWS, extra - start), fill).tobytes())
+                if os.path.exists(path):
+                    with open(path, "rb") as src:
+                        shutil.copyfileobj(src, dst)
+            os.replace(tmp_path, path)
+        self.offset = offset
+        self._write_meta()
+        self.generation += 1
+        self._map(self._file_rows())
+
+    def _refresh(self):
+        # Tiến trình khác có thể đã nối dài file, đã xóa store (file ngắn lại) hoặc đã lùi offset
+        rows = self._file_rows()
+        if rows < self._rows or self._meta_stamp() != self._meta_mtime:
+            self._load_meta()
+            self._map(rows)
+        elif rows != self._rows:
+            self._map(rows)
+
+    # =========================== Write ===========================
+    def put(self, ids, vectors):
+        """
+        Ghi embedding cho các dòng sentiments có id tương ứng.
+
+        Returns:
+            int: Số dòng đã ghi.
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if ids.size == 0:
+            return 0
+        vectors = normalize_rows(vectors)
+        with self._lock:
+            self._refresh()
+            if self.offset is None:
+                self.dim, self.offset = int(vectors.shape[1]), int(ids.min())
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dim {vectors.shape[1]} does not match the store ({self.dim})")
+            if ids.min() < self.offset:
+                self._shift(int(ids.min()))
+
+            rows = ids - self.offset
+            needed = int(rows.max()) + 1
+            if needed > self._rows:
+                self._grow(needed)
+
+            self._vectors[rows] = vectors.astype(np.float16)
+            if self._assign is not None:
+                self._assign[rows] = np.argmax(vectors @ self.centroids.T, axis=1)
+            # Đánh dấu hợp lệ sau cùng để luồng đọc không thấy dòng ghi dở
+            self._valid[rows] = 1
+            return int(rows.size)
+
+    def flush(self):
+        with self._lock:
+            for array in (self._vectors, self._valid, self._assign):
+                if array is not None:
+                    array.flush()
+
+    def clear(self):
+        # Xóa toàn bộ (sau khi xóa lịch sử); id tiếp theo trở thành offset mới
+        with self._lock:
+            self._map(0)
+            for path in (self.vectors_path, self.valid_path, self.assign_path, self.meta_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.dim = self.offset = self._meta_mtime = None
+            self.generation += 1
+
+    # =========================== Read ===========================
+    def snapshot(self) -> tuple:
+        """
+        Returns:
+            tuple: (vectors, valid, assign, offset, centroids, generation) của các dòng hiện có;
+                assign và centroids là None nếu chưa build IVF.
+        """
+        with self._lock:
+            self._refresh()
+            return self._vectors, self._valid, self._assign, self.offset, self.centroids, self.generation
+
+    def __len__(self) -> int:
+        valid = self.snapshot()[1]
+        return 0 if valid is None else int(np.count_nonzero(valid))
+
+    def missing_ids(self, ids) -> np.ndarray:
+        # Các id chưa có embedding trong store
+        ids = np.asarray(ids, dtype=np.int64)
+        _, valid, _, offset, _, _ = self.snapshot()
+        if valid is None:
+            return ids
+        rows = ids - offset
+        present = np.zeros(len(ids), dtype=bool)
+        inside = (rows >= 0) & (rows < len(valid))
+        present[inside] = valid[rows[inside]] == 1
+        return ids[~present]
+
+    # =========================== IVF ===========================
+    def build_ivf(self, nlist: int, sample_size: int = 50000, iterations: int = 10, seed: int = 0):
+        """
+        Chia các embedding thành nlist cụm bằng k-means (cosine) trên một mẫu,
+        rồi gán cụm cho mọi dòng. Các dòng ghi sau đó được gán cụm ngay trong put().
+        """
+        vectors, valid = self.snapshot()[:2]
+        if vectors is None:
+            raise ValueError("The embedding store is empty")
+        valid_rows = np.flatnonzero(valid)
+        if len(valid_rows) < nlist:
+            raise ValueError(f"Need at least {nlist} embeddings to build {nlist} lists, got {len(valid_rows)}")
+
+        rng = np.random.default_rng(seed)
+        sample = np.sort(rng.choice(valid_rows, size=min(sample_size, len(valid_rows)), replace=False))
+        data = normalize_rows(vectors[sample])
+        centroids = data[rng.choice(len(data), size=nlist, replace=False)]
+        for _ in range(iterations):
+            labels = np.argmax(data @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, labels, data)
+            counts = np.bincount(labels, minlength=nlist)
+            # Cụm rỗng được gieo lại bằng một điểm ngẫu nhiên
+            empty = counts == 0
+            sums[empty] = data[rng.choice(len(data), size=int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        with self._lock:
+            self._refresh()
+            assign = np.full(self._rows, -1, dtype=np.int32)
+            for start in range(0, self._rows, SIMILARITY_BLOCK_ROWS):
+                stop = min(start + SIMILARITY_BLOCK_ROWS, self._rows)
+                block = self._vectors[start:stop].astype(np.float32)
+                labels = np.argmax(block @ centroids.T, axis=1).astype(np.int32)
+                assign[start:stop] = np.where(self._valid[start:stop] == 1, labels, -1)
+            assign.tofile(self.assign_path)
+            np.save(self.centroids_path, centroids)
+            self.centroids = centroids
+            self.generation += 1
+            self._map(self._rows)
+
+    def drop_ivf(self):
+        with self._lock:
+            self.centroids = None
+            for path in (self.assign_path, self.centroids_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self.generation += 1
+            self._map(self._rows)
+
+
+# =========================== Similarity Index ===========================
+class SimilarityIndex:
+    """
+    Tìm top-k câu có embedding gần nhất (cosine) trong EmbeddingStore.
+
+    Không có IVF: duyệt toàn bộ theo từng khối block_rows dòng, mỗi khối là một phép nhân
+    ma trận chỉ trên các dòng đã có embedding (bỏ qua khoảng id trống do import/xóa),
+    chỉ giữ lại top-k sau mỗi khối nên bộ nhớ không phụ thuộc số dòng.
+    Có IVF: chỉ chấm điểm các dòng thuộc nprobe cụm gần truy vấn nhất. Danh sách dòng của
+    từng cụm được dựng lại khi số dòng ghi sau lần dựng trước vượt 10%; trong lúc chờ,
+    các dòng đó được lọc trực tiếp theo cụm.
+    """
+
+    def __init__(self, store: EmbeddingStore, block_rows: int = SIMILARITY_BLOCK_ROWS, nprobe: int = IVF_NPROBE):
+        self.store = store
+        self.block_rows = block_rows
+        self.nprobe = nprobe
+        self._lists = None
+        self._lists_lock = threading.Lock()
+
+    def search(self, queries, k: int = 5, exact: bool = False, max_exact_rows: int = None) -> list:
+        """
+        Args:
+            queries: Một vector hoặc ma trận (m, dim) embedding [CLS].
+            k (int): Số kết quả cho mỗi truy vấn.
+            exact (bool): Bỏ qua IVF, duyệt toàn bộ.
+            max_exact_rows (int): Không duyệt toàn bộ khi store có nhiều embedding hơn số này
+                (dùng trên đường xử lý request: chỉ tra IVF khi lịch sử lớn).
+
+        Returns:
+            list: Với mỗi truy vấn, danh sách (id, similarity) giảm dần theo độ tương đồng;
+                None cho mọi truy vấn nếu bị bỏ qua vì vượt max_exact_rows mà chưa có IVF.
+        """
+        queries = normalize_rows(queries)
+        vectors, valid, assign, offset, centroids, generation = self.store.snapshot()
+        if vectors is None:
+            return [[] for _ in queries]
+        if (assign is None or exact) and max_exact_rows is not None and np.count_nonzero(valid) > max_exact_rows:
+            return [None for _ in queries]
+        if assign is None or exact:
+            scores, rows = self._search_rows(queries, vectors, valid, k)
+        else:
+            scores, rows = self._search_ivf(queries, vectors, valid, assign, centroids, generation, k)
+        return [
+            # float16 làm tròn có thể cho giá trị nhỉnh hơn 1
+            [(int(row) + offset, min(float(score), 1.0)) for score, row in zip(query_scores, query_rows) if row >= 0]
+            for query_scores, query_rows in zip(scores, rows)
+        ]
+
+    def _search_rows(self, queries: np.ndarray, vectors, valid, k: int, candidates: np.ndarray = None) -> tuple:
+        # Duyệt (toàn bộ hoặc danh sách candidates) theo khối, gộp top-k sau mỗi khối
+        total = len(vectors) if candidates is None else len(candidates)
+        best_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_rows = np.full((len(queries), k), -1, dtype=np.int64)
+        for start in range(0, total, self.block_rows):
+            stop = min(start + self.block_rows, total)
+            if candidates is None:
+                block_valid = valid[start:stop]
+                if block_valid.all():
+                    rows = np.arange(start, stop)
+                    block = vectors[start:stop]
+                else:
+                    # Chỉ nhân với các dòng đã có embedding (khoảng id trống không tốn phép tính)
+                    rows = start + np.flatnonzero(block_valid)
+                    if not len(rows):
+                        continue
+                    block = vectors[rows]
+            else:
+                rows = candidates[start:stop]
+                rows = rows[valid[rows] == 1]
+                if not len(rows):
+                    continue
+                block = vectors[rows]
+            scores = queries @ block.astype(np.float32).T
+
+            merged_scores = np.concatenate([best_scores, scores], axis=1)
+            merged_rows = np.concatenate([best_rows, np.broadcast_to(rows, scores.shape)], axis=1)
+            top = np.argpartition(-merged_scores, k - 1, axis=1)[:, :k] if merged_scores.shape[1] > k else \
+                np.broadcast_to(np.arange(merged_scores.shape[1]), (len(queries), merged_scores.shape[1]))
+            best_scores = np.take_along_axis(merged_scores, top, axis=1)
+            best_rows = np.take_along_axis(merged_rows, top, axis=1)
+
+        order = np.argsort(-best_scores, axis=1)
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_rows = np.take_along_axis(best_rows, order, axis=1)
+        best_rows[~np.isfinite(best_scores)] = -1
+        return best_scores, best_rows
+
+    def _inverted_lists(self, assign, nlist: int, generation: int) -> tuple:
+        # Danh sách dòng của từng cụm (sắp theo cụm) dựng từ một bản chụp của assign,
+        # cùng các dòng được gán cụm sau bản chụp đó (chưa nằm trong danh sách nào)
+        with self._lists_lock:
+            if self._lists is None or self._lists[3] != generation or len(assign) < len(self._lists[2]):
+                self._lists = self._build_lists(assign, nlist, generation)
+            order, bounds, snapshot, _ = self._lists
+            pending = np.concatenate([np.flatnonzero(assign[:len(snapshot)] != snapshot),
+                                      np.arange(len(snapshot), len(assign))])
+            if len(pending) > max(IVF_REBUILD_MIN_PENDING, len(snapshot) // 10):
+                self._lists = self._build_lists(assign, nlist, generation)
+                order, bounds, snapshot, _ = self._lists
+                pending = np.empty(0, dtype=np.int64)
+            return order, bounds, pending
+
+    @staticmethod
+    def _build_lists(assign, nlist: int, generation: int) -> tuple:
+        snapshot = np.array(assign)
+        order = np.argsort(snapshot, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(snapshot[order], np.arange(nlist + 1))
+        return order, bounds, snapshot, generation
+
+    def _search_ivf(self, queries: np.ndarray, vectors, valid, assign, centroids, generation: int, k: int) -> tuple:
+        order, bounds, pending = self._inverted_lists(assign, len(centroids), generation)
+        probes = np.argsort(-(queries @ centroids.T), axis=1)[:, :self.nprobe]
+        pending_assign = assign[pending]
+        scores, rows = [], []
+        for query, query_probes in zip(queries, probes):
+            candidates = np.unique(np.concatenate(
+                [order[bounds[probe]:bounds[probe + 1]] for probe in query_probes]
+                + [pending[np.isin(pending_assign, query_probes)]]
+            ))
+            query_scores, query_rows = self._search_rows(query[None, :], vectors, valid, k, candidates)
+            scores.append(query_scores[0])
+            rows.append(query_rows[0])
+        return np.array(scores), np.array(rows)
+
+
+# =========================== Backfill / Benchmark ===========================
+def backfill(store: EmbeddingStore, backend: str = MODEL_BACKEND, chunk_size: int = 1000, batch_size: int = 32) -> int:
+    """
+    Tính embedding cho các dòng lịch sử chưa có trong store (ví dụ dòng import hàng loạt
+    hoặc được ghi trước khi có store).
+
+    Returns:
+        int: Số dòng đã bổ sung.
+    """
+    from database import iter_sentiment_rows
+    from model_loading import build_model_pipeline
+    from sentiment_classification import extract_cls_embeddings
+
+    pipeline = None
+    added = 0
+    for rows in iter_sentiment_rows(chunk_size):
+        missing = set(store.missing_ids([row_id for row_id, _, _ in rows]).tolist())
+        todo = [(row_id, text) for row_id, text, _ in rows if row_id in missing]
+        if not todo:
+            continue
+        if pipeline is None:
+            pipeline = build_model_pipeline(backend, use_cache=False)
+        ids, texts = zip(*todo)
+        added += store.put(ids, extract_cls_embeddings(list(texts), pipeline, batch_size))
+        print(f"> Backfilled {added} embeddings")
+    store.flush()
+    return added
+
+
+def benchmark(index: SimilarityIndex, queries: int = 100, k: int = 10, seed: int = 0) -> dict:
+    """
+    So sánh độ trễ duyệt toàn bộ và IVF (nếu đã build), cùng recall@k của IVF,
+    với truy vấn là chính các embedding trong store.
+    """
+    vectors, valid, assign = index.store.snapshot()[:3]
+    valid_rows = np.flatnonzero(valid)
+    rng = np.random.default_rng(seed)
+    probe = vectors[rng.choice(valid_rows, size=min(queries, len(valid_rows)), replace=False)].astype(np.float32)
+
+    report = {"rows": int(len(valid_rows)), "queries": len(probe), "k": k}
+    start = time.perf_counter()
+    exact = [index.search(query, k, exact=True)[0] for query in probe]
+    report["exact_ms"] = (time.perf_counter() - start) * 1000 / len(probe)
+    if assign is not None:
+        start = time.perf_counter()
+        approx = [index.search(query, k)[0] for query in probe]
+        report["ivf_ms"] = (time.perf_counter() - start) * 1000 / len(probe)
+        report["ivf_recall"] = float(np.mean([
+            len({i for i, _ in a} & {i for i, _ in e}) / max(1, len(e)) for a, e in zip(approx, exact)
+        ]))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the history embedding store and its similarity index.")
+    parser.add_argument("command", choices=["backfill", "build-ivf", "drop-ivf", "bench"])
+    parser.add_argument("--directory", default=EMBEDDING_STORE_DIR)
+    parser.add_argument("--backend", default=MODEL_BACKEND, help="Encoder backend for 'backfill'")
+    parser.add_argument("--nlist", type=int, default=1024, help="Number of IVF lists for 'build-ivf'")
+    parser.add_argument("--nprobe", type=int, default=IVF_NPROBE, help="Lists probed per query for 'bench'")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    args = parser.parse_args()
+
+    store = EmbeddingStore(args.directory)
+    if args.command == "backfill":
+        from database import initialize_database
+
+        initialize_database()
+        print(f"> Done. {backfill(store, args.backend)} embeddings added")
+    elif args.command == "build-ivf":
+        start = time.perf_counter()
+        store.build_ivf(args.nlist)
+        print(f"> Built {args.nlist} IVF lists over {len(store)} embeddings in {time.perf_counter() - start:.1f}s")
+    elif args.command == "drop-ivf":
+        store.drop_ivf()
+        print("> IVF removed, searches scan every row")
+    else:
+        print(f"> {benchmark(SimilarityIndex(store, nprobe=args.nprobe), args.queries, args.k)}")
@@ -0,0 +1,169 @@
+import argparse
+import csv
+import gzip
+import os
+import time
+
+from constant import EXPORT_CHUNK_ROWS, EXPORT_PARQUET_COMPRESSION
+from database import (
+    clear_export_checkpoint, initialize_database, load_export_checkpoint, save_export_checkpoint,
+    stream_sentiment_rows,
+)
+
+COLUMNS = ["id", "text", "sentiment", "timestamp"]
+
+
+# =========================== Output Writers ===========================
+class CsvExportWriter:
+    """
+    Ghi từng khối dòng vào file CSV (nén gzip nếu đuôi .gz), timestamp giữ nguyên dạng 'YYYY-MM-DD HH:MM:SS' (UTC).
+    """
+
+    def __init__(self, path: str):
+        if path.lower().endswith(".gz"):
+            # Mức nén mặc định của lệnh gzip: nhanh hơn nhiều so với mức 9 mà file chỉ lớn hơn chút ít
+            self.file = gzip.open(path, "wt", compresslevel=6, encoding="utf-8", newline="")
+        else:
+            self.file = open(path, "w", encoding="utf-8", newline="")
+        self.writer = csv.writer(self.file, lineterminator="\n")
+        self.writer.writerow(COLUMNS)
+
+    def write(self, rows: list):
+        self.writer.writerows(rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ParquetExportWriter:
+    """
+    Ghi mỗi khối dòng thành một row group Parquet; timestamp được chuyển sang kiểu timestamp (UTC).
+    """
+
+    def __init__(self, path: str, compression: str = EXPORT_PARQUET_COMPRESSION):
+        try:
+            import pyarrow as pa
+            import pyarrow.compute as pc
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError("Parquet export requires pyarrow: pip install pyarrow") from e
+
+        self.pa, self.pc = pa, pc
+        self.schema = pa.schema([
+            ("id", pa.int64()),
+            ("text", pa.string()),
+            ("sentiment", pa.string()),
+            ("timestamp", pa.timestamp("ms", tz="UTC")),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema, compression=compression)
+
+    def write(self, rows: list):
+        ids, texts, sentiments, timestamps = zip(*rows)
+        pa, pc = self.pa, self.pc
+        timestamp = pc.strptime(pa.array(timestamps, pa.string()), format="%Y-%m-%d %H:%M:%S", unit="s")
+        table = pa.Table.from_arrays([
+            pa.array(ids, pa.int64()),
+            pa.array(texts, pa.string()),
+            pa.array(sentiments, pa.string()),
+            timestamp.cast(self.schema.field("timestamp").type),
+        ], schema=self.schema)
+        self.writer.write_table(table, row_group_size=len(rows))
+
+    def close(self):
+        self.writer.close()
+
+
+WRITERS = {"csv": CsvExportWriter, "parquet": ParquetExportWriter}
+
+
+def detect_format(path: str) -> str:
+    return "parquet" if path.lower().endswith((".parquet", ".pq")) else "csv"
+
+
+# =========================== Export ===========================
+def export_history(path: str, fmt: str = None, after_id: int = 0, start_time: str = None, end_time: str = None,
+                   checkpoint: str = None, chunk_size: int = EXPORT_CHUNK_ROWS) -> dict:
+    """
+    Export bảng sentiments ra CSV/Parquet theo từng khối, bộ nhớ chỉ giữ một khối dù bảng lớn đến đâu.
+
+    Dữ liệu được ghi vào file tạm rồi đổi tên khi xong, nên file đích không bao giờ ở trạng thái ghi dở.
+    Với checkpoint (tên một luồng export), chỉ các dòng có id lớn hơn watermark đã lưu được export,
+    và watermark chỉ tiến lên sau khi file đã ghi xong.
+
+    Args:
+        path: File đích (.csv, .csv.gz, .parquet)
+        fmt: "csv" hoặc "parquet" (mặc định: theo đuôi file)
+        after_id: Chỉ export các dòng có id > after_id
+        start_time, end_time: Khoảng thời gian 'YYYY-MM-DD HH:MM:SS' (UTC)
+        checkpoint: Tên watermark cho export tăng dần
+        chunk_size: Số dòng mỗi lần fetchmany / mỗi row group
+
+    Returns:
+        dict: Số dòng, id đầu/cuối đã export, đường dẫn và thời gian (giây).
+    """
+    fmt = fmt or detect_format(path)
+    rows_before = 0
+    if checkpoint:
+        checkpoint_id, rows_before = load_export_checkpoint(checkpoint)
+        after_id = max(after_id, checkpoint_id)
+
+    start = time.perf_counter()
+    # File tạm cùng thư mục, giữ nguyên đuôi (.gz quyết định có nén hay không)
+    tmp_path = os.path.join(os.path.dirname(path), f".tmp-{os.path.basename(path)}")
+    writer = None
+    report = {"path": path, "format": fmt, "rows": 0, "first_id": None, "last_id": None}
+    try:
+        for rows in stream_sentiment_rows(after_id, start_time=start_time, end_time=end_time, chunk_size=chunk_size):
+            # Chỉ tạo file khi có dữ liệu: export tăng dần không có dòng mới thì không sinh file rỗng
+            if writer is None:
+                writer = WRITERS[fmt](tmp_path)
+                report["first_id"] = rows[0][0]
+            writer.write(rows)
+            report["rows"] += len(rows)
+            report["last_id"] = rows[-1][0]
+            print(f"> Exported {report['rows']} rows (id {report['last_id']}, {time.perf_counter() - start:.1f}s)")
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+
+    if writer is not None:
+        writer.close()
+        os.replace(tmp_path, path)
+        if checkpoint:
+            save_export_checkpoint(checkpoint, report["last_id"], rows_before + report["rows"])
+    report["seconds"] = time.perf_counter() - start
+    return report
+
+
+# =========================== Main ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Stream the sentiments history table to CSV or Parquet.")
+    parser.add_argument("output", help="Path to a .csv, .csv.gz or .parquet file")
+    parser.add_argument("--format", choices=list(WRITERS), help="Output format (default: from file extension)")
+    parser.add_argument("--after-id", type=int, default=0, help="Only export rows with a larger id")
+    parser.add_argument("--since", help="Only export rows at or after this UTC timestamp (YYYY-MM-DD HH:MM:SS)")
+    parser.add_argument("--until", help="Only export rows at or before this UTC timestamp")
+    parser.add_argument("--checkpoint", help="Name of a saved watermark: export only rows added since its last run")
+    parser.add_argument("--restart", action="store_true", help="Reset the --checkpoint watermark before exporting")
+    parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_ROWS,
+                        help=f"Rows per fetch / Parquet row group (default: {EXPORT_CHUNK_ROWS})")
+    args = parser.parse_args()
+    if args.restart and not args.checkpoint:
+        parser.error("--restart requires --checkpoint")
+
+    initialize_database()
+    if args.restart:
+        clear_export_checkpoint(args.checkpoint)
+    report = export_history(args.output, args.format, args.after_id, args.since, args.until,
+                            args.checkpoint, args.chunk_size)
+    if not report["rows"]:
+        print("> No rows to export")
+    else:
+        print(f"> Done. {report['rows']} rows (id {report['first_id']}..{report['last_id']}) "
+              f"written to {args.output} in {report['seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+import argparse
+import os
+import time
+
+import joblib
+import numpy as np
+from sklearn.linear_model import SGDClassifier
+
+from constant import (
+    CLASSIFIER_HEAD_PATH, INCREMENTAL_CALIBRATION_ROWS, INCREMENTAL_HOLDOUT_FRACTION, INCREMENTAL_REPLAY_ROWS,
+    INCREMENTAL_STATE_PATH, MODEL_REGISTRY_DIR,
+)
+from linear_head import LinearHead
+from sentiment_classification import LABEL_MAP
+
+# Lớp theo thứ tự chỉ số như SVC gốc (0=NEGATIVE, 1=NEUTRAL, 2=POSITIVE)
+CLASSES = np.array(sorted(LABEL_MAP), dtype=np.int64)
+LABEL_IDS = {label: idx for idx, label in LABEL_MAP.items()}
+
+
+# =========================== Platt Scaling ===========================
+def fit_sigmoid(decision: np.ndarray, positive: np.ndarray, max_iter: int = 100) -> tuple:
+    """
+    Ước lượng (A, B) sao cho P(positive | f) = 1 / (1 + exp(A * f + B)), cùng thuật toán
+    Newton có line search và nhãn làm mềm theo prior như sigmoid_train của libsvm.
+
+    Returns:
+        tuple: (A, B)
+    """
+    decision = np.asarray(decision, dtype=np.float64)
+    positive = np.asarray(positive, dtype=bool)
+    prior1 = float(positive.sum())
+    prior0 = float(len(positive) - prior1)
+    target = np.where(positive, (prior1 + 1) / (prior1 + 2), 1 / (prior0 + 2))
+
+    def objective(a, b):
+        f_ap_b = decision * a + b
+        return float(np.sum(np.where(
+            f_ap_b >= 0,
+            target * f_ap_b + np.log1p(np.exp(-np.abs(f_ap_b))),
+            (target - 1) * f_ap_b + np.log1p(np.exp(-np.abs(f_ap_b))),
+        )))
+
+    a, b = 0.0, float(np.log((prior0 + 1) / (prior1 + 1)))
+    value = objective(a, b)
+    sigma = 1e-12
+    for _ in range(max_iter):
+        f_ap_b = decision * a + b
+        # p = P(positive), q = 1 - p, tính theo dạng ổn định số học
+        e = np.exp(-np.abs(f_ap_b))
+        p = np.where(f_ap_b >= 0, e / (1 + e), 1 / (1 + e))
+        q = 1 - p
+        d2 = p * q
+        h11 = sigma + float(np.sum(decision * decision * d2))
+        h22 = sigma + float(np.sum(d2))
+        h21 = float(np.sum(decision * d2))
+        d1 = target - p
+        g1 = float(np.sum(decision * d1))
+        g2 = float(np.sum(d1))
+        if abs(g1) < 1e-5 and abs(g2) < 1e-5:
+            break
+
+        det = h11 * h22 - h21 * h21
+        delta_a = -(h22 * g1 - h21 * g2) / det
+        delta_b = -(-h21 * g1 + h11 * g2) / det
+        gradient_step = g1 * delta_a + g2 * delta_b
+        step = 1.0
+        while step >= 1e-10:
+            new_a, new_b = a + step * delta_a, b + step * delta_b
+            new_value = objective(new_a, new_b)
+            if new_value < value + 1e-4 * step * gradient_step:
+                a, b, value = new_a, new_b, new_value
+                break
+            step /= 2
+        if step < 1e-10:
+            break
+    return a, b
+
+
+# =========================== Incremental Head ===========================
+class IncrementalHead:
+    """
+    Classifier one-vs-one cập nhật tăng dần, xuất ra cùng định dạng LinearHead như SVC.
+
+    Mỗi cặp lớp (i, j) có một SGDClassifier (hinge loss, tức SVM tuyến tính) học bằng
+    partial_fit trên các dòng thuộc i hoặc j, với i là lớp dương để giá trị quyết định > 0
+    bỏ phiếu cho i như SVC. Đặc trưng được chuẩn hóa bằng mean/scale cố định từ lần khởi tạo
+    (gộp vào coef/intercept khi export). Tham số Platt của từng cặp được ước lượng lại sau mỗi
+    lần cập nhật trên kho dòng giữ lại (không dùng để train).
+
+    Kho replay giữ một mẫu ngẫu nhiên các dòng đã train, trộn vào mỗi lần cập nhật để
+    mô hình không quên dữ liệu cũ khi chỉ học trên một nhóm nhỏ dòng mới.
+    """
+
+    def __init__(self, mean: np.ndarray, scale: np.ndarray, alpha: float = 1e-4, seed: int = 42):
+        self.mean = np.asarray(mean, dtype=np.float32)
+        self.scale = np.asarray(scale, dtype=np.float32)
+        self.pairs = [(i, j) for i in range(len(CLASSES)) for j in range(i + 1, len(CLASSES))]
+        self.learners = [
+            SGDClassifier(loss="hinge", alpha=alpha, average=True, random_state=seed) for _ in self.pairs
+        ]
+        # Trước lần hiệu chỉnh đầu tiên: P(i | i hoặc j) = sigmoid(f)
+        self.prob_a = np.full(len(self.pairs), -1.0)
+        self.prob_b = np.zeros(len(self.pairs))
+        n_features = len(self.mean)
+        self.replay_X = np.empty((0, n_features), dtype=np.float16)
+        self.replay_y = np.empty(0, dtype=np.int64)
+        self.calibration_X = np.empty((0, n_features), dtype=np.float16)
+        self.calibration_y = np.empty(0, dtype=np.int64)
+        self.rng = np.random.default_rng(seed)
+        self.rows_seen = 0
+        self.updates = 0
+        # id lớn nhất của bảng sentiments đã dùng (--history)
+        self.last_history_id = 0
+
+    @classmethod
+    def bootstrap(cls, features: np.ndarray, **kwargs):
+        # Cố định tham số chuẩn hóa từ tập dữ liệu ban đầu (cột hằng số giữ scale 1 như StandardScaler)
+        features = np.asarray(features, dtype=np.float32)
+        scale = features.std(axis=0)
+        scale[scale < 1e-8] = 1.0
+        return cls(features.mean(axis=0), scale, **kwargs)
+
+    @property
+    def trained(self) -> bool:
+        return self.updates > 0
+
+    # =========================== Training ===========================
+    def _scaled(self, features: np.ndarray) -> np.ndarray:
+        return (np.asarray(features, dtype=np.float32) - self.mean) / self.scale
+
+    def partial_fit(self, features: np.ndarray, labels: np.ndarray, epochs: int = 5):
+        # Mỗi epoch duyệt các dòng theo thứ tự ngẫu nhiên mới
+        scaled = self._scaled(features)
+        labels = np.asarray(labels, dtype=np.int64)
+        for _ in range(epochs):
+            order = self.rng.permutation(len(labels))
+            scaled, labels = scaled[order], labels[order]
+            for (i, j), learner in zip(self.pairs, self.learners):
+                mask = (labels == i) | (labels == j)
+                if mask.any():
+                    learner.partial_fit(scaled[mask], (labels[mask] == i).astype(np.int64), classes=[0, 1])
+
+    def decision_function(self, features: np.ndarray) -> np.ndarray:
+        # Giá trị quyết định (n_samples, n_pairs), cặp chưa có dữ liệu nào cho giá trị 0
+        scaled = self._scaled(features)
+        decision = np.zeros((len(scaled), len(self.pairs)))
+        for pair_idx, learner in enumerate(self.learners):
+            if hasattr(learner, "coef_"):
+                decision[:, pair_idx] = learner.decision_function(scaled)
+        return decision
+
+    def calibrate(self, min_rows: int = 2):
+        """
+        Ước lượng lại (A, B) của từng cặp trên kho dòng giữ lại. Cặp chưa có đủ dòng
+        của cả hai lớp giữ nguyên tham số cũ.
+        """
+        decision = self.decision_function(self.calibration_X)
+        for pair_idx, (i, j) in enumerate(self.pairs):
+            mask = (self.calibration_y == i) | (self.calibration_y == j)
+            positive = self.calibration_y[mask] == i
+            if positive.sum() < min_rows or (~positive).sum() < min_rows:
+                continue
+            self.prob_a[pair_idx], self.prob_b[pair_idx] = fit_sigmoid(decision[mask, pair_idx], positive)
+
+    def _remember(self, name: str, features: np.ndarray, labels: np.ndarray, max_rows: int):
+        # Nối thêm vào kho; vượt quá max_rows thì giữ lại một mẫu ngẫu nhiên (dòng mới có tỉ trọng cao hơn)
+        X = np.concatenate([getattr(self, f"{name}_X"), np.asarray(features, dtype=np.float16)])
+        y = np.concatenate([getattr(self, f"{name}_y"), np.asarray(labels, dtype=np.int64)])
+        if len(y) > max_rows:
+            keep = np.sort(self.rng.choice(len(y), size=max_rows, replace=False))
+            X, y = X[keep], y[keep]
+        setattr(self, f"{name}_X", X)
+        setattr(self, f"{name}_y", y)
+
+    def update(self, features: np.ndarray, labels: np.ndarray, epochs: int = 5,
+               holdout_fraction: float = INCREMENTAL_HOLDOUT_FRACTION, replay_ratio: float = 1.0,
+               replay_rows: int = INCREMENTAL_REPLAY_ROWS, calibration_rows: int = INCREMENTAL_CALIBRATION_ROWS) -> dict:
+        """
+        Cập nhật head với các dòng có nhãn mới.
+
+        Một phần dòng mới (holdout_fraction) được giữ lại để đánh giá và hiệu chỉnh xác suất,
+        phần còn lại được train cùng tối đa replay_ratio lần số dòng đó lấy từ kho replay.
+
+        Returns:
+            dict: Số dòng, độ chính xác trên phần giữ lại trước/sau khi cập nhật và thời gian (giây).
+        """
+        start = time.perf_counter()
+        features = np.asarray(features, dtype=np.float32)
+        labels = np.asarray(labels, dtype=np.int64)
+        holdout = self.rng.random(len(labels)) < holdout_fraction
+        train_X, train_y = features[~holdout], labels[~holdout]
+        held_X, held_y = features[holdout], labels[holdout]
+        report = {"rows": len(labels), "train_rows": int(len(train_y)), "holdout_rows": int(len(held_y))}
+        report["holdout_accuracy_before"] = self.accuracy(held_X, held_y) if self.trained else None
+
+        n_replay = min(len(self.replay_y), int(round(replay_ratio * len(train_y))))
+        replay = self.rng.choice(len(self.replay_y), size=n_replay, replace=False)
+        report["replay_rows"] = n_replay
+        if len(train_y):
+            self.partial_fit(
+                np.concatenate([train_X, self.replay_X[replay].astype(np.float32)]),
+                np.concatenate([train_y, self.replay_y[replay]]),
+                epochs,
+            )
+            self._remember("replay", train_X, train_y, replay_rows)
+        if len(held_y):
+            self._remember("calibration", held_X, held_y, calibration_rows)
+        self.calibrate()
+        self.rows_seen += len(labels)
+        self.updates += 1
+
+        report["holdout_accuracy_after"] = self.accuracy(held_X, held_y)
+        report["calibration_rows"] = int(len(self.calibration_y))
+        report["calibration_accuracy"] = self.accuracy(self.calibration_X, self.calibration_y)
+        report["seconds"] = time.perf_counter() - start
+        return report
+
+    # =========================== Export ===========================
+    def to_head(self) -> LinearHead:
+        """
+        Xuất ra LinearHead trên đặc trưng gốc: w·(x - mean)/scale + b = (w/scale)·x + (b - (w/scale)·mean).
+        """
+        coef = np.zeros((len(self.pairs), len(self.mean)))
+        intercept = np.zeros(len(self.pairs))
+        for pair_idx, learner in enumerate(self.learners):
+            if hasattr(learner, "coef_"):
+                coef[pair_idx] = learner.coef_[0] / self.scale
+                intercept[pair_idx] = learner.intercept_[0] - coef[pair_idx] @ self.mean
+        return LinearHead(
+            coef, intercept, self.prob_a, self.prob_b, CLASSES, self.pairs,
+            source_hash=f"incremental:{self.updates}:{self.rows_seen}",
+        )
+
+    def accuracy(self, features: np.ndarray, labels: np.ndarray):
+        # Độ chính xác của head đã export (cùng cách bỏ phiếu như khi suy luận), None nếu không có dòng nào
+        if not len(labels):
+            return None
+        return float(np.mean(self.to_head().predict(np.asarray(features, dtype=np.float32)) == labels))
+
+
+def load_state(path: str = INCREMENTAL_STATE_PATH):
+    # None nếu chưa có trạng thái (cần bootstrap)
+    if not os.path.exists(path):
+        return None
+    state = IncrementalHead.__new__(IncrementalHead)
+    state.__dict__.update(joblib.load(path))
+    return state
+
+
+def save_state(state: IncrementalHead, path: str = INCREMENTAL_STATE_PATH):
+    # Lưu dict thuộc tính thay vì đối tượng để file đọc được dù script chạy dưới tên __main__;
+    # ghi ra file tạm rồi đổi tên để lần chạy bị ngắt giữa chừng không làm hỏng trạng thái cũ
+    tmp_path = f"{path}.tmp"
+    joblib.dump(dict(vars(state)), tmp_path)
+    os.replace(tmp_path, path)
+
+
+# =========================== Data ===========================
+def to_label_ids(labels) -> np.ndarray:
+    # Nhận cả chỉ số 0/1/2 lẫn tên nhãn (NEGATIVE/NEUTRAL/POSITIVE)
+    return np.array([LABEL_IDS[label] if label in LABEL_IDS else int(label) for label in labels], dtype=np.int64)
+
+
+def rows_from_csv(path: str) -> tuple:
+    """
+    Đọc file CSV (cột text, label) và tiền xử lý văn bản như khi train.
+
+    Returns:
+        tuple: (texts, labels)
+    """
+    import pandas as pd
+    from preprocessing import preprocess_batch
+
+    df = pd.read_csv(path)
+    texts, _ = preprocess_batch(df["text"].astype(str).tolist())
+    return texts, to_label_ids(df["label"].tolist())
+
+
+def rows_from_history(after_id: int = 0, ids: list = None, chunk_size: int = 1000) -> tuple:
+    """
+    Đọc các dòng của bảng sentiments (văn bản đã tách từ khi lưu), lấy nhãn đang lưu làm nhãn đúng:
+    hoặc các dòng có id > after_id, hoặc đúng các id trong ids (ví dụ các dòng vừa được sửa nhãn).
+
+    Returns:
+        tuple: (texts, labels, id lớn nhất đã đọc)
+    """
+    from database import iter_sentiment_rows, load_sentiments_by_ids
+
+    texts, labels, last_id = [], [], after_id
+    if ids is not None:
+        for start in range(0, len(ids), chunk_size):
+            found = load_sentiments_by_ids(ids[start:start + chunk_size])
+            for row in found.values():
+                texts.append(row["text"])
+                labels.append(row["sentiment"])
+        return texts, to_label_ids(labels), last_id
+
+    for rows in iter_sentiment_rows(chunk_size, after_id):
+        for row_id, text, sentiment in rows:
+            texts.append(text)
+            labels.append(sentiment)
+        last_id = rows[-1][0]
+    return texts, to_label_ids(labels), last_id
+
+
+def print_report(report: dict):
+    def fmt(value):
+        return "n/a" if value is None else f"{value:.4f}"
+
+    print(f"> Rows: {report['rows']} (train {report['train_rows']}, held out {report['holdout_rows']}, "
+          f"replayed {report['replay_rows']})")
+    print(f"> Held-out accuracy: {fmt(report['holdout_accuracy_before'])} -> {fmt(report['holdout_accuracy_after'])}")
+    print(f"> Calibration set accuracy: {fmt(report['calibration_accuracy'])} ({report['calibration_rows']} rows)")
+    print(f"> Update took {report['seconds']:.2f} seconds")
+
+
+# =========================== Main ===========================
+def main():
+    parser = argparse.ArgumentParser(description="Update the classifier head incrementally from new labelled rows.")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--csv", help="CSV file with text,label columns (label 0/1/2 or NEGATIVE/NEUTRAL/POSITIVE)")
+    source.add_argument("--history", action="store_true",
+                        help="Use rows of the sentiments table, trusting their stored labels")
+    parser.add_argument("--since-id", type=int, help="With --history: only rows with a larger id "
+                                                     "(default: continue after the last row used)")
+    parser.add_argument("--ids", help="With --history: file with one sentiments id per line (e.g. corrected rows)")
+    parser.add_argument("--bootstrap-csv", default="data_sentiment_vn.csv",
+                        help="Corpus used to initialise the learners when there is no state yet")
+    parser.add_argument("--reset", action="store_true", help="Discard the saved state and bootstrap again")
+    parser.add_argument("--state", default=INCREMENTAL_STATE_PATH)
+    parser.add_argument("--epochs", type=int, default=5, help="Passes over each update batch")
+    parser.add_argument("--bootstrap-epochs", type=int, default=20)
+    parser.add_argument("--alpha", type=float, default=1e-4, help="L2 regularization of new learners (bootstrap only)")
+    parser.add_argument("--embedding-dtype", choices=["float32", "float16"], default="float32")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Always re-encode every text")
+    parser.add_argument("--output", help="Also save the head to this .npz path")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR)
+    parser.add_argument("--version", help="Registry version name (default: timestamp)")
+    parser.add_argument("--no-publish", action="store_true", help="Do not publish the head to the model registry")
+    parser.add_argument("--no-activate", action="store_true", help="Publish without switching to the new version")
+    args = parser.parse_args()
+    if (args.since_id is not None or args.ids) and not args.history:
+        parser.error("--since-id and --ids require --history")
+    if args.output and os.path.abspath(args.output) == os.path.abspath(CLASSIFIER_HEAD_PATH):
+        # load_head export lại file này từ pickle SVC khi hash nguồn không khớp
+        parser.error(f"{CLASSIFIER_HEAD_PATH} is regenerated from the SVC pickle; publish to the registry instead")
+
+    from train_svm_phobert import load_features
+
+    def features_for(texts):
+        return load_features(texts, args.embedding_dtype, use_cache=not args.no_embedding_cache)
+
+    start_time = time.time()
+    state = None if args.reset else load_state(args.state)
+    reports = []
+    if state is None:
+        print(f"> No incremental state, bootstrapping from {args.bootstrap_csv}...")
+        texts, labels = rows_from_csv(args.bootstrap_csv)
+        features = features_for(texts)
+        state = IncrementalHead.bootstrap(features, alpha=args.alpha)
+        reports.append(state.update(features, labels, epochs=args.bootstrap_epochs))
+        print_report(reports[-1])
+
+    last_id = None
+    if args.csv:
+        texts, labels = rows_from_csv(args.csv)
+    elif args.history:
+        ids = None
+        if args.ids:
+            with open(args.ids, encoding="utf-8") as f:
+                ids = [int(line) for line in f if line.strip()]
+        since_id = args.since_id if args.since_id is not None else state.last_history_id
+        texts, labels, last_id = rows_from_history(since_id, ids)
+    else:
+        texts, labels = [], np.empty(0, dtype=np.int64)
+
+    if len(texts):
+        print(f"> Updating with {len(texts)} labelled rows...")
+        reports.append(state.update(features_for(texts), labels, epochs=args.epochs))
+        print_report(reports[-1])
+        if last_id is not None:
+            state.last_history_id = max(state.last_history_id, last_id)
+    elif not reports:
+        print("> No new labelled rows, nothing to update")
+        return
+
+    save_state(state, args.state)
+    print(f"> Saved incremental state to {args.state}")
+    head = state.to_head()
+    if args.output:
+        head.save(args.output)
+        print(f"> Saved linear head to {args.output}")
+    if not args.no_publish:
+        from model_registry import publish_head
+
+        report = reports[-1]
+        metrics = {
+            "accuracy": report["calibration_accuracy"],
+            "holdout_accuracy_before": report["holdout_accuracy_before"],
+            "holdout_accuracy_after": report["holdout_accuracy_after"],
+            "trainer": "incremental-sgd",
+            "rows_seen": state.rows_seen,
+            "updates": state.updates,
+        }
+        publish_head(head, metrics, args.version, not args.no_activate, registry_dir=args.registry)
+
+    print(f"> Incremental update completed in {time.time() - start_time:.2f} seconds.")
+
+
+if __name__ == "__main__":
+    main()
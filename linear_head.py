@@ -0,0 +1,257 @@
+import argparse
+import hashlib
+import os
+
+import numpy as np
+
+from constant import CLASSIFIER_HEAD_PATH, CLASSIFIER_PATH
+
+# Ngưỡng xác suất cặp mà libsvm dùng khi ghép xác suất nhiều lớp
+_MIN_PROB = 1e-7
+
+
+class LinearHead:
+    """
+    Đầu phân loại tuyến tính thuần NumPy thay cho SVC(kernel='linear', probability=True).
+
+    SVC nhiều lớp dùng one-vs-one: mỗi cặp lớp (i, j) có một siêu phẳng và tham số
+    Platt (A, B). Toàn bộ giá trị quyết định của một batch được tính bằng một phép nhân
+    ma trận; nhãn lấy theo bỏ phiếu giữa các cặp (giống SVC.predict), xác suất ghép từ
+    các xác suất cặp theo đúng thuật toán của libsvm (giống SVC.predict_proba).
+    """
+
+    def __init__(self, coef, intercept, prob_a, prob_b, classes, pairs, source_hash: str = ""):
+        self.coef = np.asarray(coef, dtype=np.float64)
+        self.intercept = np.asarray(intercept, dtype=np.float64)
+        self.prob_a = np.asarray(prob_a, dtype=np.float64)
+        self.prob_b = np.asarray(prob_b, dtype=np.float64)
+        self.classes_ = np.asarray(classes)
+        self.pairs = np.asarray(pairs, dtype=np.int64)
+        self.source_hash = source_hash
+
+        # Ma trận (n_features, n_pairs) liên tục trong bộ nhớ cho phép nhân
+        self._weights = np.ascontiguousarray(self.coef.T)
+
+    # =========================== Export / Load ===========================
+    @classmethod
+    def from_svc(cls, svc, source_hash: str = ""):
+        """
+        Tạo head từ một SVC tuyến tính đã train với probability=True.
+        """
+        if svc.kernel != "linear":
+            raise ValueError(f"Only linear SVC can be exported, got kernel='{svc.kernel}'")
+        if not getattr(svc, "probability", False):
+            raise ValueError("SVC must be trained with probability=True")
+
+        n_classes = len(svc.classes_)
+        pairs = [(i, j) for i in range(n_classes) for j in range(i + 1, n_classes)]
+        return cls(svc.coef_, svc.intercept_, svc.probA_, svc.probB_, svc.classes_, pairs, source_hash)
+
+    @classmethod
+    def load(cls, path: str = CLASSIFIER_HEAD_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            return cls.from_arrays(data)
+
+    @classmethod
+    def from_arrays(cls, data, prefix: str = ""):
+        # Đọc các mảng tham số (có thể có tiền tố khi nhiều head nằm chung một file)
+        return cls(
+            data[f"{prefix}coef"], data[f"{prefix}intercept"], data[f"{prefix}prob_a"], data[f"{prefix}prob_b"],
+            data[f"{prefix}classes"], data[f"{prefix}pairs"], str(data[f"{prefix}source_hash"]),
+        )
+
+    def to_arrays(self, prefix: str = "") -> dict:
+        arrays = {
+            "coef": self.coef, "intercept": self.intercept, "prob_a": self.prob_a, "prob_b": self.prob_b,
+            "classes": self.classes_, "pairs": self.pairs, "source_hash": np.array(self.source_hash),
+        }
+        return {f"{prefix}{name}": value for name, value in arrays.items()}
+
+    def save(self, path: str = CLASSIFIER_HEAD_PATH):
+        _save_npz(path, self.to_arrays())
+
+    # =========================== Inference ===========================
+    def decision_function(self, features: np.ndarray) -> np.ndarray:
+        # Giá trị quyết định one-vs-one (n_samples, n_pairs)
+        return np.asarray(features, dtype=np.float64) @ self._weights + self.intercept
+
+    def predict_with_proba(self, features: np.ndarray) -> tuple:
+        """
+        Trả về (nhãn, ma trận xác suất) cho cả batch từ một phép nhân ma trận.
+        """
+        decision = self.decision_function(features)
+        return self._vote(decision), self._couple(decision)
+
+    def predict(self, features: np.ndarray) -> np.ndarray:
+        return self._vote(self.decision_function(features))
+
+    def predict_proba(self, features: np.ndarray) -> np.ndarray:
+        return self._couple(self.decision_function(features))
+
+    def _vote(self, decision: np.ndarray) -> np.ndarray:
+        # Mỗi cặp (i, j) bỏ phiếu cho i nếu giá trị quyết định > 0, ngược lại cho j
+        n_samples = decision.shape[0]
+        votes = np.zeros((n_samples, len(self.classes_)), dtype=np.int64)
+        positive = decision > 0
+        rows = np.arange(n_samples)
+        for pair_idx, (i, j) in enumerate(self.pairs):
+            winners = np.where(positive[:, pair_idx], i, j)
+            np.add.at(votes, (rows, winners), 1)
+        # Hòa phiếu thì chọn lớp có chỉ số nhỏ hơn, giống libsvm
+        return self.classes_[np.argmax(votes, axis=1)]
+
+    def _couple(self, decision: np.ndarray) -> np.ndarray:
+        # Xác suất cặp theo Platt scaling: P(i | i hoặc j) = 1 / (1 + exp(A * f + B))
+        f_ap_b = decision * self.prob_a + self.prob_b
+        pairwise = np.where(
+            f_ap_b >= 0,
+            np.exp(-np.abs(f_ap_b)) / (1 + np.exp(-np.abs(f_ap_b))),
+            1 / (1 + np.exp(-np.abs(f_ap_b))),
+        )
+        pairwise = np.clip(pairwise, _MIN_PROB, 1 - _MIN_PROB)
+
+        n_samples, k = decision.shape[0], len(self.classes_)
+        r = np.zeros((n_samples, k, k))
+        for pair_idx, (i, j) in enumerate(self.pairs):
+            r[:, i, j] = pairwise[:, pair_idx]
+            r[:, j, i] = 1 - pairwise[:, pair_idx]
+        return _multiclass_probability(r)
+
+
+def _multiclass_probability(r: np.ndarray) -> np.ndarray:
+    """
+    Ghép xác suất cặp r[:, i, j] thành xác suất từng lớp (Wu, Lin & Weng 2004, phương pháp 2),
+    cùng vòng lặp và điều kiện dừng với multiclass_probability của libsvm, vector hóa theo batch.
+    """
+    n_samples, k = r.shape[0], r.shape[1]
+    squared = r ** 2
+    # Q[t][t] = sum_{j != t} r[j][t]^2, Q[t][j] = -r[j][t] * r[t][j]
+    Q = -np.transpose(r, (0, 2, 1)) * r
+    diag = squared.sum(axis=1) - np.einsum("ntt->nt", squared)
+    idx = np.arange(k)
+    Q[:, idx, idx] = diag
+
+    p = np.full((n_samples, k), 1.0 / k)
+    eps = 0.005 / k
+    active = np.arange(n_samples)
+
+    for _ in range(max(100, k)):
+        # Tính lại Qp và pQp ở đầu mỗi vòng lặp như libsvm, chỉ cho các mẫu chưa hội tụ
+        Qp = np.einsum("ntj,nj->nt", Q[active], p[active])
+        pQp = np.einsum("nt,nt->n", p[active], Qp)
+        max_error = np.max(np.abs(Qp - pQp[:, None]), axis=1)
+        keep = max_error >= eps
+        active, Qp, pQp = active[keep], Qp[keep], pQp[keep]
+        if active.size == 0:
+            break
+
+        p_active = p[active]
+        for t in range(k):
+            q_tt = Q[active, t, t]
+            diff = (-Qp[:, t] + pQp) / q_tt
+            p_active[:, t] += diff
+            pQp = (pQp + diff * (diff * q_tt + 2 * Qp[:, t])) / (1 + diff) / (1 + diff)
+            Qp = (Qp + diff[:, None] * Q[active, t, :]) / (1 + diff)[:, None]
+            p_active /= (1 + diff)[:, None]
+        p[active] = p_active
+    return p
+
+
+# =========================== Helpers ===========================
+def _save_npz(path: str, arrays: dict):
+    # Ghi ra file tạm rồi đổi tên để tiến trình khác không đọc phải file ghi dở
+    tmp_path = f"{path}.tmp.npz"
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def save_heads(heads: dict, path: str):
+    """
+    Lưu nhiều head vào một file .npz, mỗi head được đánh khóa bằng một số nguyên (ví dụ chỉ số layer).
+    """
+    arrays = {"keys": np.array(sorted(heads), dtype=np.int64)}
+    for key, head in heads.items():
+        arrays.update(head.to_arrays(prefix=f"head{key}_"))
+    _save_npz(path, arrays)
+
+
+def load_heads(path: str) -> dict:
+    with np.load(path, allow_pickle=False) as data:
+        return {int(key): LinearHead.from_arrays(data, prefix=f"head{key}_") for key in data["keys"]}
+
+
+def file_sha256(path: str) -> str:
+    # Tính hash của file theo từng khối để không phải đọc toàn bộ vào bộ nhớ
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def export_head(classifier_path: str = CLASSIFIER_PATH, head_path: str = CLASSIFIER_HEAD_PATH) -> LinearHead:
+    """
+    Đọc SVC từ file pickle và ghi ra file head .npz (kèm hash của pickle nguồn).
+    """
+    import joblib
+
+    head = LinearHead.from_svc(joblib.load(classifier_path), source_hash=file_sha256(classifier_path))
+    head.save(head_path)
+    return head
+
+
+def load_head(classifier_path: str = CLASSIFIER_PATH, head_path: str = CLASSIFIER_HEAD_PATH) -> LinearHead:
+    """
+    Tải head .npz; chỉ export lại từ pickle khi chưa có file head hoặc pickle đã thay đổi.
+    """
+    source_hash = file_sha256(classifier_path) if os.path.exists(classifier_path) else ""
+    if os.path.exists(head_path):
+        head = LinearHead.load(head_path)
+        if not source_hash or head.source_hash == source_hash:
+            return head
+    print(f"> Exporting {classifier_path} to {head_path}...")
+    return export_head(classifier_path, head_path)
+
+
+def verify_head(head: LinearHead, svc, features: np.ndarray) -> dict:
+    """
+    So sánh head với SVC gốc trên cùng ma trận đặc trưng.
+    """
+    labels, proba = head.predict_with_proba(features)
+    svc_proba = svc.predict_proba(features)
+    return {
+        "samples": len(features),
+        "label_agreement": float(np.mean(labels == svc.predict(features))),
+        "max_proba_diff": float(np.max(np.abs(proba - svc_proba))),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export the SVC pickle to a NumPy linear head and verify it.")
+    parser.add_argument("--classifier", default=CLASSIFIER_PATH)
+    parser.add_argument("--output", default=CLASSIFIER_HEAD_PATH)
+    parser.add_argument("--csv", help="Also verify on PhoBERT embeddings of this CSV (loads the encoder)")
+    args = parser.parse_args()
+
+    import joblib
+
+    svc = joblib.load(args.classifier)
+    head = export_head(args.classifier, args.output)
+    print(f"> Saved linear head to {args.output}")
+
+    # Kiểm tra trên đặc trưng ngẫu nhiên có cùng độ lớn với embedding [CLS]
+    probe = np.random.default_rng(0).normal(0, 0.3, size=(5000, head.coef.shape[1]))
+    print(f"> Random probe: {verify_head(head, svc, probe)}")
+
+    if args.csv:
+        import pandas as pd
+        from transformers import AutoTokenizer
+
+        from constant import MODEL_NAME
+        from model_backends import load_encoder
+        from preprocessing import preprocess_batch
+        from sentiment_classification import extract_cls_embeddings
+
+        texts, _ = preprocess_batch(pd.read_csv(args.csv)["text"].astype(str).tolist(), workers=1)
+        pipeline = {"model": load_encoder(MODEL_NAME), "tokenizer": AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=False), "device": "cpu"}
+        print(f"> {args.csv}: {verify_head(head, svc, extract_cls_embeddings(texts, pipeline))}")
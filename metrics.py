@@ -0,0 +1,234 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from constant import METRICS_HISTORY_INTERVAL_SECONDS, METRICS_HISTORY_RETENTION_HOURS
+
+# Ngưỡng (giây) của histogram thời gian và ngưỡng của histogram kích thước batch
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+# =========================== Metric Types ===========================
+class Metric:
+    """
+    Một họ metric (counter / gauge / histogram) có thể có nhãn, ghi trong bộ nhớ tiến trình.
+
+    Mỗi tổ hợp giá trị nhãn là một chuỗi số riêng; mọi thao tác chỉ giữ lock trong vài phép cộng.
+    """
+
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        if set(labels) != set(self.label_names):
+            raise ValueError(f"Metric '{self.name}' expects labels {self.label_names}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def _format_labels(self, key: tuple, extra: dict = None) -> str:
+        pairs = list(zip(self.label_names, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        escaped = (
+            str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+            for _, value in pairs
+        )
+        return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+    def samples(self) -> list:
+        # Danh sách (tên, nhãn dạng chuỗi, giá trị) theo định dạng Prometheus
+        with self._lock:
+            return [(self.name, self._format_labels(key), value) for key, value in self._values.items()]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        super().__init__(name, documentation, labels)
+        self._function = None
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function):
+        # Giá trị được đọc lúc export (ví dụ độ dài hàng đợi), không tốn chi phí trên hot path
+        self._function = function
+
+    def samples(self) -> list:
+        if self._function is not None:
+            return [(self.name, "", float(self._function()))]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # [số lần rơi vào từng ngưỡng (+Inf ở cuối), tổng, số lần]
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> list:
+        with self._lock:
+            states = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+
+        samples = []
+        for key, counts, total, count in states:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == math.inf else repr(float(bound))
+                samples.append((f"{self.name}_bucket", self._format_labels(key, {"le": le}), cumulative))
+            samples.append((f"{self.name}_sum", self._format_labels(key), total))
+            samples.append((f"{self.name}_count", self._format_labels(key), count))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric '{metric.name}' is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: tuple = ()) -> Counter:
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: tuple = ()) -> Gauge:
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS) -> Histogram:
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def samples(self) -> list:
+        return [sample for metric in self._metrics.values() for sample in metric.samples()]
+
+    def render_prometheus(self) -> str:
+        """
+        Xuất toàn bộ metric theo định dạng text của Prometheus (version 0.0.4).
+        """
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+def _format_value(value: float) -> str:
+    if isinstance(value, int):
+        return str(value)
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+# =========================== Pipeline Metrics ===========================
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram("vnsaa_stage_seconds", "Time spent in each pipeline stage.", ("stage",))
+REQUESTS_TOTAL = REGISTRY.counter("vnsaa_requests_total", "Texts processed by the full pipeline, by outcome.", ("status",))
+QUEUE_DEPTH = REGISTRY.gauge("vnsaa_scheduler_queue_depth", "Requests waiting in the micro-batch scheduler queue.")
+BATCH_SIZE = REGISTRY.histogram("vnsaa_batch_size", "Number of texts per scheduler batch.", buckets=BATCH_SIZE_BUCKETS)
+CACHE_LOOKUPS = REGISTRY.counter("vnsaa_cache_lookups_total", "Result cache lookups, by result.", ("result",))
+DB_WRITE_SECONDS = REGISTRY.histogram("vnsaa_db_write_seconds", "Latency of SQLite write transactions.", ("operation",))
+MODEL_LOAD_SECONDS = REGISTRY.gauge("vnsaa_model_load_seconds", "Duration of each model loading phase.", ("phase",))
+
+
+@contextmanager
+def stage_timer(stage: str, timings: dict = None):
+    """
+    Đo thời gian một bước của pipeline, ghi vào histogram vnsaa_stage_seconds
+    và (nếu có) vào timings[stage] tính bằng giây.
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = elapsed
+
+
+# =========================== SQLite History ===========================
+class MetricsRecorder:
+    """
+    Định kỳ chụp giá trị hiện tại của mọi metric vào bảng metrics_history,
+    đồng thời xóa các bản ghi cũ hơn retention_hours.
+    """
+
+    def __init__(self, interval: float = METRICS_HISTORY_INTERVAL_SECONDS,
+                 retention_hours: float = METRICS_HISTORY_RETENTION_HOURS, registry: MetricsRegistry = REGISTRY):
+        self.interval = interval
+        self.retention_hours = retention_hours
+        self.registry = registry
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-recorder", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def record(self):
+        from database import save_metrics_snapshot
+
+        save_metrics_snapshot(self.registry.samples(), self.retention_hours)
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.record()
+
+
+def start_metrics_history() -> MetricsRecorder:
+    # Chỉ bật khi METRICS_HISTORY_INTERVAL_SECONDS > 0
+    if METRICS_HISTORY_INTERVAL_SECONDS <= 0:
+        return None
+    return MetricsRecorder().start()
@@ -0,0 +1,283 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+import time
+
+import numpy as np
+import torch
+from transformers import AutoModel, AutoTokenizer
+
+from constant import CLASSIFIER_PATH, MODEL_NAME, MODEL_SNAPSHOT_DIR, ONNX_MODEL_PATH
+from tokenization import wrap_tokenizer
+
+BACKENDS = ("torch", "int8", "onnx")
+ONNX_OPSET = 17
+
+
+# =========================== Encoder Backends ===========================
+class ClsOnlyEncoder(torch.nn.Module):
+    """
+    Bọc PhoBERT để chỉ trả về hidden state của token [CLS] (dạng (batch, 1, hidden)),
+    dùng khi export ONNX để không phải sao chép toàn bộ chuỗi output.
+    """
+
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask):
+        outputs = self.model(input_ids=input_ids, attention_mask=attention_mask)
+        return outputs[0][:, :1, :]
+
+
+class OnnxEncoder:
+    """
+    Chạy encoder đã export ONNX bằng onnxruntime trên CPU.
+    Có cùng cách gọi với model PyTorch: model(input_ids=..., attention_mask=...)[0].
+    """
+
+    def __init__(self, onnx_path: str, num_threads: int = None, export_hash: str = None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The 'onnx' backend requires onnxruntime: pip install onnxruntime") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.onnx_path = onnx_path
+        # Hash của manifest export (checkpoint + opset), đưa vào model_version của cache kết quả
+        self.export_hash = export_hash
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+
+    def __call__(self, input_ids, attention_mask):
+        outputs = self.session.run(None, {
+            "input_ids": input_ids.cpu().numpy().astype(np.int64),
+            "attention_mask": attention_mask.cpu().numpy().astype(np.int64),
+        })
+        return (torch.from_numpy(outputs[0]),)
+
+    # Giữ tương thích với các lệnh model.to(device) / model.eval() trong pipeline
+    def to(self, device):
+        return self
+
+    def eval(self):
+        return self
+
+
+def export_onnx(model, onnx_path: str = ONNX_MODEL_PATH) -> str:
+    """
+    Export encoder PhoBERT (chỉ lấy [CLS]) sang ONNX với batch và độ dài chuỗi động.
+    """
+    wrapper = ClsOnlyEncoder(model).eval()
+    dummy = torch.ones((1, 8), dtype=torch.long)
+    with torch.no_grad():
+        torch.onnx.export(
+            wrapper,
+            (dummy, dummy),
+            onnx_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["cls_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "cls_hidden_state": {0: "batch"},
+            },
+            opset_version=ONNX_OPSET,
+            dynamo=False,
+        )
+    return onnx_path
+
+
+def onnx_manifest_path(onnx_path: str = ONNX_MODEL_PATH) -> str:
+    return f"{onnx_path}.json"
+
+
+def onnx_export_manifest(model_name: str = MODEL_NAME) -> dict:
+    """
+    Mô tả bản export ONNX cần có cho checkpoint hiện tại: opset và dấu vân tay của checkpoint
+    (kích thước, thời điểm sửa của config.json và các file trọng số, không đọc toàn bộ trọng số).
+    """
+    path = resolve_model_path(model_name)
+    files = {}
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name == "config.json" or name.endswith((".safetensors", ".bin")):
+                stat = os.stat(os.path.join(path, name))
+                files[name] = [stat.st_size, stat.st_mtime_ns]
+    return {"model_name": model_name, "checkpoint": os.path.realpath(path) if files else path,
+            "files": files, "opset": ONNX_OPSET}
+
+
+def manifest_hash(manifest: dict) -> str:
+    return hashlib.sha256(json.dumps(manifest, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def read_onnx_manifest(onnx_path: str = ONNX_MODEL_PATH) -> dict:
+    # Manifest đã lưu cạnh file .onnx (None nếu thiếu hoặc hỏng)
+    try:
+        with open(onnx_manifest_path(onnx_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_onnx_manifest(manifest: dict, onnx_path: str = ONNX_MODEL_PATH):
+    tmp_path = f"{onnx_manifest_path(onnx_path)}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp_path, onnx_manifest_path(onnx_path))
+
+
+# =========================== Local Snapshot ===========================
+def snapshot_path(model_name: str = MODEL_NAME, root: str = MODEL_SNAPSHOT_DIR) -> str:
+    slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", model_name)
+    return os.path.join(root, slug)
+
+
+def resolve_model_path(model_name: str = MODEL_NAME, root: str = MODEL_SNAPSHOT_DIR) -> str:
+    """
+    Tìm bản model cục bộ để from_pretrained không phải tra cứu Hugging Face Hub:
+        1. model_name đã là một thư mục
+        2. snapshot safetensors trong MODEL_SNAPSHOT_DIR (tạo bằng --save-snapshot)
+        3. bản đã tải trong cache của Hugging Face
+    Không có bản nào thì trả về model_name để tải từ Hub như cũ.
+    """
+    if os.path.isdir(model_name):
+        return model_name
+
+    local_path = snapshot_path(model_name, root)
+    if os.path.isfile(os.path.join(local_path, "model.safetensors")):
+        return local_path
+
+    try:
+        from huggingface_hub import snapshot_download
+
+        return snapshot_download(model_name, local_files_only=True)
+    except Exception:
+        return model_name
+
+
+def save_model_snapshot(model_name: str = MODEL_NAME, root: str = MODEL_SNAPSHOT_DIR) -> str:
+    """
+    Lưu encoder (safetensors, không có pooler) và tokenizer vào MODEL_SNAPSHOT_DIR.
+    Các lần khởi động sau đọc trọng số bằng mmap thay vì giải nén file pickle .bin.
+    """
+    local_path = snapshot_path(model_name, root)
+    model = AutoModel.from_pretrained(model_name, add_pooling_layer=False)
+    model.save_pretrained(local_path, safe_serialization=True)
+    AutoTokenizer.from_pretrained(model_name, use_fast=False).save_pretrained(local_path)
+    return local_path
+
+
+def load_tokenizer(model_name: str = MODEL_NAME, cached: bool = True):
+    # Tokenizer (slow) đọc từ bản cục bộ nếu có, bọc bằng đường tokenize có cache theo từ
+    tokenizer = AutoTokenizer.from_pretrained(resolve_model_path(model_name), use_fast=False)
+    return wrap_tokenizer(tokenizer) if cached else tokenizer
+
+
+def load_encoder(model_name: str = MODEL_NAME, backend: str = "torch", onnx_path: str = ONNX_MODEL_PATH):
+    """
+    Tải encoder PhoBERT theo backend:
+        - torch: fp32 PyTorch
+        - int8: lượng tử hóa động int8 cho các lớp Linear
+        - onnx: graph ONNX chạy bằng onnxruntime CPU (tự export nếu chưa có file, hoặc export lại
+          khi manifest cạnh file không khớp checkpoint/opset hiện tại)
+
+    Pooler bị bỏ đi vì pipeline chỉ đọc hidden state của [CLS].
+    Trọng số được đọc từ bản cục bộ nếu có (safetensors được mmap, không tải lại từ Hub).
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}', expected one of {BACKENDS}")
+
+    # File ONNX đã có và khớp manifest thì không cần dựng model PyTorch
+    if backend == "onnx":
+        manifest = onnx_export_manifest(model_name)
+        if os.path.exists(onnx_path) and read_onnx_manifest(onnx_path) == manifest:
+            return OnnxEncoder(onnx_path, export_hash=manifest_hash(manifest))
+
+    model = AutoModel.from_pretrained(resolve_model_path(model_name), add_pooling_layer=False)
+    model.eval()
+
+    if backend == "int8":
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+    if backend == "onnx":
+        print(f"> Exporting {model_name} to {onnx_path}...")
+        # Xóa manifest cũ trước để lần export bị ngắt giữa chừng không được coi là hợp lệ
+        if os.path.exists(onnx_manifest_path(onnx_path)):
+            os.remove(onnx_manifest_path(onnx_path))
+        export_onnx(model, onnx_path)
+        write_onnx_manifest(manifest, onnx_path)
+        return OnnxEncoder(onnx_path, export_hash=manifest_hash(manifest))
+
+    return model
+
+
+def encoder_size_mb(model) -> float:
+    # Kích thước trọng số của encoder (MB), ước lượng bộ nhớ thường trú
+    if isinstance(model, OnnxEncoder):
+        return os.path.getsize(model.onnx_path) / 2**20
+    state = model.state_dict()
+    total = 0
+    for value in state.values():
+        if isinstance(value, torch.Tensor):
+            total += value.numel() * value.element_size()
+        elif isinstance(value, tuple):
+            # Lớp Linear lượng tử hóa lưu (weight, bias) đã đóng gói
+            total += sum(t.numel() * t.element_size() for t in value if isinstance(t, torch.Tensor))
+    return total / 2**20
+
+
+# =========================== Parity Check ===========================
+def check_backend_parity(backend: str, csv_path: str = "data_sentiment_vn.csv", model_name: str = MODEL_NAME,
+                         classifier_path: str = CLASSIFIER_PATH, batch_size: int = 32) -> dict:
+    """
+    So sánh dự đoán SVM của một backend với fp32 trên file CSV.
+
+    Returns:
+        dict: Tỷ lệ nhãn trùng khớp, sai lệch xác suất lớn nhất/trung bình, thời gian encode và kích thước encoder.
+    """
+    import joblib
+    import pandas as pd
+
+    from preprocessing import preprocess_batch
+    from sentiment_classification import extract_cls_embeddings
+
+    texts, _ = preprocess_batch(pd.read_csv(csv_path)["text"].astype(str).tolist(), workers=1)
+    tokenizer = load_tokenizer(model_name)
+    classifier = joblib.load(classifier_path)
+
+    report = {"backend": backend, "samples": len(texts)}
+    outputs = {}
+    for name in ("torch", backend):
+        pipeline = {"model": load_encoder(model_name, name), "tokenizer": tokenizer, "device": "cpu"}
+        start = time.perf_counter()
+        features = extract_cls_embeddings(texts, pipeline, batch_size=batch_size)
+        report[f"{name}_encode_seconds"] = time.perf_counter() - start
+        report[f"{name}_encoder_mb"] = encoder_size_mb(pipeline["model"])
+        outputs[name] = (classifier.predict(features), classifier.predict_proba(features))
+
+    reference_labels, reference_proba = outputs["torch"]
+    labels, proba = outputs[backend]
+    report["label_agreement"] = float(np.mean(reference_labels == labels))
+    report["max_proba_diff"] = float(np.max(np.abs(reference_proba - proba)))
+    report["mean_proba_diff"] = float(np.mean(np.abs(reference_proba - proba)))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare a PhoBERT inference backend against fp32.")
+    parser.add_argument("--backend", choices=[b for b in BACKENDS if b != "torch"], default="int8")
+    parser.add_argument("--csv", default="data_sentiment_vn.csv")
+    parser.add_argument("--save-snapshot", action="store_true", help=f"Save {MODEL_NAME} as a local safetensors snapshot and exit")
+    args = parser.parse_args()
+
+    if args.save_snapshot:
+        print(f"> Saved snapshot to {save_model_snapshot()}")
+    else:
+        for key, value in check_backend_parity(args.backend, args.csv).items():
+            print(f"> {key}: {value:.4f}" if isinstance(value, float) else f"> {key}: {value}")
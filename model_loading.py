@@ -1,25 +1,135 @@
+import threading
 import time
-import joblib
-from transformers import AutoModel, AutoTokenizer
+from contextlib import contextmanager
+
 import streamlit as st
 
+from constant import CLASSIFIER_HEAD_PATH, CLASSIFIER_PATH, EMBEDDING_STORE_DIR, EMBEDDING_STORE_ENABLED, MODEL_BACKEND, MODEL_NAME, MODEL_REGISTRY_DIR, MODEL_REGISTRY_POLL_SECONDS, RESULT_CACHE_SIZE, SCHEDULER_MAX_BATCH_SIZE, SCHEDULER_MAX_WAIT_MS
+from metrics import MODEL_LOAD_SECONDS, REGISTRY, start_metrics_history
 
-@st.cache_resource
-def load_model_pipeline():
+# Các câu dùng để chạy thử model và underthesea trước yêu cầu thật đầu tiên
+WARMUP_TEXTS = ["sản phẩm này rất tốt", "hôm nay tôi cảm thấy bình thường, không có gì đặc biệt"]
+
+# Các giai đoạn khởi động theo thứ tự, dùng để tính tiến độ
+WARMUP_PHASES = (
+    ("imports", "Nạp thư viện"),
+    ("encoder", "Tải PhoBERT"),
+    ("tokenizer", "Tải tokenizer"),
+    ("classifier", "Tải classifier"),
+    ("warmup_model", "Chạy thử mô hình"),
+    ("warmup_underthesea", "Chạy thử underthesea"),
+    ("scheduler", "Khởi tạo scheduler"),
+)
+
+CLASSIFIER_RELOADS = REGISTRY.counter("vnsaa_classifier_reloads_total", "Classifier head hot swaps from the model registry, by result.", ("result",))
+
+
+@contextmanager
+def _timed(timings: dict, phase: str, on_phase=None):
+    # Đo thời gian một giai đoạn và báo cho người gọi biết giai đoạn đang chạy
+    if on_phase:
+        on_phase(phase)
+    start = time.perf_counter()
+    yield
+    timings[phase] = time.perf_counter() - start
+    MODEL_LOAD_SECONDS.set(timings[phase], phase=phase)
+
+
+def _model_version(model_name: str, backend: str, classifier_hash: str, early_exit, encoder_hash: str = None) -> str:
+    # Cache kết quả gắn với phiên bản model, tự vô hiệu khi model (kể cả bản export ONNX), classifier
+    # hoặc cấu hình early exit thay đổi
+    model_version = f"{model_name}:{backend}"
+    if encoder_hash is not None:
+        model_version += f"#{encoder_hash}"
+    model_version += f"@{classifier_hash}"
+    if early_exit is not None:
+        model_version += f"+exit{early_exit.threshold}@{early_exit.source_hash}"
+    return model_version
+
+
+def load_classifier(model_name: str = MODEL_NAME, registry_dir: str = MODEL_REGISTRY_DIR) -> tuple:
+    """
+    Tải classifier head: phiên bản đang dùng trong registry nếu có, ngược lại CLASSIFIER_HEAD_PATH.
+
+    Phiên bản đang dùng bị thiếu/hỏng (hoặc train trên encoder khác) thì thử lần lượt các phiên bản
+    dùng trước đó, cuối cùng là classifier đi kèm, để app vẫn khởi động được; mỗi lỗi đều được in ra.
+
+    Returns:
+        tuple: (classifier, classifier_hash, classifier_version); classifier_version là None khi không dùng registry.
+    """
+    from linear_head import file_sha256, load_head
+    from model_registry import candidate_versions, load_version
+
+    try:
+        versions = candidate_versions(registry_dir)
+    except Exception as e:
+        print(f"> Cannot read the model registry: {e}")
+        versions = []
+
+    for version in versions:
+        try:
+            classifier, manifest = load_version(version, registry_dir)
+            if manifest["model_name"] != model_name:
+                raise ValueError(f"trained on {manifest['model_name']}, not {model_name}")
+        except Exception as e:
+            print(f"> Classifier version {version} failed to load: {e}")
+            continue
+        if version != versions[0]:
+            print(f"> Falling back to classifier version {version}")
+        return classifier, manifest["classifier_hash"], version
+
+    if versions:
+        print(f"> No registered classifier version could be loaded, falling back to {CLASSIFIER_HEAD_PATH}")
+    classifier = load_head(CLASSIFIER_PATH, CLASSIFIER_HEAD_PATH)
+    return classifier, classifier.source_hash or file_sha256(CLASSIFIER_HEAD_PATH), None
+
+
+def build_model_pipeline(backend: str = MODEL_BACKEND, on_phase=None, use_cache: bool = True) -> dict:
+    """
+    Tải PhoBERT, tokenizer và classifier, ghi lại thời gian của từng giai đoạn.
+
+    Args:
+        backend (str): Backend của encoder (torch / int8 / onnx).
+        on_phase: Hàm được gọi với tên giai đoạn trước khi giai đoạn đó bắt đầu.
+        use_cache (bool): Tạo cache kết quả (cần database); False cho các job chấm điểm hàng loạt.
+
+    Returns:
+        dict: Pipeline gồm model, tokenizer, classifier (và classifier_version trong registry), early_exit,
+            cache, return_embeddings và 'timings' (giây) của từng giai đoạn.
+    """
     # Ghi nhận thời gian bắt đầu
     start_time = time.time()
-    print("> Loading model pipeline...")
+    timings = {}
+    print(f"> Loading model pipeline ({backend})...")
+
+    # torch / transformers chỉ được import ở đây để trang có thể hiển thị trước khi nạp xong
+    with _timed(timings, "imports", on_phase):
+        from early_exit import load_early_exit
+        from model_backends import load_encoder, load_tokenizer
+        from sentiment_cache import SentimentCache
 
-    # Tải mô hình PhoBERT-base-v2
-    model_name = "vinai/phobert-base-v2"
-    model = AutoModel.from_pretrained(model_name)
+    # Tải mô hình PhoBERT-base-v2 theo backend đã chọn (torch / int8 / onnx)
+    # Trọng số đọc từ snapshot safetensors cục bộ (mmap) nếu có
+    model_name = MODEL_NAME
+    with _timed(timings, "encoder", on_phase):
+        model = load_encoder(model_name, backend)
 
     # Tải tokenizer tương ứng với PhoBERT
-    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+    with _timed(timings, "tokenizer", on_phase):
+        tokenizer = load_tokenizer(model_name)
 
-    # Tải mô hình phân loại SVM đã được train sẵn từ file pickle
+    # Tải đầu phân loại tuyến tính NumPy export từ SVM đã train (không cần unpickle SVC),
+    # ưu tiên phiên bản đang dùng trong model registry
     # Mô hình này sẽ nhận embedding từ PhoBERT để dự đoán nhãn cảm xúc
-    classifier = joblib.load("svm_phobert_sentiment.pkl")
+    with _timed(timings, "classifier", on_phase):
+        classifier, classifier_hash, classifier_version = load_classifier(model_name)
+
+        # Head của các layer giữa cho chế độ early exit (None nếu tắt hoặc chưa train)
+        early_exit = load_early_exit(model, classifier, backend)
+
+    encoder_hash = getattr(model, "export_hash", None)
+    model_version = _model_version(model_name, backend, classifier_hash, early_exit, encoder_hash)
+    cache = SentimentCache(model_version, max_size=RESULT_CACHE_SIZE) if use_cache else None
 
     # Chọn thiết bị để chạy model
     device = "cpu"
@@ -34,10 +144,281 @@ def load_model_pipeline():
 
     # Trả về dictionary chứa các thành phần cần thiết cho pipeline
     return {
-        "model": model, 
-        "tokenizer": tokenizer, 
-        "classifier": classifier, 
+        "model": model,
+        "tokenizer": tokenizer,
+        "classifier": classifier,
         "device": device,
+        "backend": backend,
+        "model_name": model_name,
+        "classifier_hash": classifier_hash,
+        "encoder_hash": encoder_hash,
+        "classifier_version": classifier_version,
+        "early_exit": early_exit,
+        "cache": cache,
+        # Trả kèm embedding [CLS] cho embedding store (không có khi early exit dừng ở layer giữa)
+        "return_embeddings": EMBEDDING_STORE_ENABLED and use_cache,
+        "timings": timings,
         "start_time": start_time,
         "end_time": end_time
-    }
\ No newline at end of file
+    }
+
+
+def swap_classifier(pipeline: dict, version: str, registry_dir: str = MODEL_REGISTRY_DIR) -> dict:
+    """
+    Tạo pipeline mới dùng classifier head của một phiên bản trong registry, giữ nguyên encoder
+    và tokenizer đã tải (không sửa pipeline cũ, các batch đang chạy vẫn dùng nó đến khi xong).
+
+    Raises:
+        ValueError: Phiên bản hỏng, train trên encoder khác hoặc khác số chiều đặc trưng.
+    """
+    from early_exit import load_early_exit
+    from model_registry import load_version
+    from sentiment_cache import SentimentCache
+
+    classifier, manifest = load_version(version, registry_dir)
+    if manifest["model_name"] != pipeline["model_name"]:
+        raise ValueError(f"Classifier version {version} was trained on {manifest['model_name']}, not {pipeline['model_name']}")
+    if classifier.coef.shape[1] != pipeline["classifier"].coef.shape[1]:
+        raise ValueError(f"Classifier version {version} expects {classifier.coef.shape[1]} features, "
+                         f"the encoder produces {pipeline['classifier'].coef.shape[1]}")
+
+    # Early exit dùng classifier chính ở layer cuối nên được tạo lại với head mới
+    early_exit = load_early_exit(pipeline["model"], classifier, pipeline["backend"])
+    cache = None
+    if pipeline["cache"] is not None:
+        model_version = _model_version(pipeline["model_name"], pipeline["backend"], manifest["classifier_hash"], early_exit,
+                                       pipeline.get("encoder_hash"))
+        cache = SentimentCache(model_version, max_size=pipeline["cache"].max_size)
+    return dict(
+        pipeline,
+        classifier=classifier,
+        classifier_hash=manifest["classifier_hash"],
+        classifier_version=version,
+        early_exit=early_exit,
+        cache=cache,
+    )
+
+
+def warm_up_pipeline(pipeline: dict, on_phase=None) -> dict:
+    """
+    Chạy thử một lượt forward và một lần tách từ underthesea để yêu cầu thật đầu tiên không bị chậm.
+    Kết quả chạy thử không đi qua cache nên không được ghi vào bảng sentiment_cache.
+    """
+    from preprocessing import preprocess_text
+    from sentiment_classification import extract_cls_embeddings, predict_from_features
+
+    timings = pipeline["timings"]
+    with _timed(timings, "warmup_model", on_phase):
+        features = extract_cls_embeddings(WARMUP_TEXTS, pipeline)
+        predict_from_features(features, pipeline["classifier"])
+
+    # underthesea nạp mô hình CRF ở lần gọi đầu tiên
+    with _timed(timings, "warmup_underthesea", on_phase):
+        for text in WARMUP_TEXTS:
+            preprocess_text(text)
+    return timings
+
+
+@st.cache_resource
+def load_model_pipeline(backend: str = MODEL_BACKEND):
+    return build_model_pipeline(backend)
+
+
+def create_batch_scheduler(pipeline: dict):
+    from batch_scheduler import MicroBatchScheduler
+
+    # Một scheduler dùng chung cho mọi phiên, đứng trước pipeline đã cache
+    return MicroBatchScheduler(
+        pipeline,
+        max_batch_size=SCHEDULER_MAX_BATCH_SIZE,
+        max_wait_ms=SCHEDULER_MAX_WAIT_MS,
+    )
+
+
+@st.cache_resource
+def load_batch_scheduler():
+    return create_batch_scheduler(load_model_pipeline())
+
+
+# =========================== Background Warm-up ===========================
+class ModelWarmup:
+    """
+    Tải pipeline và chạy thử trên một luồng nền để giao diện hiển thị ngay khi khởi động.
+
+    Trong lúc tải, phase/progress cho biết giai đoạn hiện tại; khi xong, ready = True
+    và scheduler sẵn sàng nhận yêu cầu. Lỗi (nếu có) được giữ trong error.
+    """
+
+    def __init__(self, backend: str = MODEL_BACKEND):
+        self.backend = backend
+        self.phase = None
+        self.pipeline = None
+        self.scheduler = None
+        self.error = None
+        self.timings = {}
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="model-warmup", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    @property
+    def ready(self) -> bool:
+        return self._done.is_set() and self.error is None
+
+    @property
+    def failed(self) -> bool:
+        return self.error is not None
+
+    @property
+    def progress(self) -> float:
+        # Tỷ lệ giai đoạn đã hoàn thành, trong [0, 1]
+        if self._done.is_set():
+            return 1.0
+        names = [name for name, _ in WARMUP_PHASES]
+        return names.index(self.phase) / len(names) if self.phase in names else 0.0
+
+    @property
+    def phase_label(self) -> str:
+        return dict(WARMUP_PHASES).get(self.phase, "Đang khởi động")
+
+    def wait(self, timeout: float = None):
+        """
+        Chờ khởi động xong và trả về scheduler; ném lại lỗi nếu khởi động thất bại.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError(f"Model warm-up did not finish within {timeout} seconds")
+        if self.error is not None:
+            raise self.error
+        return self.scheduler
+
+    def _set_phase(self, phase: str):
+        self.phase = phase
+
+    def _run(self):
+        start = time.perf_counter()
+        try:
+            self.pipeline = build_model_pipeline(self.backend, on_phase=self._set_phase)
+            self.timings = self.pipeline["timings"]
+            warm_up_pipeline(self.pipeline, on_phase=self._set_phase)
+            with _timed(self.timings, "scheduler", self._set_phase):
+                self.scheduler = create_batch_scheduler(self.pipeline)
+            self.timings["total"] = time.perf_counter() - start
+            print("> Warm-up finished: " + ", ".join(f"{name} {seconds:.2f}s" for name, seconds in self.timings.items()))
+        except Exception as e:
+            self.error = e
+            print(f"> Warm-up failed: {e}")
+        finally:
+            self._done.set()
+
+
+@st.cache_resource
+def load_embedding_store():
+    from embedding_store import EmbeddingStore
+
+    # None nếu tắt trong constant.py
+    return EmbeddingStore(EMBEDDING_STORE_DIR) if EMBEDDING_STORE_ENABLED else None
+
+
+@st.cache_resource
+def load_similarity_index():
+    from embedding_store import SimilarityIndex
+
+    store = load_embedding_store()
+    return SimilarityIndex(store) if store is not None else None
+
+
+# =========================== Classifier Hot Reload ===========================
+class ClassifierWatcher:
+    """
+    Theo dõi phiên bản đang dùng trong model registry và đổi classifier head khi nó thay đổi,
+    không tải lại PhoBERT và không ngắt các phiên đang mở.
+
+    Pipeline mới (chung encoder) được giao cho scheduler bằng một phép gán: batch đang chạy
+    hoàn tất với head cũ, batch kế tiếp dùng head mới. Phiên bản lỗi bị bỏ qua và head cũ
+    vẫn được dùng.
+    """
+
+    def __init__(self, warmup: ModelWarmup, registry_dir: str = MODEL_REGISTRY_DIR, interval: float = MODEL_REGISTRY_POLL_SECONDS):
+        self.warmup = warmup
+        self.registry_dir = registry_dir
+        self.interval = interval
+        self._failed_version = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="classifier-watcher", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def check(self) -> bool:
+        """
+        Kiểm tra registry một lần.
+
+        Returns:
+            bool: True nếu đã đổi sang phiên bản mới.
+        """
+        from model_registry import current_version
+
+        if not self.warmup.ready:
+            return False
+        version = current_version(self.registry_dir)
+        pipeline = self.warmup.pipeline
+        if version is None or version == pipeline.get("classifier_version") or version == self._failed_version:
+            return False
+
+        start = time.perf_counter()
+        try:
+            new_pipeline = swap_classifier(pipeline, version, self.registry_dir)
+        except Exception as e:
+            # Ghi nhận một lần cho mỗi phiên bản lỗi, không thử lại liên tục
+            self._failed_version = version
+            CLASSIFIER_RELOADS.inc(result="error")
+            print(f"> Classifier version {version} rejected: {e}")
+            return False
+
+        self.warmup.scheduler.update_pipeline(new_pipeline)
+        self.warmup.pipeline = new_pipeline
+        self._failed_version = None
+        CLASSIFIER_RELOADS.inc(result="ok")
+        print(f"> Classifier swapped to {version} (took {(time.perf_counter() - start) * 1000:.1f} ms)")
+        return True
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                print(f"> Model registry check failed: {e}")
+
+
+@st.cache_resource
+def start_classifier_watcher():
+    # Một luồng theo dõi registry cho cả server (None nếu tắt trong constant.py)
+    if not MODEL_REGISTRY_POLL_SECONDS:
+        return None
+    return ClassifierWatcher(start_model_warmup()).start()
+
+
+@st.cache_resource
+def start_db_writer():
+    from db_writer import GroupCommitWriter
+
+    # Một writer dùng chung cho mọi phiên, lịch sử (và embedding) được ghi theo nhóm trên luồng nền
+    return GroupCommitWriter(embedding_store=load_embedding_store())
+
+
+@st.cache_resource
+def start_metrics_recorder():
+    # Ghi metric định kỳ vào bảng metrics_history (None nếu tắt trong constant.py)
+    return start_metrics_history()
+
+
+@st.cache_resource
+def start_model_warmup(backend: str = MODEL_BACKEND) -> ModelWarmup:
+    # Một luồng khởi động duy nhất cho cả server, các phiên dùng chung kết quả
+    return ModelWarmup(backend).start()
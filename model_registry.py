@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import time
+
+from constant import MAX_TOKEN_LENGTH, MODEL_NAME, MODEL_REGISTRY_DIR
+from linear_head import LinearHead, file_sha256
+
+# Số phiên bản trước đó được ghi nhớ để rollback
+MAX_HISTORY = 20
+
+HEAD_FILE = "head.npz"
+MANIFEST_FILE = "manifest.json"
+CURRENT_FILE = "current.json"
+
+
+# =========================== Files ===========================
+def _write_json(path: str, payload: dict):
+    # Ghi ra file tạm rồi đổi tên: tiến trình đang theo dõi không bao giờ đọc phải file ghi dở
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def _read_json(path: str) -> dict:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def version_dir(version: str, registry_dir: str = MODEL_REGISTRY_DIR) -> str:
+    return os.path.join(registry_dir, version)
+
+
+# =========================== Registry ===========================
+def publish_head(head: LinearHead, metrics: dict = None, version: str = None, activate: bool = True,
+                 model_name: str = MODEL_NAME, registry_dir: str = MODEL_REGISTRY_DIR) -> str:
+    """
+    Thêm một classifier head vào registry dưới dạng một phiên bản mới (không sửa phiên bản cũ).
+
+    Mỗi phiên bản là một thư mục gồm head.npz và manifest.json (tên encoder, hash của head,
+    hash của pickle nguồn, metrics, số chiều đặc trưng). Manifest được ghi sau cùng nên một
+    thư mục chưa có manifest là phiên bản ghi dở và bị bỏ qua.
+
+    Returns:
+        str: Tên phiên bản.
+    """
+    version = version or time.strftime("%Y%m%d-%H%M%S")
+    directory = version_dir(version, registry_dir)
+    if os.path.exists(os.path.join(directory, MANIFEST_FILE)):
+        raise ValueError(f"Version '{version}' already exists in {registry_dir}")
+    os.makedirs(directory, exist_ok=True)
+
+    head_path = os.path.join(directory, HEAD_FILE)
+    head.save(head_path)
+    _write_json(os.path.join(directory, MANIFEST_FILE), {
+        "version": version,
+        "model_name": model_name,
+        "max_token_length": MAX_TOKEN_LENGTH,
+        "classifier_hash": file_sha256(head_path),
+        "source_hash": head.source_hash,
+        "n_features": int(head.coef.shape[1]),
+        "classes": head.classes_.tolist(),
+        "metrics": metrics or {},
+        "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+    })
+    print(f"> Published classifier version {version} to {directory}")
+
+    if activate:
+        activate_version(version, registry_dir)
+    return version
+
+
+def load_manifest(version: str, registry_dir: str = MODEL_REGISTRY_DIR) -> dict:
+    return _read_json(os.path.join(version_dir(version, registry_dir), MANIFEST_FILE))
+
+
+def load_version(version: str, registry_dir: str = MODEL_REGISTRY_DIR) -> tuple:
+    """
+    Tải head của một phiên bản và kiểm tra hash so với manifest.
+
+    Returns:
+        tuple: (LinearHead, manifest)
+
+    Raises:
+        ValueError: head.npz không khớp với classifier_hash trong manifest.
+    """
+    manifest = load_manifest(version, registry_dir)
+    head_path = os.path.join(version_dir(version, registry_dir), HEAD_FILE)
+    if file_sha256(head_path) != manifest["classifier_hash"]:
+        raise ValueError(f"{head_path} does not match the classifier hash in its manifest")
+    return LinearHead.load(head_path), manifest
+
+
+def list_versions(registry_dir: str = MODEL_REGISTRY_DIR) -> list:
+    """
+    Returns:
+        list: Manifest của các phiên bản đã publish xong, sắp theo thời gian tạo.
+    """
+    if not os.path.isdir(registry_dir):
+        return []
+    manifests = []
+    for name in os.listdir(registry_dir):
+        if os.path.exists(os.path.join(registry_dir, name, MANIFEST_FILE)):
+            manifests.append(load_manifest(name, registry_dir))
+    return sorted(manifests, key=lambda manifest: (manifest["created_at"], manifest["version"]))
+
+
+def current_version(registry_dir: str = MODEL_REGISTRY_DIR) -> str:
+    # Phiên bản đang dùng, None nếu registry trống (khi đó dùng CLASSIFIER_HEAD_PATH như trước)
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    return _read_json(path).get("version")
+
+
+def candidate_versions(registry_dir: str = MODEL_REGISTRY_DIR) -> list:
+    """
+    Returns:
+        list: Phiên bản đang dùng rồi các phiên bản dùng trước đó (mới nhất trước), không trùng lặp;
+            rỗng nếu registry trống.
+    """
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return []
+    current = _read_json(path)
+    versions = [current.get("version")] + list(reversed(current.get("history", [])))
+    return list(dict.fromkeys(version for version in versions if version))
+
+
+def activate_version(version: str, registry_dir: str = MODEL_REGISTRY_DIR):
+    """
+    Đổi phiên bản đang dùng. Các tiến trình đang chạy nhận phiên bản mới ở lần kiểm tra kế tiếp.
+    """
+    load_version(version, registry_dir)
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    history = _read_json(path).get("history", []) if os.path.exists(path) else []
+    previous = current_version(registry_dir)
+    if previous == version:
+        return
+    if previous is not None:
+        history = (history + [previous])[-MAX_HISTORY:]
+    _write_json(path, {"version": version, "history": history, "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+    print(f"> Activated classifier version {version}")
+
+
+def rollback(registry_dir: str = MODEL_REGISTRY_DIR) -> str:
+    """
+    Quay lại phiên bản dùng trước phiên bản hiện tại.
+
+    Returns:
+        str: Phiên bản được kích hoạt lại.
+    """
+    path = os.path.join(registry_dir, CURRENT_FILE)
+    history = _read_json(path).get("history", []) if os.path.exists(path) else []
+    if not history:
+        raise ValueError("No previous classifier version to roll back to")
+    version = history[-1]
+    load_version(version, registry_dir)
+    _write_json(path, {"version": version, "history": history[:-1], "updated_at": time.strftime("%Y-%m-%d %H:%M:%S")})
+    print(f"> Rolled back to classifier version {version}")
+    return version
+
+
+# =========================== Main ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage versioned classifier heads for hot reloading.")
+    parser.add_argument("--registry", default=MODEL_REGISTRY_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    publish_parser = subparsers.add_parser("publish", help="Add a classifier head as a new version")
+    source = publish_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--classifier", help="SVC pickle to export")
+    source.add_argument("--head", help="Linear head .npz already exported")
+    publish_parser.add_argument("--version", help="Version name (default: timestamp)")
+    publish_parser.add_argument("--metrics", help="JSON file with evaluation metrics to store in the manifest")
+    publish_parser.add_argument("--no-activate", action="store_true", help="Publish without switching to it")
+
+    subparsers.add_parser("list", help="List published versions")
+    activate_parser = subparsers.add_parser("activate", help="Switch to a published version")
+    activate_parser.add_argument("version")
+    subparsers.add_parser("rollback", help="Switch back to the previous version")
+    args = parser.parse_args()
+
+    if args.command == "publish":
+        if args.classifier:
+            import joblib
+
+            head = LinearHead.from_svc(joblib.load(args.classifier), source_hash=file_sha256(args.classifier))
+        else:
+            head = LinearHead.load(args.head)
+        metrics = _read_json(args.metrics) if args.metrics else None
+        publish_head(head, metrics, args.version, not args.no_activate, registry_dir=args.registry)
+    elif args.command == "list":
+        active = current_version(args.registry)
+        for manifest in list_versions(args.registry):
+            marker = "*" if manifest["version"] == active else " "
+            accuracy = manifest["metrics"].get("accuracy")
+            accuracy = f"accuracy {accuracy:.4f}" if accuracy is not None else "no metrics"
+            print(f"{marker} {manifest['version']}  {manifest['created_at']}  {manifest['classifier_hash'][:12]}  {accuracy}")
+    elif args.command == "activate":
+        activate_version(args.version, args.registry)
+    else:
+        rollback(args.registry)
@@ -0,0 +1,228 @@
+from functools import lru_cache
+
+from constant import MAX_SENTENCE_LENGTH, NEIGHBOR_LABEL_THRESHOLD, SIMILAR_MAX_EXACT_ROWS, SIMILAR_TOP_K
+from database import load_sentiments_by_ids, save_to_sqlite
+from metrics import REQUESTS_TOTAL, stage_timer
+from preprocessing import correct_slang_words, standardize_text, tokenize_text
+
+# Độ dài tối thiểu của câu (sau khi tách từ) được chấp nhận
+MIN_SENTENCE_LENGTH = 5
+
+INVALID_LENGTH_ERROR = f"Độ dài câu không hợp lệ, vui lòng thử lại ({MIN_SENTENCE_LENGTH}-{MAX_SENTENCE_LENGTH} ký tự)"
+
+
+def preprocess_input(text: str, timings: dict = None) -> tuple:
+    """
+    Chuẩn hóa, sửa từ lóng và tách từ một câu.
+
+    Args:
+        text (str): Câu gốc.
+        timings (dict): Nếu có, nhận thời gian (giây) của từng bước.
+
+    Returns:
+        tuple: (câu đã sửa từ lóng, câu đã tách từ)
+    """
+    # Chuẩn hóa văn bản
+    with stage_timer("standardize_text", timings):
+        standardized_text = standardize_text(text)
+
+    # Sửa những từ không dấu, viết tắt, từ lóng
+    with stage_timer("correct_slang_words", timings):
+        corrected_text = correct_slang_words(standardized_text)
+
+    # Tách từ
+    with stage_timer("tokenize_text", timings):
+        tokenized_text = tokenize_text(corrected_text)
+    return corrected_text, tokenized_text
+
+
+def is_valid_length(tokenized_text: str) -> bool:
+    return MIN_SENTENCE_LENGTH <= len(tokenized_text) <= MAX_SENTENCE_LENGTH
+
+
+def save_result(result: dict, writer=None, embedding=None, store=None):
+    # Đưa vào writer ghi theo nhóm nếu có, ngược lại ghi đồng bộ (embedding ghi vào store theo id mới)
+    if writer is not None:
+        writer.save(result, embedding)
+        return
+    row_id = save_to_sqlite(result)
+    if store is not None and row_id is not None and embedding is not None:
+        store.put([row_id], [embedding])
+
+
+def find_similar(index, embeddings, k: int = SIMILAR_TOP_K, max_exact_rows: int = SIMILAR_MAX_EXACT_ROWS) -> list:
+    """
+    Tìm các bình luận cũ gần nhất (cosine similarity trên embedding [CLS]) cho nhiều câu cùng lúc.
+    Lịch sử lớn hơn max_exact_rows chỉ được tra qua IVF để thời gian xử lý không tăng theo lịch sử.
+
+    Returns:
+        list: Với mỗi embedding, danh sách dict {'id', 'text', 'sentiment', 'timestamp', 'similarity'}
+            giảm dần theo độ tương đồng (bỏ qua dòng đã bị xóa khỏi lịch sử);
+            None nếu bị bỏ qua vì lịch sử lớn mà chưa build IVF.
+    """
+    hits = index.search(embeddings, k, max_exact_rows=max_exact_rows)
+    if hits and hits[0] is None:
+        _warn_no_ivf()
+        return hits
+    rows = load_sentiments_by_ids(sorted({row_id for query_hits in hits for row_id, _ in query_hits}))
+    return [
+        [dict(rows[row_id], id=row_id, similarity=round(similarity, 4)) for row_id, similarity in query_hits if row_id in rows]
+        for query_hits in hits
+    ]
+
+
+@lru_cache(maxsize=1)
+def _warn_no_ivf():
+    # Chỉ nhắc một lần mỗi process
+    print(f"> Similar search skipped: more than {SIMILAR_MAX_EXACT_ROWS} embeddings and no IVF index "
+          "(run: python embedding_store.py build-ivf)")
+
+
+def reuse_neighbor_label(sentiment: dict, similar: list) -> dict:
+    # Dùng nhãn của bình luận cũ gần nhất nếu đủ giống (độ tin cậy là độ tương đồng)
+    if NEIGHBOR_LABEL_THRESHOLD is None or not similar or similar[0]["similarity"] < NEIGHBOR_LABEL_THRESHOLD:
+        return sentiment
+    neighbor = similar[0]
+    return {"label": neighbor["sentiment"], "score": neighbor["similarity"], "reused_from": neighbor["id"]}
+
+
+def _build_outputs(text: str, corrected_text: str, tokenized_text: str, sentiment: dict, similar: list = None) -> tuple:
+    # Bản ghi lưu vào database và thông tin hiển thị
+    result = {
+        "text": tokenized_text,
+        "sentiment": sentiment['label'],
+    }
+    display_result = {
+        "original_text": text,
+        "corrected_text": corrected_text,
+        "tokenized_text": tokenized_text,
+        "sentiment_label": sentiment['label'],
+        "sentiment_score": round(sentiment['score'] * 100, 2),
+    }
+    if similar is not None:
+        display_result["similar"] = similar
+    if "reused_from" in sentiment:
+        display_result["reused_from"] = sentiment["reused_from"]
+    return result, display_result
+
+
+# =========================== Full Pipeline ===========================
+def full_pipeline(text: str, scheduler, save: bool = True, timeout: float = None, writer=None,
+                  index=None, similar_k: int = SIMILAR_TOP_K):
+    """
+    Chạy toàn bộ pipeline cho một câu: tiền xử lý → phân loại (qua scheduler)
+    → tìm bình luận tương tự → lưu lịch sử.
+
+    Args:
+        text (str): Câu gốc người dùng nhập.
+        scheduler: MicroBatchScheduler dùng chung.
+        save (bool): Lưu kết quả vào bảng sentiments.
+        timeout (float): Thời gian chờ tối đa (giây) cho bước phân loại.
+        writer: GroupCommitWriter để ghi lịch sử trên luồng nền; None thì ghi đồng bộ.
+        index: SimilarityIndex để tìm bình luận tương tự và lưu embedding; None thì bỏ qua.
+        similar_k (int): Số bình luận tương tự trả về.
+
+    Returns:
+        tuple: (result, display_result, error); error là None nếu thành công.
+            display_result['timings'] chứa thời gian (ms) của từng bước,
+            display_result['similar'] các bình luận tương tự (nếu có index).
+    """
+    timings = {}
+    try:
+        with stage_timer("total", timings):
+            # === Bước 1: Tiền xử lý
+            corrected_text, tokenized_text = preprocess_input(text, timings)
+
+            # Kiểm tra hợp lệ trước khi chạy model
+            if not is_valid_length(tokenized_text):
+                REQUESTS_TOTAL.inc(status="invalid")
+                return None, None, INVALID_LENGTH_ERROR
+
+            # === Bước 2: Phân loại cảm xúc (gom batch với các yêu cầu khác, gồm cả thời gian chờ)
+            with stage_timer("classify", timings):
+                sentiment = scheduler.classify(tokenized_text, timeout=timeout)
+            embedding = sentiment.pop("embedding", None)
+
+            # === Bước 3: Tìm bình luận tương tự trong lịch sử (trước khi lưu câu hiện tại)
+            similar = None
+            if index is not None and embedding is not None:
+                with stage_timer("similar_search", timings):
+                    similar = find_similar(index, embedding, similar_k)[0]
+                sentiment = reuse_neighbor_label(sentiment, similar)
+
+            # === Bước 4: Hợp nhất kết quả và lưu vào database
+            result, display_result = _build_outputs(text, corrected_text, tokenized_text, sentiment, similar)
+            if save:
+                with stage_timer("save_to_sqlite", timings):
+                    save_result(result, writer, embedding, index.store if index is not None else None)
+
+        # Thời gian từng bước (ms) để hiển thị cạnh chi tiết pipeline
+        display_result["timings"] = {stage: round(seconds * 1000, 2) for stage, seconds in timings.items()}
+
+        # Trả về kết quả
+        REQUESTS_TOTAL.inc(status="ok")
+        return result, display_result, None
+
+    except Exception as e:
+        REQUESTS_TOTAL.inc(status="error")
+        return None, None, f"Pipeline error: {e}. Please try again."
+
+
+def batch_pipeline(texts: list, scheduler, save: bool = True, timeout: float = None, writer=None,
+                   index=None, similar_k: int = SIMILAR_TOP_K) -> list:
+    """
+    Chạy pipeline cho nhiều câu; tất cả câu hợp lệ được đưa vào scheduler cùng lúc
+    để model xử lý chung trong các micro-batch, và được tìm bình luận tương tự trong một lần duyệt.
+
+    Returns:
+        list: Mỗi phần tử là (result, display_result, error) theo đúng thứ tự texts.
+    """
+    outputs = [None] * len(texts)
+    pending = []
+    for i, text in enumerate(texts):
+        try:
+            corrected_text, tokenized_text = preprocess_input(text)
+            if not is_valid_length(tokenized_text):
+                REQUESTS_TOTAL.inc(status="invalid")
+                outputs[i] = (None, None, INVALID_LENGTH_ERROR)
+                continue
+            # submit báo lỗi ngay nếu scheduler đã đóng
+            pending.append((i, text, corrected_text, tokenized_text, scheduler.submit(tokenized_text)))
+        except Exception as e:
+            REQUESTS_TOTAL.inc(status="error")
+            outputs[i] = (None, None, f"Pipeline error: {e}. Please try again.")
+
+    classified = []
+    for i, text, corrected_text, tokenized_text, future in pending:
+        try:
+            sentiment = future.result(timeout=timeout)
+            classified.append((i, text, corrected_text, tokenized_text, sentiment, sentiment.pop("embedding", None)))
+        except Exception as e:
+            REQUESTS_TOTAL.inc(status="error")
+            outputs[i] = (None, None, f"Pipeline error: {e}. Please try again.")
+
+    # Một lần duyệt index cho mọi câu có embedding
+    similar = {}
+    with_embedding = [item for item in classified if item[5] is not None]
+    if index is not None and with_embedding:
+        try:
+            with stage_timer("similar_search"):
+                found = find_similar(index, [item[5] for item in with_embedding], similar_k)
+            similar = {item[0]: neighbors for item, neighbors in zip(with_embedding, found)}
+        except Exception as e:
+            print(f"> Similar search failed: {e}")
+
+    for i, text, corrected_text, tokenized_text, sentiment, embedding in classified:
+        try:
+            neighbors = similar.get(i)
+            sentiment = reuse_neighbor_label(sentiment, neighbors)
+            result, display_result = _build_outputs(text, corrected_text, tokenized_text, sentiment, neighbors)
+            if save:
+                with stage_timer("save_to_sqlite"):
+                    save_result(result, writer, embedding, index.store if index is not None else None)
+            REQUESTS_TOTAL.inc(status="ok")
+            outputs[i] = (result, display_result, None)
+        except Exception as e:
+            REQUESTS_TOTAL.inc(status="error")
+            outputs[i] = (None, None, f"Pipeline error: {e}. Please try again.")
+    return outputs
@@ -1,18 +1,42 @@
-from underthesea import word_tokenize
-from constant import CORRECTION_DICT
+import os
+import re
+import sys
+import time
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from constant import CORRECTION_DICT, TOKENIZE_CACHE_SIZE
+
+def build_correction_pattern(correction_dict: dict) -> re.Pattern:
+    # Ghép toàn bộ từ điển thành một regex duy nhất, ưu tiên cụm dài hơn (kể cả cụm nhiều từ).
+    # Một từ chỉ khớp khi không dính liền với chữ/số khác, nên "k," hay "ko!" vẫn được sửa.
+    # Dấu thanh rời (U+0300-U+036F) và "."/"'" nằm giữa hai chữ ("v.v", "t.p", "k's") được coi là
+    # một phần của từ, nên các từ đó được giữ nguyên như khi tách theo khoảng trắng.
+    keys = sorted((" ".join(key.split()) for key in correction_dict), key=len, reverse=True)
+    alternatives = "|".join(re.escape(key) for key in keys)
+    return re.compile(
+        rf"(?<![\w\u0300-\u036f-])(?<!\w[.'])(?:{alternatives})(?![\w\u0300-\u036f-])(?![.']\w)"
+    )
+
+CORRECTION_PATTERN = build_correction_pattern(CORRECTION_DICT)
+NORMALIZED_CORRECTION_DICT = {" ".join(key.split()): value for key, value in CORRECTION_DICT.items()}
 
 def standardize_text(text: str) -> str:
     standardized_text = text.strip().lower()
     return standardized_text
 
 def correct_slang_words(text: str) -> str:
-    words = text.split()
-    corrected_words = [CORRECTION_DICT.get(w, w) for w in words]
-    corrected_text = " ".join(corrected_words)
+    # Chuẩn hóa NFC (chữ có dấu dạng tổ hợp sẵn), gộp khoảng trắng rồi thay thế tất cả từ lóng trong một lần quét
+    normalized_text = " ".join(unicodedata.normalize("NFC", text).split())
+    corrected_text = CORRECTION_PATTERN.sub(lambda m: NORMALIZED_CORRECTION_DICT[m.group(0)], normalized_text)
     return corrected_text
 
-def tokenize_text(text: str) -> str:
-    # Tách từ sử dụng underthesea
+@lru_cache(maxsize=TOKENIZE_CACHE_SIZE)
+def _segment(text: str) -> str:
+    # Tách từ sử dụng underthesea (import khi cần để không làm chậm lúc khởi động app)
+    from underthesea import word_tokenize
+
     tokenized_list = word_tokenize(text)
 
     # Thay khoảng trắng trong token bằng dấu gạch dưới
@@ -21,4 +45,123 @@ def tokenize_text(text: str) -> str:
         processed_tokens.append(token.replace(" ", "_"))
     final_text = " ".join(processed_tokens)
 
-    return final_text
\ No newline at end of file
+    return final_text
+
+def tokenize_text(text: str) -> str:
+    # Kết quả tách từ được ghi nhớ, câu lặp lại không phải chạy underthesea
+    return _segment(text)
+
+def preprocess_text(text: str) -> str:
+    # standardize → sửa từ lóng → tách từ
+    return tokenize_text(correct_slang_words(standardize_text(text)))
+
+# =========================== Batch Preprocessing ===========================
+PREPROCESSING_STAGES = (
+    ("standardize_text", standardize_text),
+    ("correct_slang_words", correct_slang_words),
+    ("tokenize_text", tokenize_text),
+)
+
+def _preprocess_chunk(texts: list) -> tuple:
+    # Chạy lần lượt từng bước cho cả khối và đo thời gian của mỗi bước
+    timings = {}
+    for stage_name, stage in PREPROCESSING_STAGES:
+        start = time.perf_counter()
+        texts = [stage(text) for text in texts]
+        timings[stage_name] = time.perf_counter() - start
+    return texts, timings
+
+def preprocess_batch(texts: list, workers: int = None, chunk_size: int = 256, executor=None) -> tuple:
+    """
+    Tiền xử lý một danh sách văn bản, chia thành từng khối chạy song song trên process pool.
+
+    Kết quả giống hệt việc gọi preprocess_text cho từng câu, theo đúng thứ tự đầu vào.
+
+    Args:
+        texts (list): Danh sách văn bản gốc.
+        workers (int): Số process, mặc định os.cpu_count(); 1 để chạy trong process hiện tại.
+        chunk_size (int): Số câu mỗi khối gửi sang một process.
+        executor: Process pool có sẵn để dùng lại giữa nhiều lần gọi (bỏ qua workers).
+
+    Returns:
+        tuple: (danh sách văn bản đã tách từ, dict thời gian CPU (giây) của từng bước và 'total' là thời gian thực)
+    """
+    start = time.perf_counter()
+    texts = list(texts)
+    chunks = [texts[i:i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    workers = workers or os.cpu_count() or 1
+
+    if executor is not None:
+        processed, timings = _merge_chunks(executor.map(_preprocess_chunk, chunks))
+    elif workers <= 1 or len(chunks) <= 1:
+        processed, timings = _merge_chunks(map(_preprocess_chunk, chunks))
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(chunks))) as pool:
+            processed, timings = _merge_chunks(pool.map(_preprocess_chunk, chunks))
+
+    timings["total"] = time.perf_counter() - start
+    return processed, timings
+
+def _merge_chunks(outputs) -> tuple:
+    processed = []
+    timings = {stage_name: 0.0 for stage_name, _ in PREPROCESSING_STAGES}
+    for chunk_texts, chunk_timings in outputs:
+        processed.extend(chunk_texts)
+        for stage_name, seconds in chunk_timings.items():
+            timings[stage_name] += seconds
+    return processed, timings
+
+def format_timing_report(timings: dict, count: int) -> str:
+    lines = [f"> Preprocessed {count} texts in {timings['total']:.3f}s"]
+    for stage_name, _ in PREPROCESSING_STAGES:
+        seconds = timings[stage_name]
+        per_text = seconds / count * 1000 if count else 0.0
+        lines.append(f"  - {stage_name:<20} {seconds:8.3f}s  ({per_text:.3f} ms/text)")
+    return "\n".join(lines)
+
+# Các câu mà regex sửa từ lóng dễ làm sai: chữ dạng NFD, viết tắt có "." hoặc "'" giữa hai chữ
+# (cách tách theo khoảng trắng cũ giữ nguyên), và các trường hợp vẫn phải được sửa
+CORRECTION_EDGE_CASES = [
+    (unicodedata.normalize("NFD", "à vâng"), "à vâng"),
+    (unicodedata.normalize("NFD", "é"), "é"),
+    (unicodedata.normalize("NFD", "k vui"), "không vui"),
+    ("v.v", "v.v"),
+    ("t.p hcm", "t.p hcm"),
+    ("m.n", "m.n"),
+    ("k's", "k's"),
+    ("đi với e.", "đi với em."),
+    ("k, ko!", "không, không!"),
+    ("'k' vui", "'không' vui"),
+]
+
+def verify_preprocessing(csv_path: str = "data_sentiment_vn.csv", workers: int = None) -> list:
+    """
+    So sánh preprocess_batch với cách xử lý từng câu bằng split từ điển cũ trên file CSV,
+    và correct_slang_words với kết quả mong đợi của CORRECTION_EDGE_CASES.
+
+    Returns:
+        list: Các cặp (câu gốc, kết quả batch, kết quả tham chiếu) bị lệch, rỗng nếu khớp hoàn toàn.
+    """
+    import pandas as pd
+
+    texts = pd.read_csv(csv_path)["text"].astype(str).tolist()
+    processed, timings = preprocess_batch(texts, workers=workers, chunk_size=max(1, len(texts) // 4))
+    print(format_timing_report(timings, len(texts)))
+
+    mismatches = []
+    for text, batch_output in zip(texts, processed):
+        words = standardize_text(text).split()
+        reference = tokenize_text(" ".join(CORRECTION_DICT.get(w, w) for w in words))
+        if batch_output != reference:
+            mismatches.append((text, batch_output, reference))
+    for text, expected in CORRECTION_EDGE_CASES:
+        corrected = correct_slang_words(text)
+        if corrected != expected:
+            mismatches.append((text, corrected, expected))
+    return mismatches
+
+if __name__ == "__main__":
+    mismatches = verify_preprocessing(*sys.argv[1:2])
+    for text, batch_output, reference in mismatches:
+        print(f"! {text!r}: {batch_output!r} != {reference!r}")
+    print(f"> {len(mismatches)} mismatches")
@@ -0,0 +1,87 @@
+import threading
+from collections import OrderedDict
+
+from constant import RESULT_CACHE_RETENTION_DAYS
+from database import load_cached_sentiments, purge_retired_cache, save_cached_sentiments
+from metrics import CACHE_LOOKUPS
+
+
+class SentimentCache:
+    """
+    Cache kết quả phân loại hai tầng:
+        - Tầng 1: LRU trong bộ nhớ, giới hạn max_size phần tử.
+        - Tầng 2: bảng sentiment_cache trong SQLite, dùng chung giữa các tiến trình.
+
+    Mỗi kết quả được gắn với model_version (tên model + hash classifier); khóa trong SQLite là
+    (câu, model_version) nên các tiến trình chạy phiên bản khác nhau không ghi đè lên nhau.
+    Lúc khởi tạo chỉ xóa các phiên bản đã ngừng dùng quá RESULT_CACHE_RETENTION_DAYS ngày.
+    """
+
+    def __init__(self, model_version: str, max_size: int = 10000, retention_days: float = RESULT_CACHE_RETENTION_DAYS):
+        self.model_version = model_version
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        # Xóa kết quả của các phiên bản model đã ngừng dùng
+        purge_retired_cache(model_version, retention_days)
+
+    @staticmethod
+    def make_key(text: str) -> str:
+        # Gộp khoảng trắng thừa để các câu giống nhau dùng chung một khóa
+        return " ".join(text.split())
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get_many(self, keys: list) -> dict:
+        """
+        Tra cứu nhiều khóa cùng lúc, trả về dict {key: {'label', 'score'}} cho các khóa tìm thấy.
+        """
+        found = {}
+        missing = []
+        with self._lock:
+            for key in keys:
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[key] = self._entries[key]
+                else:
+                    missing.append(key)
+
+        # Những khóa không có trong bộ nhớ thì tra tiếp trong SQLite
+        if missing:
+            stored = load_cached_sentiments(missing, self.model_version)
+            if stored:
+                self._remember(stored)
+                found.update(stored)
+
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        CACHE_LOOKUPS.inc(len(found), result="hit")
+        CACHE_LOOKUPS.inc(len(keys) - len(found), result="miss")
+        return found
+
+    def put_many(self, results: dict):
+        """
+        Ghi nhiều kết quả {key: {'label', 'score'}} vào cả hai tầng cache.
+        """
+        if not results:
+            return
+        self._remember(results)
+        save_cached_sentiments(results, self.model_version)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _remember(self, results: dict):
+        with self._lock:
+            for key, value in results.items():
+                self._entries[key] = value
+                self._entries.move_to_end(key)
+            # Loại bỏ phần tử ít dùng nhất khi vượt quá giới hạn
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
@@ -1,7 +1,12 @@
 import torch
-from torch.utils.data import DataLoader
 import numpy as np
-from torch.utils.data import Dataset
+
+from constant import MAX_TOKEN_LENGTH
+from metrics import stage_timer
+from tokenization import length_bucketed_batches, pad_batch, tokenize_batch
+
+# Ánh xạ chỉ số lớp sang nhãn
+LABEL_MAP = {0: "NEGATIVE", 1: "NEUTRAL", 2: "POSITIVE"}
 
 def classify_sentiment(text: str, pipeline) -> dict:
     """
@@ -18,94 +23,136 @@ def classify_sentiment(text: str, pipeline) -> dict:
     Returns:
         dict: Kết quả phân loại gồm nhãn ('label') và độ tin cậy ('score')
     """
+    return classify_batch([text], pipeline)[0]
+
+def classify_batch(texts: list, pipeline, batch_size: int = 32, max_len: int = MAX_TOKEN_LENGTH) -> list:
+    """
+    Phân loại cảm xúc cho một danh sách văn bản với một lần forward cho mỗi batch.
+
+    Các câu được nhóm theo độ dài token, mỗi batch chỉ được padding đến câu dài nhất
+    trong batch đó (dynamic padding) thay vì padding cố định đến max_len.
+
+    Args:
+        texts (list): Danh sách chuỗi văn bản (đã tiền xử lý) cần phân loại.
+        pipeline (dict): Pipeline trả về từ load_model_pipeline().
+        batch_size (int): Số câu tối đa trong một lần forward.
+        max_len (int): Độ dài tối đa (token) mỗi câu, phần dư bị cắt bớt.
+
+    Returns:
+        list: Danh sách dict {'label', 'score'} theo đúng thứ tự của texts
+            (thêm 'embedding' float16 nếu pipeline có 'return_embeddings').
+    """
 
     # Kiểm tra xem pipeline đã được khởi tạo chưa
     if pipeline is None:
         raise Exception("Pipeline has not been initialized.")
-    
+
+    if not texts:
+        return []
+
+    # Không có cache thì chạy thẳng model
+    cache = pipeline.get("cache")
+    if cache is None:
+        return _predict_batch(texts, pipeline, batch_size, max_len)
+
+    # Chỉ chạy model cho những câu (không trùng lặp) chưa có trong cache
+    keys = [cache.make_key(text) for text in texts]
+    unique_keys = list(dict.fromkeys(keys))
+    found = cache.get_many(unique_keys)
+    missing = [key for key in unique_keys if key not in found]
+
+    if missing:
+        predicted = dict(zip(missing, _predict_batch(missing, pipeline, batch_size, max_len)))
+        cache.put_many(predicted)
+        found.update(predicted)
+
+    return [dict(found[key]) for key in keys]
+
+def extract_cls_embeddings(texts: list, pipeline, batch_size: int = 32, max_len: int = MAX_TOKEN_LENGTH) -> np.ndarray:
+    """
+    Sinh embedding [CLS] của PhoBERT cho danh sách văn bản.
+
+    Returns:
+        np.ndarray: Ma trận (len(texts), hidden_size) theo thứ tự đầu vào.
+    """
     # Lấy các thành phần từ pipeline
     model = pipeline["model"]
     tokenizer = pipeline["tokenizer"]
-    classifier = pipeline["classifier"]
     device = pipeline["device"]
 
-    # Tạo dataset chỉ chứa một mẫu văn bản
-    dataset = InferenceDataset([text], tokenizer)
-    # DataLoader giúp chia dữ liệu thành batch
-    loader = DataLoader(dataset, batch_size=1)
+    # Tokenize toàn bộ một lần, sau đó nhóm các câu có độ dài gần nhau vào cùng batch
+    with stage_timer("model_tokenize"):
+        input_ids = tokenize_batch(tokenizer, texts, max_len)
+    batches = length_bucketed_batches([len(ids) for ids in input_ids], batch_size)
 
-    features = []
+    features = None
 
     # Tắt gradient để chỉ inference (dự đoán)
-    with torch.no_grad():
-        for batch in loader:
-            # Đưa dữ liệu lên CPU
-            input_ids = batch["input_ids"].to(device)
-            attention_mask = batch["attention_mask"].to(device)
+    with stage_timer("encoder_forward"), torch.no_grad():
+        for indices in batches:
+            # Chỉ padding đến câu dài nhất trong batch
+            encoded = pad_batch([input_ids[i] for i in indices], tokenizer.pad_token_id)
 
             # Chạy mô hình transformer để lấy embedding
-            outputs = model(input_ids=input_ids, attention_mask=attention_mask)
+            outputs = model(
+                input_ids=encoded["input_ids"].to(device),
+                attention_mask=encoded["attention_mask"].to(device),
+            )
 
-            # Lấy embedding của token [CLS] (đại diện toàn câu)
+            # Lấy embedding của token [CLS] (đại diện toàn câu) và đặt lại đúng vị trí ban đầu
             cls_embedding = outputs[0][:, 0, :].cpu().numpy()
+            if features is None:
+                features = np.empty((len(texts), cls_embedding.shape[1]), dtype=cls_embedding.dtype)
+            features[indices] = cls_embedding
 
-            # Lưu embedding vào danh sách
-            features.append(cls_embedding)
-
-    # Ghép các embedding lại thành ma trận numpy
-    features = np.vstack(features)
-
-    # Dự đoán xác suất các lớp bằng SVM classifier
-    proba = classifier.predict_proba(features)[0]
+    return features
 
-    # Lấy chỉ số lớp có xác suất cao nhất
-    label_idx = classifier.predict(features)[0]
-    # Lấy điểm tin cậy cao nhất
-    score = float(max(proba))
-
-    # Nếu độ tin cậy thấp hơn 0.5, gán nhãn là NEUTRAL
-    if score < 0.5:
-        label_idx = 1
-
-    # Ánh xạ chỉ số lớp sang nhãn
-    label_map = {0: "NEGATIVE", 1: "NEUTRAL", 2: "POSITIVE"}
-    label = label_map[label_idx]
-
-    # Trả về nhãn cảm xúc và điểm tin cậy
-    return {"label": label, "score": score}
+def predict_from_features(features: np.ndarray, classifier) -> list:
+    """
+    Dự đoán nhãn và điểm tin cậy từ ma trận embedding [CLS].
 
-class InferenceDataset(Dataset):
+    Returns:
+        list: Danh sách dict {'label', 'score'} theo thứ tự các dòng của features.
     """
-    Dataset dùng cho inference (dự đoán).
-    Mỗi phần tử trong dataset là một văn bản được mã hóa bởi tokenizer.
+    # Dự đoán xác suất và nhãn cho toàn bộ batch
+    if hasattr(classifier, "predict_with_proba"):
+        # LinearHead: nhãn và xác suất từ cùng một phép nhân ma trận
+        label_idxs, probas = classifier.predict_with_proba(features)
+    else:
+        probas = classifier.predict_proba(features)
+        label_idxs = classifier.predict(features)
+    return format_predictions(label_idxs, probas)
+
+def format_predictions(label_idxs, probas) -> list:
     """
-
-    def __init__(self, texts, tokenizer, max_len=100):
-        self.texts = texts              # Danh sách các chuỗi văn bản
-        self.tokenizer = tokenizer      # Tokenizer để chuyển text thành token ID
-        self.max_len = max_len          # Độ dài tối đa mỗi câu
-
-    def __len__(self):
-        # Trả về số lượng mẫu trong dataset
-        return len(self.texts)
-
-    def __getitem__(self, idx):
-        # Lấy một văn bản theo chỉ số
-        text = self.texts[idx]
-
-        # Tokenize và mã hóa câu thành input cho model
-        encoded = self.tokenizer.encode_plus(
-            text,
-            add_special_tokens=True,     # Thêm token [CLS], [SEP]
-            max_length=self.max_len,     # Giới hạn độ dài tối đa
-            padding="max_length",        # Padding đến độ dài cố định
-            truncation=True,             # Cắt bớt nếu vượt quá max_len
-            return_attention_mask=True,  # Trả về attention mask
-            return_tensors="pt",         # Trả về tensor PyTorch
-        )
-
-        # Trả về dict chứa input_ids và attention_mask (loại bỏ chiều batch=1)
-        return {
-            "input_ids": encoded["input_ids"].squeeze(0),
-            "attention_mask": encoded["attention_mask"].squeeze(0)
-        }
\ No newline at end of file
+    Chuyển chỉ số lớp và ma trận xác suất thành danh sách dict {'label', 'score'}.
+    """
+    results = []
+    for label_idx, proba in zip(label_idxs, probas):
+        # Lấy điểm tin cậy cao nhất
+        score = float(max(proba))
+
+        # Nếu độ tin cậy thấp hơn 0.5, gán nhãn là NEUTRAL
+        if score < 0.5:
+            label_idx = 1
+
+        results.append({"label": LABEL_MAP[int(label_idx)], "score": score})
+
+    # Trả về nhãn cảm xúc và điểm tin cậy theo thứ tự đầu vào
+    return results
+
+def _predict_batch(texts: list, pipeline, batch_size: int, max_len: int) -> list:
+    # Chạy PhoBERT + classifier cho danh sách văn bản, không qua cache
+    early_exit = pipeline.get("early_exit")
+    if early_exit is not None:
+        # Chế độ early exit: câu dễ dừng ở layer giữa, không chạy hết encoder
+        return early_exit.classify(texts, pipeline["tokenizer"], pipeline["device"], batch_size, max_len)
+    features = extract_cls_embeddings(texts, pipeline, batch_size, max_len)
+    with stage_timer("classifier"):
+        results = predict_from_features(features, pipeline["classifier"])
+
+    # Giữ lại embedding (float16) để lưu vào embedding store và tìm câu tương tự
+    if pipeline.get("return_embeddings"):
+        for result, feature in zip(results, features):
+            result["embedding"] = feature.astype(np.float16)
+    return results
@@ -0,0 +1,262 @@
+import argparse
+import asyncio
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from constant import EMBEDDING_STORE_DIR, EMBEDDING_STORE_ENABLED, MODEL_BACKEND, MODEL_REGISTRY_POLL_SECONDS, SERVICE_MAX_BATCH_TEXTS, SERVICE_MAX_PENDING, SERVICE_TIMEOUT_SECONDS, SERVICE_WORKERS
+from database import initialize_database
+from db_writer import GroupCommitWriter
+from embedding_store import EmbeddingStore, SimilarityIndex
+from metrics import REGISTRY, start_metrics_history
+from model_loading import ClassifierWatcher, ModelWarmup
+from pipeline import INVALID_LENGTH_ERROR, batch_pipeline, full_pipeline
+
+# Kích thước body tối đa của một yêu cầu (byte)
+MAX_BODY_BYTES = 1 << 20
+
+PENDING_REQUESTS = REGISTRY.gauge("vnsaa_service_pending_requests", "HTTP requests queued or running in the service worker pool.")
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: list = None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.headers = headers or []
+
+
+class SentimentService:
+    """
+    Ứng dụng ASGI (không cần framework) phục vụ phân loại cảm xúc qua HTTP, độc lập với Streamlit.
+
+    Endpoint:
+        - GET  /health            trạng thái khởi động, số yêu cầu đang xử lý, hàng đợi scheduler, phiên bản classifier
+        - GET  /metrics           metric của pipeline theo định dạng text của Prometheus
+        - POST /sentiment         {"text": "...", "save": true}
+        - POST /sentiment/batch   {"texts": ["...", ...], "save": true}
+    Kết quả kèm "similar" (các bình luận cũ gần nhất) nếu có SimilarityIndex.
+
+    Pipeline chạy trên một thread pool SERVICE_WORKERS luồng (tiền xử lý + chờ scheduler);
+    lịch sử được ghi theo nhóm bởi GroupCommitWriter trên luồng nền.
+    Khi đã có max_pending yêu cầu đang chờ/chạy, yêu cầu mới bị từ chối ngay bằng 503
+    thay vì xếp hàng vô hạn; yêu cầu quá timeout giây trả về 504.
+    """
+
+    def __init__(self, warmup: ModelWarmup, workers: int = SERVICE_WORKERS, max_pending: int = SERVICE_MAX_PENDING,
+                 timeout: float = SERVICE_TIMEOUT_SECONDS, max_batch_texts: int = SERVICE_MAX_BATCH_TEXTS,
+                 recorder=None, writer: GroupCommitWriter = None, index=None):
+        self.warmup = warmup
+        self.recorder = recorder
+        self.writer = writer
+        self.index = index
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.max_batch_texts = max_batch_texts
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sentiment-service")
+
+        self._pending = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        PENDING_REQUESTS.set_function(lambda: self._pending)
+        self._routes = {
+            ("GET", "/health"): self.health,
+            ("GET", "/metrics"): self.metrics,
+            ("POST", "/sentiment"): self.sentiment,
+            ("POST", "/sentiment/batch"): self.sentiment_batch,
+        }
+
+    # =========================== ASGI ===========================
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+
+        headers = []
+        try:
+            handler = self._routes.get((scope["method"], scope["path"]))
+            if handler is None:
+                raise HTTPError(404, f"No route for {scope['method']} {scope['path']}")
+            status, payload = await handler(await self._read_json(scope, receive))
+        except HTTPError as e:
+            status, payload, headers = e.status, {"error": e.message}, e.headers
+
+        # Handler trả về chuỗi thì gửi dạng text, ngược lại dạng JSON
+        if isinstance(payload, str):
+            body, content_type = payload.encode("utf-8"), b"text/plain; version=0.0.4; charset=utf-8"
+        else:
+            body, content_type = json.dumps(payload, ensure_ascii=False).encode("utf-8"), b"application/json; charset=utf-8"
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type), (b"content-length", str(len(body)).encode())] + headers,
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.close()
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_json(scope, receive):
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if len(body) > MAX_BODY_BYTES:
+                raise HTTPError(413, f"Request body exceeds {MAX_BODY_BYTES} bytes")
+            if not message.get("more_body"):
+                break
+        if scope["method"] == "GET" or not body:
+            return {}
+        try:
+            payload = json.loads(body)
+        except ValueError:
+            raise HTTPError(400, "Request body must be valid JSON")
+        if not isinstance(payload, dict):
+            raise HTTPError(400, "Request body must be a JSON object")
+        return payload
+
+    # =========================== Worker Pool ===========================
+    async def _run(self, fn, *args):
+        # Chiếm một chỗ trong giới hạn max_pending; chỗ chỉ được trả khi công việc thực sự xong,
+        # kể cả khi yêu cầu đã hết thời gian chờ, để backpressure phản ánh đúng tải của worker
+        if not self.warmup.ready:
+            raise HTTPError(503, "Model is still loading" if not self.warmup.failed else f"Model failed to load: {self.warmup.error}",
+                            [(b"retry-after", b"5")])
+        with self._lock:
+            # Đã đóng (đang tắt) thì không nhận thêm việc; kiểm tra và submit cùng trong khóa
+            # nên close() không thể tắt executor giữa hai bước
+            if self._closed:
+                raise HTTPError(503, "Server is shutting down")
+            if self._pending >= self.max_pending:
+                raise HTTPError(503, "Server is busy, please retry later", [(b"retry-after", b"1")])
+            self._pending += 1
+            future = self.executor.submit(fn, *args)
+        future.add_done_callback(self._release)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(future), self.timeout)
+        except asyncio.TimeoutError:
+            raise HTTPError(504, f"Request timed out after {self.timeout} seconds")
+
+    def _release(self, _):
+        with self._lock:
+            self._pending -= 1
+
+    def close(self):
+        # Từ chối yêu cầu mới, chờ các yêu cầu đang chạy, rồi ghi nốt lịch sử còn trong hàng đợi
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self.executor.shutdown(wait=True)
+        if self.writer is not None:
+            self.writer.close()
+        if self.recorder is not None:
+            self.recorder.close()
+        if self.warmup.scheduler is not None:
+            self.warmup.scheduler.close()
+
+    # =========================== Handlers ===========================
+    async def health(self, _):
+        status = "ready" if self.warmup.ready else "failed" if self.warmup.failed else "loading"
+        payload = {
+            "status": status,
+            "phase": self.warmup.phase,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "scheduler_queue": self.warmup.scheduler.queue_size() if self.warmup.scheduler else 0,
+            "classifier_version": self.warmup.pipeline.get("classifier_version") if self.warmup.ready else None,
+        }
+        return (200 if self.warmup.ready else 503), payload
+
+    async def metrics(self, _):
+        return 200, REGISTRY.render_prometheus()
+
+    async def sentiment(self, payload):
+        text = payload.get("text")
+        if not isinstance(text, str):
+            raise HTTPError(422, "'text' must be a string")
+
+        result, display_result, error = await self._run(
+            full_pipeline, text, self.warmup.scheduler, bool(payload.get("save", True)), self.timeout, self.writer,
+            self.index,
+        )
+        if error:
+            raise HTTPError(422 if error == INVALID_LENGTH_ERROR else 500, error)
+        return 200, _format_result(display_result)
+
+    async def sentiment_batch(self, payload):
+        texts = payload.get("texts")
+        if not isinstance(texts, list) or not all(isinstance(text, str) for text in texts):
+            raise HTTPError(422, "'texts' must be a list of strings")
+        if len(texts) > self.max_batch_texts:
+            raise HTTPError(413, f"At most {self.max_batch_texts} texts per request")
+
+        outputs = await self._run(
+            batch_pipeline, texts, self.warmup.scheduler, bool(payload.get("save", True)), self.timeout, self.writer,
+            self.index,
+        )
+        results = [_format_result(display_result) if error is None else {"text": text, "error": error}
+                   for text, (_, display_result, error) in zip(texts, outputs)]
+        return 200, {"results": results}
+
+
+def _format_result(display_result: dict) -> dict:
+    formatted = {
+        "text": display_result["original_text"],
+        "tokenized_text": display_result["tokenized_text"],
+        "sentiment": display_result["sentiment_label"],
+        "score": display_result["sentiment_score"],
+    }
+    for key in ("similar", "reused_from"):
+        if key in display_result:
+            formatted[key] = display_result[key]
+    return formatted
+
+
+def create_app(backend: str = MODEL_BACKEND, **kwargs) -> SentimentService:
+    """
+    Khởi tạo database, bắt đầu tải model trên luồng nền và trả về ứng dụng ASGI.
+    Các tham số còn lại (workers, max_pending, timeout, max_batch_texts) chuyển cho SentimentService.
+    """
+    initialize_database()
+    store = EmbeddingStore(EMBEDDING_STORE_DIR) if EMBEDDING_STORE_ENABLED else None
+    warmup = ModelWarmup(backend).start()
+    # Classifier head mới trong model registry được đổi ngay khi đang phục vụ
+    if MODEL_REGISTRY_POLL_SECONDS:
+        ClassifierWatcher(warmup).start()
+    return SentimentService(
+        warmup,
+        recorder=start_metrics_history(),
+        writer=GroupCommitWriter(embedding_store=store),
+        index=SimilarityIndex(store) if store is not None else None,
+        **kwargs,
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the sentiment pipeline over HTTP (ASGI).")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--backend", default=MODEL_BACKEND)
+    parser.add_argument("--workers", type=int, default=SERVICE_WORKERS, help="Threads running the pipeline")
+    parser.add_argument("--max-pending", type=int, default=SERVICE_MAX_PENDING, help="Requests in flight before returning 503")
+    parser.add_argument("--timeout", type=float, default=SERVICE_TIMEOUT_SECONDS, help="Per-request timeout in seconds")
+    args = parser.parse_args()
+
+    try:
+        import uvicorn
+    except ImportError as e:
+        raise ImportError("Running the service requires an ASGI server: pip install uvicorn") from e
+
+    app = create_app(args.backend, workers=args.workers, max_pending=args.max_pending, timeout=args.timeout)
+    uvicorn.run(app, host=args.host, port=args.port)
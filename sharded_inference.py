@@ -0,0 +1,268 @@
+import argparse
+import multiprocessing as mp
+import os
+import queue
+import time
+from collections import deque
+
+from constant import MODEL_BACKEND
+
+# Số khối tối đa đang nằm ở worker cho mỗi worker (giới hạn bộ nhớ của bộ đệm sắp xếp)
+INFLIGHT_CHUNKS_PER_WORKER = 2
+
+
+# =========================== Worker Process ===========================
+def _worker_main(worker_id: int, pipeline, backend: str, threads: int, cores: list,
+                 batch_size: int, preprocess: bool, tasks, results):
+    import torch
+
+    # Mỗi replica chỉ dùng đúng số thread (và nhóm core) được chia, không tranh nhau CPU
+    if cores and hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, cores)
+    torch.set_num_threads(threads)
+
+    from preprocessing import preprocess_text
+    from sentiment_classification import classify_batch
+
+    # Không có fork thì mỗi worker tự tải model của mình
+    if pipeline is None:
+        from model_loading import build_model_pipeline
+
+        pipeline = build_model_pipeline(backend, use_cache=False)
+
+    while True:
+        item = tasks.get()
+        if item is None:
+            return
+        index, texts = item
+        try:
+            if preprocess:
+                texts = [preprocess_text(text) for text in texts]
+            results.put((index, classify_batch(texts, pipeline, batch_size=batch_size), None))
+        except Exception as e:
+            results.put((index, None, f"worker {worker_id}: {e!r}"))
+
+
+# =========================== Engine ===========================
+class ShardedInferenceEngine:
+    """
+    Chạy phân loại trên nhiều process, mỗi process là một replica PhoBERT với số thread cố định.
+
+    Model được tải một lần ở process cha rồi mới fork: các worker dùng chung trang bộ nhớ
+    chứa trọng số (copy-on-write, chỉ đọc) thay vì mỗi worker giữ một bản riêng.
+    Trên nền tảng không có fork, mỗi worker tự tải model.
+
+    Đầu vào được chia thành các khối chunk_size câu, đưa vào một hàng đợi chung
+    (worker nào rảnh thì lấy), kết quả được trả về theo đúng thứ tự đầu vào.
+    """
+
+    def __init__(self, num_workers: int = None, threads_per_worker: int = 1, backend: str = MODEL_BACKEND,
+                 pipeline: dict = None, batch_size: int = 32, preprocess: bool = False, pin_cores: bool = True):
+        self.num_workers = num_workers or max(1, (os.cpu_count() or 1) // threads_per_worker)
+        self.threads_per_worker = threads_per_worker
+        self.max_inflight = self.num_workers * INFLIGHT_CHUNKS_PER_WORKER
+        # Số thứ tự khối tăng dần qua mọi lần gọi map()
+        self._sequence = 0
+
+        use_fork = "fork" in mp.get_all_start_methods()
+        context = mp.get_context("fork" if use_fork else "spawn")
+        if use_fork and pipeline is None:
+            from model_loading import build_model_pipeline
+
+            # Tải trước khi fork và không chạy forward ở process cha
+            # (thread pool OpenMP đã khởi động không an toàn khi fork)
+            pipeline = build_model_pipeline(backend, use_cache=False)
+        if pipeline is not None:
+            # Worker không dùng cache kết quả (kết nối SQLite không được chia sẻ qua fork)
+            pipeline = dict(pipeline, cache=None)
+
+        self._tasks = context.Queue()
+        self._results = context.Queue()
+        self._workers = []
+        for worker_id in range(self.num_workers):
+            process = context.Process(
+                target=_worker_main,
+                args=(worker_id, pipeline if use_fork else None, backend, threads_per_worker,
+                      self._cores_for(worker_id) if pin_cores else None, batch_size, preprocess,
+                      self._tasks, self._results),
+                name=f"sharded-inference-{worker_id}",
+                daemon=True,
+            )
+            process.start()
+            self._workers.append(process)
+
+    def _cores_for(self, worker_id: int) -> list:
+        # Chia các core được phép dùng thành các nhóm rời nhau; không đủ core thì không ghim
+        if not hasattr(os, "sched_getaffinity"):
+            return None
+        available = sorted(os.sched_getaffinity(0))
+        if len(available) < self.num_workers * self.threads_per_worker:
+            return None
+        start = worker_id * self.threads_per_worker
+        return available[start:start + self.threads_per_worker]
+
+    def map(self, texts, chunk_size: int = 256):
+        """
+        Phân loại một dãy văn bản (có thể là generator), trả về từng dict {'label', 'score'}
+        theo đúng thứ tự đầu vào ngay khi khối tương ứng hoàn thành.
+        Mỗi engine chỉ nên có một lần map() đang chạy tại một thời điểm.
+        """
+        buffered = {}
+        first_index = next_index = self._sequence
+
+        for chunk in _chunks(texts, chunk_size):
+            # Giới hạn số khối đang xử lý để bộ đệm sắp xếp không phình to
+            while self._sequence - next_index >= self.max_inflight:
+                next_index = yield from self._drain(buffered, first_index, next_index)
+            self._tasks.put((self._sequence, chunk))
+            self._sequence += 1
+
+        while next_index < self._sequence:
+            next_index = yield from self._drain(buffered, first_index, next_index)
+
+    def _drain(self, buffered: dict, first_index: int, next_index: int):
+        # Nhận thêm một khối kết quả rồi trả ra mọi khối liền mạch tính từ next_index;
+        # bỏ qua kết quả còn sót của một lần map() trước bị dừng giữa chừng
+        index, results = self._receive()
+        if index >= first_index:
+            buffered[index] = results
+        while next_index in buffered:
+            yield from buffered.pop(next_index)
+            next_index += 1
+        return next_index
+
+    def _receive(self) -> tuple:
+        while True:
+            try:
+                index, results, error = self._results.get(timeout=1)
+            except queue.Empty:
+                dead = [p.name for p in self._workers if not p.is_alive()]
+                if dead:
+                    raise RuntimeError(f"Inference worker(s) exited unexpectedly: {', '.join(dead)}")
+                continue
+            if error:
+                raise RuntimeError(error)
+            return index, results
+
+    def close(self):
+        for _ in self._workers:
+            self._tasks.put(None)
+        for process in self._workers:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _chunks(texts, chunk_size: int):
+    chunk = []
+    for text in texts:
+        chunk.append(text)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# =========================== Scaling Report ===========================
+def scaling_report(texts: list, max_workers: int, threads_per_worker: int = 1, backend: str = MODEL_BACKEND,
+                   chunk_size: int = 64, batch_size: int = 32, preprocess: bool = False) -> list:
+    """
+    Đo throughput với 1..max_workers worker trên cùng danh sách văn bản.
+
+    Returns:
+        list: Mỗi phần tử gồm workers, seconds, texts_per_second, speedup (so với 1 worker)
+            và efficiency (speedup / workers).
+    """
+    from model_loading import build_model_pipeline
+
+    # Tải model một lần, các engine fork từ cùng bản này
+    pipeline = build_model_pipeline(backend, use_cache=False)
+
+    report = []
+    for workers in range(1, max_workers + 1):
+        with ShardedInferenceEngine(workers, threads_per_worker, backend, pipeline, batch_size, preprocess) as engine:
+            # Một lượt chạy thử để worker khởi động xong trước khi đo
+            list(engine.map(texts[:chunk_size * workers], chunk_size))
+            start = time.perf_counter()
+            count = sum(1 for _ in engine.map(texts, chunk_size))
+            seconds = time.perf_counter() - start
+
+        row = {"workers": workers, "seconds": seconds, "texts_per_second": count / seconds}
+        row["speedup"] = row["texts_per_second"] / report[0]["texts_per_second"] if report else 1.0
+        row["efficiency"] = row["speedup"] / workers
+        report.append(row)
+        print(f"> {workers} worker(s): {row['texts_per_second']:.1f} texts/s, "
+              f"speedup {row['speedup']:.2f}x, efficiency {row['efficiency']:.0%}")
+    return report
+
+
+# =========================== Re-scoring ===========================
+def rescore_history(engine: ShardedInferenceEngine, read_chunk_size: int = 2000, write_chunk_size: int = 1000) -> tuple:
+    """
+    Chấm điểm lại toàn bộ bảng sentiments bằng engine và cập nhật nhãn đã thay đổi.
+
+    Văn bản được đọc theo keyset (id) và đưa liên tục vào engine; vì kết quả trả về
+    đúng thứ tự nên chỉ cần một hàng đợi id song song để ghép lại.
+
+    Returns:
+        tuple: (số dòng đã chấm, số dòng đổi nhãn)
+    """
+    from database import iter_sentiment_rows, update_sentiments
+
+    pending = deque()
+
+    def texts():
+        for rows in iter_sentiment_rows(read_chunk_size):
+            for row_id, text, sentiment in rows:
+                pending.append((row_id, sentiment))
+                yield text
+
+    scored = changed = 0
+    updates = []
+    for result in engine.map(texts()):
+        row_id, old_sentiment = pending.popleft()
+        scored += 1
+        if result["label"] != old_sentiment:
+            updates.append((result["label"], row_id))
+        if len(updates) >= write_chunk_size:
+            changed += update_sentiments(updates)
+            updates = []
+        if scored % 10000 == 0:
+            print(f"> Rescored {scored} rows ({changed + len(updates)} changed)")
+    changed += update_sentiments(updates)
+    return scored, changed
+
+
+# =========================== Main ===========================
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Multi-process PhoBERT inference: scaling report and history re-scoring.")
+    parser.add_argument("command", choices=["scale", "rescore"])
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="Worker processes (max for 'scale')")
+    parser.add_argument("--threads", type=int, default=1, help="Torch threads per worker")
+    parser.add_argument("--backend", default=MODEL_BACKEND)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--csv", default="data_sentiment_vn.csv", help="Texts used by 'scale'")
+    parser.add_argument("--repeat", type=int, default=4, help="Repeat the CSV texts this many times for 'scale'")
+    args = parser.parse_args()
+
+    if args.command == "scale":
+        import pandas as pd
+
+        from preprocessing import preprocess_batch
+
+        texts, _ = preprocess_batch(pd.read_csv(args.csv)["text"].astype(str).tolist(), workers=1)
+        scaling_report(texts * args.repeat, args.workers, args.threads, args.backend, batch_size=args.batch_size)
+    else:
+        from database import initialize_database
+
+        initialize_database()
+        with ShardedInferenceEngine(args.workers, args.threads, args.backend, batch_size=args.batch_size) as engine:
+            scored, changed = rescore_history(engine)
+        print(f"> Done. {scored} rows rescored, {changed} labels changed")
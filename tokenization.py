@@ -0,0 +1,257 @@
+import argparse
+import random
+import re
+import time
+from functools import lru_cache
+
+import numpy as np
+import torch
+from torch.utils.data import Sampler
+
+from constant import MAX_TOKEN_LENGTH, PHOBERT_WORD_CACHE_SIZE
+
+# Cách tách từ trước khi chạy BPE của PhobertTokenizer._tokenize
+_WORD_PATTERN = re.compile(r"\S+\n?")
+
+# =========================== Cached PhoBERT Tokenizer ===========================
+class CachedPhobertTokenizer:
+    """
+    Đường tokenize nhanh cho PhobertTokenizer (bản slow, thuần Python), cho cùng token ID.
+
+    Tokenizer gốc mã hóa từng câu qua toàn bộ bộ máy của PreTrainedTokenizer (tách added
+    token, tokenize, đổi token sang ID, thêm token đặc biệt, cắt câu). Ở đây mỗi câu chỉ còn
+    tách từ theo khoảng trắng rồi nối các ID của từng từ, lấy từ một LRU cache có giới hạn
+    (từ vựng tiếng Việt ít và lặp lại nhiều); BPE chỉ chạy cho từ chưa có trong cache.
+    Câu có chứa chuỗi của added token (<s>, </s>, <unk>, ...) được chuyển cho tokenizer gốc.
+
+    Các thuộc tính và phương thức khác (pad_token_id, save_pretrained, gọi trực tiếp, ...)
+    được chuyển tiếp cho tokenizer gốc.
+    """
+
+    def __init__(self, tokenizer, cache_size: int = PHOBERT_WORD_CACHE_SIZE):
+        self.tokenizer = tokenizer
+        added = sorted(tokenizer.added_tokens_encoder, key=len, reverse=True)
+        self._added_pattern = re.compile("|".join(map(re.escape, added))) if added else None
+        self.word_ids = lru_cache(maxsize=cache_size)(self._encode_word)
+
+    def _encode_word(self, word: str) -> tuple:
+        pieces = self.tokenizer.bpe(word).split(" ")
+        # bpe() tự ghi nhớ mọi từ trong một dict không giới hạn; bỏ đi vì đã có LRU cache ở trên
+        self.tokenizer.cache.pop(word, None)
+        return tuple(self.tokenizer.convert_tokens_to_ids(pieces))
+
+    def encode_ids(self, texts: list, max_len: int = MAX_TOKEN_LENGTH) -> list:
+        """
+        Giống tokenize_batch với tokenizer gốc: token ID có <s>, </s>, cắt bớt theo max_len, chưa padding.
+        """
+        if max_len < 3:
+            # Không đủ chỗ cho <s>, </s> và một token: giữ nguyên cách xử lý của tokenizer gốc
+            return tokenize_batch(self.tokenizer, texts, max_len)
+        bos, eos = self.tokenizer.bos_token_id, self.tokenizer.eos_token_id
+        limit = max_len - 1
+        word_ids = self.word_ids
+        results = []
+        for text in texts:
+            if self._added_pattern is not None and self._added_pattern.search(text):
+                results.append(tokenize_batch(self.tokenizer, [text], max_len)[0])
+                self.tokenizer.cache.clear()
+                continue
+            ids = [bos]
+            for word in _WORD_PATTERN.findall(text):
+                ids.extend(word_ids(word))
+                # Câu dài: các từ phía sau đằng nào cũng bị cắt
+                if len(ids) >= limit:
+                    break
+            del ids[limit:]
+            ids.append(eos)
+            results.append(ids)
+        return results
+
+    def clear_cache(self):
+        self.word_ids.cache_clear()
+
+    def __call__(self, *args, **kwargs):
+        return self.tokenizer(*args, **kwargs)
+
+    def __len__(self):
+        return len(self.tokenizer)
+
+    def __getattr__(self, name):
+        # Chỉ được gọi khi thuộc tính không có trên wrapper
+        if name == "tokenizer":
+            raise AttributeError(name)
+        return getattr(self.tokenizer, name)
+
+
+def wrap_tokenizer(tokenizer, cache_size: int = PHOBERT_WORD_CACHE_SIZE):
+    """
+    Bọc tokenizer PhoBERT slow bằng CachedPhobertTokenizer; tokenizer khác hoặc cache_size = 0
+    thì trả về nguyên tokenizer.
+    """
+    if cache_size and hasattr(tokenizer, "bpe") and hasattr(tokenizer, "cache"):
+        return CachedPhobertTokenizer(tokenizer, cache_size)
+    return tokenizer
+
+# =========================== Shared Tokenization Config ===========================
+def tokenize_batch(tokenizer, texts: list, max_len: int = MAX_TOKEN_LENGTH) -> list:
+    """
+    Mã hóa danh sách văn bản thành token ID (có <s>, </s>, cắt bớt theo max_len), chưa padding.
+    Dùng chung cho training và suy luận để hai bên có cùng cấu hình cắt câu.
+    """
+    if isinstance(tokenizer, CachedPhobertTokenizer):
+        return tokenizer.encode_ids(texts, max_len)
+    encoded = tokenizer(
+        list(texts),
+        add_special_tokens=True,     # Thêm token [CLS], [SEP]
+        max_length=max_len,          # Giới hạn độ dài tối đa
+        truncation=True,             # Cắt bớt nếu vượt quá max_len
+        padding=False,               # Padding sau, theo từng batch
+        return_attention_mask=False,
+    )
+    return encoded["input_ids"]
+
+def pad_batch(input_ids: list, pad_token_id: int) -> dict:
+    """
+    Padding một batch token ID đến câu dài nhất trong batch.
+
+    Returns:
+        dict: 'input_ids' và 'attention_mask' dạng tensor (batch, độ dài câu dài nhất).
+    """
+    lengths = np.fromiter((len(ids) for ids in input_ids), dtype=np.int64, count=len(input_ids))
+    ids = np.full((len(input_ids), int(lengths.max())), pad_token_id, dtype=np.int64)
+    mask = np.arange(ids.shape[1])[None, :] < lengths[:, None]
+    ids[mask] = np.concatenate([np.asarray(seq, dtype=np.int64) for seq in input_ids])
+    return {
+        "input_ids": torch.from_numpy(ids),
+        "attention_mask": torch.from_numpy(mask.astype(np.int64)),
+    }
+
+def encode_batch(tokenizer, texts: list, max_len: int = MAX_TOKEN_LENGTH) -> dict:
+    # Tokenize và padding động cho một batch
+    return pad_batch(tokenize_batch(tokenizer, texts, max_len), tokenizer.pad_token_id)
+
+# =========================== Length Bucketing ===========================
+def length_bucketed_batches(lengths, batch_size: int) -> list:
+    """
+    Nhóm chỉ số theo độ dài token: sắp xếp theo độ dài rồi chia thành batch,
+    để mỗi batch chỉ phải padding tới câu dài nhất trong nhóm các câu có độ dài gần nhau.
+
+    Returns:
+        list: Danh sách mảng chỉ số (theo thứ tự gốc của dữ liệu).
+    """
+    order = np.argsort(np.asarray(lengths), kind="stable")
+    return [order[start:start + batch_size] for start in range(0, len(order), batch_size)]
+
+class LengthBucketSampler(Sampler):
+    """
+    batch_sampler cho DataLoader, trả về các batch chỉ số đã nhóm theo độ dài token.
+    """
+
+    def __init__(self, lengths, batch_size: int):
+        self.batches = length_bucketed_batches(lengths, batch_size)
+
+    def __iter__(self):
+        for batch in self.batches:
+            yield batch.tolist()
+
+    def __len__(self):
+        return len(self.batches)
+
+# =========================== Parity Check ===========================
+def synthetic_corpus(texts: list, size: int = 5000, seed: int = 0, max_len: int = MAX_TOKEN_LENGTH) -> list:
+    """
+    Sinh câu thử cho kiểm tra parity từ từ vựng của texts: ghép từ ngẫu nhiên, từ lạ (chữ có dấu,
+    số, dấu câu, emoji), khoảng trắng/tab/xuống dòng liên tiếp, câu dài hơn max_len, câu rỗng
+    và câu chứa chuỗi của token đặc biệt.
+    """
+    rng = random.Random(seed)
+    words = sorted({word for text in texts for word in text.split()}) or ["từ"]
+    alphabet = "aăâbcdđeêghiklmnoôơpqrstuưvxyáàảãạắằẳẵặấầẩẫậéèẻẽẹếềểễệíìỉĩịóòỏõọốồổỗộớờởỡợúùủũụứừửữựýỳỷỹỵ"
+    alphabet += alphabet.upper() + "0123456789_.,!?;:'\"()-/%@#&*+=<>[]{}~😀😡👍🔥"
+    separators = [" "] * 20 + ["  ", "\t", "\n", " \n ", " "]
+    specials = ["<s>", "</s>", "<pad>", "<unk>", "<mask>"]
+
+    def noise_word():
+        return "".join(rng.choice(alphabet) for _ in range(rng.randint(1, 12)))
+
+    corpus = ["", " ", "\n", "  ".join(words[:max_len * 2])]
+    while len(corpus) < size:
+        n_words = rng.choice([1, 2, 5, 10, 20, 40, max_len + rng.randint(1, 50)])
+        parts = []
+        for _ in range(n_words):
+            roll = rng.random()
+            if roll < 0.7:
+                word = rng.choice(words)
+            elif roll < 0.8:
+                # Ghép/cắt từ có sẵn để tạo từ chưa gặp
+                word = rng.choice(words)[: rng.randint(1, 6)] + rng.choice(words)[rng.randint(0, 3):]
+            else:
+                word = noise_word()
+            parts.append(word)
+            parts.append(rng.choice(separators))
+        # Một phần nhỏ câu chứa token đặc biệt (đi qua tokenizer gốc)
+        if rng.random() < 0.05:
+            parts.insert(rng.randrange(len(parts) + 1), rng.choice(specials))
+        text = "".join(parts)
+        corpus.append(text if rng.random() < 0.8 else rng.choice(separators) + text)
+    return corpus
+
+
+def check_tokenizer_parity(csv_path: str = "data_sentiment_vn.csv", synthetic_size: int = 5000,
+                           max_len: int = MAX_TOKEN_LENGTH, model_name: str = None) -> dict:
+    """
+    So sánh token ID của CachedPhobertTokenizer với tokenizer gốc trên file CSV (đã tiền xử lý
+    như khi suy luận) và trên tập câu tổng hợp, kèm thời gian của từng đường.
+
+    Returns:
+        dict: Với mỗi tập: số câu, số câu lệch, thời gian tokenizer gốc, đường nhanh khi cache
+              còn trống (cold) và khi cache đã có từ (warm).
+    """
+    import pandas as pd
+
+    from constant import MODEL_NAME
+    from model_backends import load_tokenizer
+    from preprocessing import preprocess_batch
+
+    slow = load_tokenizer(model_name or MODEL_NAME, cached=False)
+    fast = CachedPhobertTokenizer(load_tokenizer(model_name or MODEL_NAME, cached=False))
+    texts, _ = preprocess_batch(pd.read_csv(csv_path)["text"].astype(str).tolist(), workers=1)
+
+    report = {}
+    for name, corpus in (("csv", texts), ("synthetic", synthetic_corpus(texts, synthetic_size, max_len=max_len))):
+        fast.clear_cache()
+        slow.cache.clear()
+        start = time.perf_counter()
+        expected = tokenize_batch(slow, corpus, max_len)
+        slow_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        got = fast.encode_ids(corpus, max_len)
+        cold_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        fast.encode_ids(corpus, max_len)
+        warm_seconds = time.perf_counter() - start
+        report[name] = {
+            "samples": len(corpus),
+            "mismatches": sum(a != b for a, b in zip(expected, got)),
+            "slow_seconds": slow_seconds,
+            "cold_seconds": cold_seconds,
+            "warm_seconds": warm_seconds,
+            "speedup": slow_seconds / warm_seconds,
+        }
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Check that the cached PhoBERT tokenizer matches the slow tokenizer.")
+    parser.add_argument("--csv", default="data_sentiment_vn.csv")
+    parser.add_argument("--synthetic-size", type=int, default=5000)
+    parser.add_argument("--max-len", type=int, default=MAX_TOKEN_LENGTH)
+    args = parser.parse_args()
+
+    report = check_tokenizer_parity(args.csv, args.synthetic_size, args.max_len)
+    for name, row in report.items():
+        print(f"> {name}: {row['samples']} texts, {row['mismatches']} mismatches, slow {row['slow_seconds'] * 1000:.1f} ms, "
+              f"cached cold {row['cold_seconds'] * 1000:.1f} ms / warm {row['warm_seconds'] * 1000:.1f} ms "
+              f"({row['speedup']:.1f}x)")
+    if any(row["mismatches"] for row in report.values()):
+        raise SystemExit(1)
@@ -1,3 +1,4 @@
+import argparse
 import time
 import numpy as np
 import pandas as pd
@@ -9,26 +10,36 @@ from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, accuracy_score
 import joblib
 
-from preprocessing import correct_slang_words, standardize_text, tokenize_text
+from constant import MAX_TOKEN_LENGTH, MODEL_NAME
+from embedding_cache import EmbeddingCache
+from linear_head import export_head
+from model_backends import resolve_model_path
+from model_registry import publish_head
+from preprocessing import preprocess_batch
+from tokenization import LengthBucketSampler, pad_batch, tokenize_batch, wrap_tokenizer
 
 # =========================== Main Training Script ===========================
 def main():
+    parser = argparse.ArgumentParser(description="Train the SVM classifier on PhoBERT [CLS] embeddings.")
+    parser.add_argument("--embedding-dtype", choices=["float32", "float16"], default="float32",
+                        help="Storage dtype of the on-disk embedding cache (default: float32)")
+    parser.add_argument("--no-embedding-cache", action="store_true", help="Always re-encode every text")
+    parser.add_argument("--publish", action="store_true",
+                        help="Also publish the head (with test metrics) to the model registry and activate it")
+    args = parser.parse_args()
+
     start_time = time.time()
 
     print("> Loading dataset...")
     # 1. Load dataset CSV (cột: text, label 0/1/2)
     df = pd.read_csv("data_sentiment_vn.csv")  # label: 0=negative,1=neutral,2=positive
-    df['text'] = df['text'].apply(lambda x: tokenize_text(correct_slang_words(standardize_text(x))))
+    df['text'], _ = preprocess_batch(df['text'].tolist())
     texts = df['text'].tolist()
     labels = df['label'].tolist()
     
-    # 2. Load PhoBERT
-    print("> Loading PhoBERT model...")
-    model, tokenizer = load_phobert_model()
-    
-    # 3. Extract features
+    # 2-3. Extract features (đọc lại embedding đã tính từ cache memmap, chỉ tải PhoBERT và encode câu mới/đã đổi)
     print("> Extracting features from PhoBERT embeddings...")
-    features = extract_features(model, tokenizer, texts, max_len=150, batch_size=32, device='cpu')
+    features = load_features(texts, args.embedding_dtype, use_cache=not args.no_embedding_cache)
     
     # 4. Train/Test split
     X_train, X_test, y_train, y_test = train_test_split(features, labels, test_size=0.2, random_state=42, stratify=labels)
@@ -46,62 +57,95 @@ def main():
     # 7. Save classifier
     joblib.dump(clf, "svm_phobert_sentiment.pkl")
     print("> Saved classifier to svm_phobert_sentiment.pkl")
+    head = export_head("svm_phobert_sentiment.pkl", "svm_phobert_head.npz")
+    print("> Exported linear head to svm_phobert_head.npz")
+
+    # 8. Publish lên model registry: app/service đang chạy tự đổi sang head mới
+    if args.publish:
+        metrics = {
+            "accuracy": accuracy_score(y_test, y_pred),
+            "report": classification_report(y_test, y_pred, output_dict=True),
+            "train_size": len(y_train),
+            "test_size": len(y_test),
+        }
+        publish_head(head, metrics)
 
     end_time = time.time()
     print(f"> Training SVM completed in {end_time - start_time:.2f} seconds.")
 
-if __name__ == "__main__":
-    main()
-
 # =========================== Dataset ===========================
 class SentimentDataset(Dataset):
-    def __init__(self, texts, labels, tokenizer, max_len=100):
+    def __init__(self, texts, labels, tokenizer, max_len=MAX_TOKEN_LENGTH):
         self.texts = texts
         self.labels = labels
         self.tokenizer = tokenizer
         self.max_len = max_len
+        # Tokenize trước toàn bộ (chưa padding) để biết độ dài từng câu
+        self.input_ids = tokenize_batch(tokenizer, texts, max_len)
+        self.lengths = [len(ids) for ids in self.input_ids]
         
     def __len__(self):
         return len(self.texts)
     
     def __getitem__(self, idx):
-        text = self.texts[idx]
-        label = self.labels[idx]
-        encoded = self.tokenizer.encode_plus(
-            text,
-            add_special_tokens=True,
-            max_length=self.max_len,
-            padding='max_length',
-            truncation=True,
-            return_attention_mask=True,
-            return_tensors='pt'
-        )
-        input_ids = encoded['input_ids'].squeeze(0)
-        attention_mask = encoded['attention_mask'].squeeze(0)
-        return {"input_ids": input_ids, "attention_mask": attention_mask, "label": label}
+        return {"input_ids": self.input_ids[idx], "label": self.labels[idx], "index": idx}
+
+    def collate(self, items):
+        # Padding động: chỉ đến câu dài nhất trong batch
+        batch = pad_batch([item["input_ids"] for item in items], self.tokenizer.pad_token_id)
+        batch["label"] = torch.tensor([item["label"] for item in items])
+        batch["index"] = torch.tensor([item["index"] for item in items])
+        return batch
 
 # =========================== Load PhoBERT ===========================
-def load_phobert_model(model_name="vinai/phobert-base-v2"):
-    model = AutoModel.from_pretrained(model_name)
-    tokenizer = AutoTokenizer.from_pretrained(model_name, use_fast=False)
+def load_phobert_model(model_name=MODEL_NAME):
+    # Ưu tiên bản model cục bộ (MODEL_SNAPSHOT_DIR / cache Hugging Face) giống lúc suy luận
+    model_path = resolve_model_path(model_name)
+    model = AutoModel.from_pretrained(model_path)
+    tokenizer = wrap_tokenizer(AutoTokenizer.from_pretrained(model_path, use_fast=False))
     return model, tokenizer
 
 # =========================== Feature Extraction ===========================
-def extract_features(model, tokenizer, texts, max_len=100, batch_size=16, device='cpu'):
+def extract_features(model, tokenizer, texts, max_len=MAX_TOKEN_LENGTH, batch_size=16, device='cpu', layers=None):
+    # layers: danh sách chỉ số layer (1..num_hidden_layers); khi có, trả về dict {layer: [CLS] của layer đó}
     dataset = SentimentDataset(texts=texts, labels=[0]*len(texts), tokenizer=tokenizer, max_len=max_len)
-    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False)
+    # Gom các câu có độ dài gần nhau vào cùng batch để giảm token padding
+    loader = DataLoader(dataset, batch_sampler=LengthBucketSampler(dataset.lengths, batch_size), collate_fn=dataset.collate)
     
     model = model.to(device)
     model.eval()
     
-    features = []
+    wanted = list(layers) if layers is not None else [model.config.num_hidden_layers]
+    features = {layer: np.empty((len(texts), model.config.hidden_size), dtype=np.float32) for layer in wanted}
     with torch.no_grad():
         for batch in loader:
             input_ids = batch['input_ids'].to(device)
             attention_mask = batch['attention_mask'].to(device)
-            outputs = model(input_ids=input_ids, attention_mask=attention_mask)
-            cls_embeddings = outputs[0][:, 0, :].cpu().numpy()
-            features.append(cls_embeddings)
-    features = np.vstack(features)
-    return features
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask, output_hidden_states=layers is not None)
+            for layer in wanted:
+                # hidden_states[0] là output của lớp embedding, hidden_states[i] là output của layer thứ i
+                hidden = outputs.hidden_states[layer] if layers is not None else outputs[0]
+                cls_embeddings = hidden[:, 0, :].cpu().numpy()
+                # Đặt embedding về đúng thứ tự ban đầu của texts
+                features[layer][batch['index'].numpy()] = cls_embeddings
+    return features if layers is not None else features[wanted[0]]
+
+def load_features(texts: list, embedding_dtype: str = "float32", use_cache: bool = True) -> np.ndarray:
+    """
+    Embedding [CLS] của các câu đã tiền xử lý, đọc từ EmbeddingCache nếu đã có;
+    PhoBERT chỉ được tải khi thực sự có câu cần encode.
+    """
+    phobert = {}
+    def encode(texts_to_encode):
+        if not phobert:
+            print("> Loading PhoBERT model...")
+            phobert["model"], phobert["tokenizer"] = load_phobert_model()
+        return extract_features(phobert["model"], phobert["tokenizer"], texts_to_encode, max_len=MAX_TOKEN_LENGTH, batch_size=32, device='cpu')
+
+    if not use_cache:
+        return encode(texts)
+    cache = EmbeddingCache(MODEL_NAME, max_len=MAX_TOKEN_LENGTH, dtype=embedding_dtype)
+    return cache.get_or_compute(texts, encode)
 
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,9 @@
+import pandas as pd
 import streamlit as st
 
+# Màu của từng nhãn trên biểu đồ thống kê
+SENTIMENT_COLORS = {"NEGATIVE": "#e74c3c", "NEUTRAL": "#f1c40f", "POSITIVE": "#2ecc71"}
+
 def show_sentiment_result(label: str, score: float):
     st.markdown("### Kết quả phân tích")
     match label:
@@ -10,7 +14,14 @@ def show_sentiment_result(label: str, score: float):
         case "NEUTRAL":
             return st.warning(f"Trung tính - {score}%", icon="😐")
 
-def show_pipeline_steps(original_text, corrected_text, tokenized_text, sentiment, result):
+def show_stage_timing(timings: dict, *stages):
+    # Hiển thị thời gian (ms) của các bước tương ứng, bỏ qua nếu không có số liệu
+    parts = [f"{stage} {timings[stage]:.2f} ms" for stage in stages if stage in timings]
+    if parts:
+        st.caption("⏱ " + " · ".join(parts))
+
+def show_pipeline_steps(original_text, corrected_text, tokenized_text, sentiment, result, timings=None):
+    timings = timings or {}
     with st.expander("Xem chi tiết luồng xử lý", expanded=True):
         st.markdown("##### 1. Câu ban đầu")
         st.code(original_text)
@@ -20,12 +31,40 @@ def show_pipeline_steps(original_text, corrected_text, tokenized_text, sentiment
         with col1:
             st.markdown("###### Chuẩn hóa")
             st.code(corrected_text)
+            show_stage_timing(timings, "standardize_text", "correct_slang_words")
         with col2:
             st.markdown("###### Tách từ")
             st.code(tokenized_text)
+            show_stage_timing(timings, "tokenize_text")
 
         st.markdown("##### 3. Phân loại cảm xúc")
         st.code(sentiment)
+        show_stage_timing(timings, "classify")
         
         st.markdown("##### 4. Hợp nhất kết quả")
-        st.json(result)
\ No newline at end of file
+        st.json(result)
+        show_stage_timing(timings, "save_to_sqlite", "total")
+
+def show_similar_comments(similar: list, reused_from: int = None, timings: dict = None):
+    # Các bình luận cũ gần nhất theo embedding [CLS] (cosine similarity)
+    st.markdown("#### Bình luận tương tự")
+    if reused_from is not None:
+        st.caption(f"Nhãn được lấy từ bình luận #{reused_from} (đủ giống, không dùng kết quả của mô hình)")
+    if not similar:
+        st.info("Chưa có bình luận tương tự trong lịch sử!")
+    else:
+        st.dataframe(
+            pd.DataFrame(similar, columns=["similarity", "text", "sentiment", "timestamp"]),
+            hide_index=True,
+            column_config={"similarity": st.column_config.ProgressColumn("Độ tương đồng", min_value=0.0, max_value=1.0, format="%.3f")},
+        )
+    show_stage_timing(timings or {}, "similar_search")
+
+def show_sentiment_trend(df_rollup: pd.DataFrame):
+    # Biểu đồ số câu của từng nhãn theo bucket thời gian, dữ liệu lấy từ bảng rollup
+    if df_rollup.empty:
+        st.info("Chưa có dữ liệu thống kê trong khoảng thời gian này!")
+        return
+    chart = df_rollup.pivot_table(index="bucket", columns="sentiment", values="row_count", aggfunc="sum", fill_value=0)
+    chart.index = pd.to_datetime(chart.index)
+    st.bar_chart(chart, color=[SENTIMENT_COLORS.get(label, "#95a5a6") for label in chart.columns], stack=True)